@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 import os
 
-from decouple import config
+from decouple import config, Csv
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -24,10 +24,22 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = config('SECRET_KEY')
 
+# Settings profile: dev keeps debugging aids, bench and prod turn the
+# fast defaults on together (DEBUG off, persistent database connections,
+# a cache shared by all workers, JSON-only renderer). List responses stay
+# unpaginated in every profile, clients rely on receiving all rows.
+# Individual settings can still be overridden from the environment.
+SETTINGS_PROFILE = config('SETTINGS_PROFILE', default='dev')
+FAST_DEFAULTS = SETTINGS_PROFILE in ('bench', 'prod')
+
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = config('DEBUG', default=not FAST_DEFAULTS, cast=bool)
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = config(
+    'ALLOWED_HOSTS',
+    default='localhost,127.0.0.1' if FAST_DEFAULTS else '',
+    cast=Csv(),
+)
 
 
 # Application definition
@@ -50,6 +62,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -92,9 +105,115 @@ DATABASES = {
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
         'PASSWORD': os.environ.get('DB_PASS'),
+        'CONN_MAX_AGE': config(
+            'CONN_MAX_AGE', default=60 if FAST_DEFAULTS else 0, cast=int
+        ),
     }
 }
 
+# Per-user data (tags, ingredients, recipes) can be spread over several
+# databases. Users and auth tokens always stay in the global database.
+# Each shard is configured with DB_<ALIAS>_HOST / DB_<ALIAS>_NAME variables.
+
+DATABASE_SHARDS = config('DATABASE_SHARDS', default='', cast=Csv())
+SHARD_GLOBAL_DATABASE = 'default'
+
+for shard in DATABASE_SHARDS:
+    DATABASES.setdefault(shard, {
+        **DATABASES['default'],
+        'HOST': os.environ.get(f'DB_{shard.upper()}_HOST',
+                               DATABASES['default']['HOST']),
+        'NAME': os.environ.get(f'DB_{shard.upper()}_NAME', shard),
+    })
+
+DATABASE_ROUTERS = ['core.routers.UserShardRouter']
+
+if FAST_DEFAULTS:
+    # shared by the workers of a host, so version bumps reach all of them
+    CACHES = {
+        'default': {
+            'BACKEND': 'core.shmcache.SharedMemoryCache',
+            'LOCATION': config('CACHE_LOCATION',
+                               default='/vol/web/cache/django.shm'),
+            'OPTIONS': {
+                'SIZE': config('CACHE_SIZE', default=64 * 1024 * 1024,
+                               cast=int),
+            },
+        }
+    }
+
+REST_FRAMEWORK = {}
+if FAST_DEFAULTS:
+    REST_FRAMEWORK.update({
+        'DEFAULT_RENDERER_CLASSES': [
+            'rest_framework.renderers.JSONRenderer',
+        ],
+    })
+
+# /api/recipe/sync/ sends at most SYNC_PAGE_SIZE changes of each kind per
+# call. Tombstones of deleted rows are kept for SYNC_TOMBSTONE_RETENTION,
+# older sync tokens are refused and clients download everything again.
+SYNC_PAGE_SIZE = 500
+SYNC_TOMBSTONE_RETENTION = 30 * 24 * 60 * 60
+
+# Tag and ingredient autocomplete returns AUTOCOMPLETE_LIMIT names unless
+# asked for more, up to AUTOCOMPLETE_MAX_LIMIT
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 50
+
+# Ingredients are linked to a global catalog of normalized names shared by
+# all users, existing ones by the backfill_ingredient_catalog command
+INGREDIENT_CATALOG_ENABLED = True
+
+# Serialized recipes are cached per change of the recipe and assembled
+# into list and detail responses
+FRAGMENT_CACHE_ENABLED = True
+FRAGMENT_CACHE_TIMEOUT = 24 * 60 * 60
+
+# ASGI workers stream each user's changes as server-sent events at
+# EVENTS_PATH, with a comment every EVENTS_HEARTBEAT seconds while idle. A
+# client more than EVENTS_QUEUE_SIZE events behind is told to resync.
+EVENTS_PATH = '/api/recipe/events/'
+EVENTS_HEARTBEAT = 15
+EVENTS_QUEUE_SIZE = 1000
+# EventSource can not send the Authorization header, it connects with a
+# ?ticket= from /api/recipe/events/ticket/ valid for this many seconds
+EVENTS_TICKET_MAX_AGE = 60
+
+# /api/batch/ runs up to BATCH_MAX_REQUESTS sub-requests below these paths,
+# parallel batches run consecutive reads on up to BATCH_MAX_WORKERS threads
+BATCH_PATH_PREFIXES = ['/api/user/me/', '/api/recipe/']
+BATCH_MAX_REQUESTS = 20
+BATCH_MAX_WORKERS = 4
+BATCH_RESPONSE_HEADERS = ('etag', 'last-modified', 'location')
+
+# The shopping list merges the ingredients of up to this many recipes
+SHOPPING_LIST_MAX_RECIPES = 1000
+
+# Number of users whose "what can I cook" index is kept in memory per process
+COOKABLE_INDEX_MAX_USERS = 256
+
+# Deleted accounts are purged by the task queue in batches of this many
+# rows per table
+USER_PURGE_BATCH_SIZE = 1000
+
+# `manage.py serve` workers, 0 sizes them from the CPU count
+SERVE_WORKERS = config('SERVE_WORKERS', default=0, cast=int)
+SERVE_MAX_REQUESTS = 1000
+
+# Database-backed task queue, run with `manage.py run_worker`
+# queue name -> number of jobs a worker runs at once
+TASK_QUEUES = {'default': 4, 'media': 2, 'maintenance': 1}
+TASK_BATCH_SIZE = 10
+TASK_RETRY_DELAY = 10
+TASK_RETRY_MAX_DELAY = 60 * 60
+# workers refresh the locks of their running jobs every
+# TASK_HEARTBEAT_INTERVAL, jobs whose lock is older than TASK_LOCK_TIMEOUT
+# are assumed lost and queued again, or failed after max_attempts
+TASK_HEARTBEAT_INTERVAL = 60
+TASK_LOCK_TIMEOUT = 5 * 60
+TASK_IDLE_TIMEOUT = 30
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -138,6 +257,72 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = '/vol/web/media'
 STATIC_ROOT = '/vol/web/static'
 
+# collectstatic writes .gz and .br siblings which serve_static sends to
+# clients accepting them
+STATICFILES_STORAGE = 'core.compression.CompressedStaticFilesStorage'
+
+# Responses smaller than COMPRESSION_MIN_SIZE bytes are sent as they are,
+# Accept-Encoding ties are broken in the order of COMPRESSION_ENCODINGS
+# (zstd only when the zstandard package is installed)
+COMPRESSION_MIN_SIZE = 512
+COMPRESSION_ENCODINGS = ['zstd', 'br', 'gzip']
+_TEXT_LEVELS = {'zstd': 3, 'br': 4, 'gzip': 6}
+# Compression level per content type and encoding, other content types are
+# not compressed. The event stream is answered before the middleware runs
+# and is never compressed.
+COMPRESSION_LEVELS = {
+    'application/json': _TEXT_LEVELS,
+    'text/html': _TEXT_LEVELS,
+    'text/plain': _TEXT_LEVELS,
+    'text/css': _TEXT_LEVELS,
+    'text/javascript': _TEXT_LEVELS,
+    'application/javascript': _TEXT_LEVELS,
+    'image/svg+xml': _TEXT_LEVELS,
+}
+
+# Uploads are streamed to this directory, on the same volume as MEDIA_ROOT
+# so storing them is a rename rather than a copy
+FILE_UPLOAD_TEMP_DIR = '/vol/web/tmp'
+
+RECIPE_IMAGE_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+RECIPE_IMAGE_MAX_DIMENSION = 8000
+
+# Recipe images are stored under their SHA-256 so identical uploads share
+# one file, unreferenced files are removed by the gc_media command
+DEFAULT_FILE_STORAGE = 'core.imagestore.MediaStorage'
+RECIPE_IMAGE_CONTENT_ADDRESSED = config(
+    'RECIPE_IMAGE_CONTENT_ADDRESSED', default=True, cast=bool
+)
+MEDIA_GC_GRACE_PERIOD = 60 * 60
+
+# Media is authorized by Django and delivered by the front server when
+# MEDIA_SERVE_MODE is x-accel-redirect (nginx, internal location at
+# MEDIA_ACCEL_REDIRECT_PREFIX) or x-sendfile (Apache, lighttpd), and with
+# the WSGI server's sendfile file wrapper otherwise
+MEDIA_SERVE_MODE = config('MEDIA_SERVE_MODE', default='sendfile')
+MEDIA_ACCEL_REDIRECT_PREFIX = config(
+    'MEDIA_ACCEL_REDIRECT_PREFIX', default='/protected-media/'
+)
+MEDIA_SERVE_PREFIXES = ['uploads/']
+# content-addressed files are cached forever, others for this many seconds
+MEDIA_CACHE_MAX_AGE = 24 * 60 * 60
+# elements that can not send the Authorization header, like <img>, load
+# media from signed URLs valid for this many seconds
+MEDIA_SIGNED_URL_MAX_AGE = 5 * 60
+
+# Resized WebP / AVIF / JPEG variants of recipe images, rendered by a pool
+# of IMAGE_VARIANT_WORKERS processes (0 renders in the request thread)
+RECIPE_IMAGE_WIDTHS = [160, 320, 640, 1024, 1600]
+IMAGE_VARIANT_CACHE_DIR = '/vol/web/cache/variants'
+IMAGE_VARIANT_CACHE_SIZE = config(
+    'IMAGE_VARIANT_CACHE_SIZE', default=512 * 1024 * 1024, cast=int
+)
+IMAGE_VARIANT_WORKERS = config('IMAGE_VARIANT_WORKERS', default=2, cast=int)
+IMAGE_VARIANT_TIMEOUT = 30
+IMAGE_VARIANT_QUALITY = {'AVIF': 60, 'WEBP': 80, 'JPEG': 82, 'PNG': None}
+# widths rendered by the task queue right after an upload
+RECIPE_IMAGE_PREWARM_WIDTHS = [320, 640]
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -0,0 +1,142 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connections
+from django.urls import Resolver404, resolve
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+logger = logging.getLogger(__name__)
+
+# request metadata copied from the batch request to its sub-requests
+INHERITED_META = (
+    'SERVER_NAME', 'SERVER_PORT', 'REMOTE_ADDR', 'wsgi.url_scheme',
+)
+
+
+def _sub_request(request, method, path, body):
+    """ Build a request for a sub-request sharing the batch's credentials """
+    url = urlsplit(path)
+    content = json.dumps(body).encode() if body is not None else b''
+    environ = {
+        key: value for key, value in request.META.items()
+        if key.startswith('HTTP_') or key in INHERITED_META
+    }
+    environ.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': url.path,
+        'SCRIPT_NAME': '',
+        'QUERY_STRING': url.query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(content)),
+        'wsgi.input': BytesIO(content),
+    })
+    environ.pop('HTTP_CONTENT_ENCODING', None)
+    sub_request = WSGIRequest(environ)
+    # authenticated once for the whole batch
+    sub_request._force_auth_user = request.user
+    sub_request._force_auth_token = request.auth
+    return sub_request
+
+
+def _body(response):
+    content_type = response.get('Content-Type', '')
+    if not response.content:
+        return None
+    if content_type.startswith('application/json'):
+        return json.loads(response.content)
+    return response.content.decode(response.charset, errors='replace')
+
+
+def run_request(request, item):
+    """ Run one sub-request through the URLconf and describe its response """
+    try:
+        return _dispatch(request, item)
+    except Exception:
+        # one failing sub-request does not fail the rest of the batch
+        logger.exception(
+            'Batch sub-request %s %s failed', item['method'], item['path']
+        )
+        return {'status': 500, 'body': {
+            'detail': 'A server error occurred.'
+        }}
+
+
+def _dispatch(request, item):
+    path = urlsplit(item['path']).path
+    allowed = any(
+        path.startswith(prefix) for prefix in settings.BATCH_PATH_PREFIXES
+    )
+    if not allowed or path.startswith(request.path):
+        return {'status': 400, 'body': {
+            'detail': f'{path} can not be requested in a batch.'
+        }}
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return {'status': 404, 'body': {'detail': 'Not found.'}}
+
+    response = match.func(
+        _sub_request(request, item['method'], item['path'],
+                     item.get('body')),
+        *match.args, **match.kwargs
+    )
+    if hasattr(response, 'render'):
+        response.render()
+    if response.streaming:
+        # close its files without response.close(), which would signal the
+        # end of the batch request and close its database connections
+        for closer in response._resource_closers:
+            closer()
+        return {'status': 400, 'body': {
+            'detail': 'Streaming responses can not be batched.'
+        }}
+    return {
+        'status': response.status_code,
+        'headers': {
+            name: value for name, value in response.items()
+            if name.lower() in settings.BATCH_RESPONSE_HEADERS
+        },
+        'body': _body(response),
+    }
+
+
+def _run_in_thread(request, item):
+    try:
+        return run_request(request, item)
+    finally:
+        # pool threads end with the batch, their connections with them
+        connections.close_all()
+
+
+def run_batch(request, items, parallel=False):
+    """
+    Run sub-requests in order and return their responses.
+
+    With parallel, consecutive safe requests run at the same time, each on
+    its own database connection, while writes run one at a time on the
+    batch's connection and see everything requested before them.
+    """
+    results = []
+    start = 0
+    while start < len(items):
+        end = start + 1
+        if parallel and items[start]['method'] in SAFE_METHODS:
+            while end < len(items) and items[end]['method'] in SAFE_METHODS:
+                end += 1
+        group = items[start:end]
+        if len(group) == 1:
+            results.append(run_request(request, group[0]))
+        else:
+            workers = min(len(group), settings.BATCH_MAX_WORKERS)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results.extend(executor.map(
+                    lambda item: _run_in_thread(request, item), group
+                ))
+        start = end
+    return results
@@ -0,0 +1,106 @@
+from collections import Counter
+from functools import partial
+
+from django.db import connections, transaction
+
+from . import cookable, imagestore, similarity, stats
+from .models import Recipe, RecipeSummary
+
+# recipe fields that can be set on many recipes at once
+BULK_FIELDS = ('title', 'time_minutes', 'price', 'link')
+
+
+def _deltas(values, sign=-1):
+    return [(value, sign * n) for value, n in Counter(values).items()]
+
+
+def update_recipes(queryset, user_id, values, using='default'):
+    """
+    Set the same field values on every recipe of the queryset with a
+    single UPDATE and return the number of updated recipes.
+    """
+    with transaction.atomic(using=using):
+        if 'price' not in values and 'time_minutes' not in values:
+            return queryset.update(**values)
+
+        # lock the rows so the statistics see exactly the values replaced
+        old = list(queryset.select_for_update(of=('self',)).values_list(
+            'price', 'time_minutes'
+        ).order_by())
+        updated = queryset.update(**values)
+
+        price_deltas = time_deltas = ()
+        if 'price' in values:
+            price_deltas = _deltas(price for price, _ in old)
+            price_deltas.append((values['price'], len(old)))
+        if 'time_minutes' in values:
+            time_deltas = _deltas(minutes for _, minutes in old)
+            time_deltas.append((values['time_minutes'], len(old)))
+        stats.update_stats(
+            user_id,
+            using=using,
+            price_deltas=price_deltas,
+            time_deltas=time_deltas,
+        )
+    return updated
+
+
+def delete_recipes(queryset, user_id, using='default'):
+    """
+    Delete every recipe of the queryset with one DELETE per table instead
+    of the collector, keeping derived data in step, and return the number
+    of deleted recipes.
+    """
+    connection = connections[using]
+    with transaction.atomic(using=using):
+        rows = list(queryset.select_for_update(of=('self',)).values_list(
+            'id', 'price', 'time_minutes', 'image',
+            'summary__tag_ids', 'summary__ingredient_ids',
+        ).order_by())
+        if not rows:
+            return 0
+
+        recipe_ids = [row[0] for row in rows]
+        tables = [
+            (Recipe.tags.through, 'recipe_id'),
+            (Recipe.ingredients.through, 'recipe_id'),
+            (RecipeSummary, 'recipe_id'),
+            (Recipe, 'id'),
+        ]
+        with connection.cursor() as cursor:
+            for model, column in tables:
+                table = connection.ops.quote_name(model._meta.db_table)
+                cursor.execute(
+                    f'DELETE FROM {table} WHERE {column} = ANY(%s)',
+                    [recipe_ids],
+                )
+
+        stats.update_stats(
+            user_id,
+            using=using,
+            recipe_delta=-len(rows),
+            price_deltas=_deltas(row[1] for row in rows),
+            time_deltas=_deltas(row[2] for row in rows),
+            tag_deltas=_deltas(pk for row in rows for pk in row[4] or ()),
+            ingredient_deltas=_deltas(
+                pk for row in rows for pk in row[5] or ()
+            ),
+        )
+        images = Counter(row[3] for row in rows if row[3])
+        transaction.on_commit(
+            partial(_publish_deletion, user_id, recipe_ids, images),
+            using=using,
+        )
+    return len(rows)
+
+
+def _discard_recipes(recipe_ids, index):
+    for recipe_id in recipe_ids:
+        index.discard_recipe(recipe_id)
+
+
+def _publish_deletion(user_id, recipe_ids, images):
+    similarity.invalidate(user_id)
+    cookable.apply_change(user_id, partial(_discard_recipes, recipe_ids))
+    for name, count in images.items():
+        imagestore.remove_reference(name, count=count)
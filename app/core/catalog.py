@@ -0,0 +1,114 @@
+import unicodedata
+from functools import partial
+
+from django.db import connections, transaction
+
+from . import similarity, sync
+from .lru import LRUCache
+from .models import CanonicalIngredient, Ingredient
+from .sharding import global_database
+
+# catalog ids of recently seen normalized names, catalog rows never change
+_ids = LRUCache(maxsize=4096)
+
+
+def normalize_name(name):
+    """
+    Return the catalog form of an ingredient name: compatibility characters
+    composed (NFKC), case folded and whitespace collapsed
+    """
+    name = unicodedata.normalize('NFKC', name).casefold()
+    return ' '.join(name.split())
+
+
+def _lookup(cursor, table, names):
+    cursor.execute(
+        f'SELECT name, id FROM "{table}" WHERE name = ANY(%s)', [names]
+    )
+    return dict(cursor.fetchall())
+
+
+def canonical_ids(names):
+    """
+    Return {name: catalog id} of the given ingredient names, adding the
+    normalized names missing from the catalog. Names that normalize to
+    nothing are left out.
+    """
+    normalized = {name: normalize_name(name) for name in names}
+    ids = {}
+    for form in set(normalized.values()) - {''}:
+        pk = _ids.get(form)
+        if pk is not None:
+            ids[form] = pk
+
+    missing = sorted(set(normalized.values()) - {''} - set(ids))
+    if missing:
+        using = global_database()
+        table = CanonicalIngredient._meta.db_table
+        with connections[using].cursor() as cursor:
+            found = _lookup(cursor, table, missing)
+            new = [form for form in missing if form not in found]
+            if new:
+                # sorted, so concurrent inserts of the same names take the
+                # unique index locks in one order
+                cursor.execute(
+                    f'INSERT INTO "{table}" (name) '
+                    f'SELECT unnest(%s::text[]) ON CONFLICT (name) DO NOTHING',
+                    [new],
+                )
+                found.update(_lookup(cursor, table, new))
+        ids.update(found)
+        # remembered once committed, the rows of a rolled back insert are gone
+        transaction.on_commit(partial(_remember, found), using=using)
+
+    return {
+        name: ids[form] for name, form in normalized.items() if form in ids
+    }
+
+
+def canonical_id(name):
+    """ Return the catalog id of an ingredient name, or None """
+    return canonical_ids([name]).get(name)
+
+
+def _remember(ids):
+    for form, pk in ids.items():
+        _ids.set(form, pk)
+
+
+def backfill(using, batch_size=1000):
+    """
+    Link the ingredients of a data database that have no catalog entry, in
+    batches of their ids. Returns the number of ingredients linked.
+    """
+    table = Ingredient._meta.db_table
+    linked, last_id = 0, 0
+    while True:
+        rows = list(Ingredient.objects.using(using).filter(
+            id__gt=last_id, canonical_id__isnull=True,
+        ).order_by('id').values_list('id', 'user_id', 'name')[:batch_size])
+        if not rows:
+            return linked
+        last_id = rows[-1][0]
+
+        ids = canonical_ids({name for _, _, name in rows})
+        pairs = [(pk, ids[name]) for pk, _, name in rows if name in ids]
+        with transaction.atomic(using=using):
+            # a column clients do not see, keep the change numbers
+            sync.skip_change_tracking(using)
+            with connections[using].cursor() as cursor:
+                cursor.execute(
+                    f'UPDATE "{table}" SET canonical_id = v.canonical_id '
+                    f'FROM (SELECT unnest(%s::bigint[]) AS id, '
+                    f'unnest(%s::bigint[]) AS canonical_id) v '
+                    f'WHERE "{table}".id = v.id '
+                    f'AND "{table}".canonical_id IS NULL',
+                    [[pk for pk, _ in pairs], [cid for _, cid in pairs]],
+                )
+                linked += cursor.rowcount
+        for user_id in {user_id for _, user_id, _ in rows}:
+            similarity.invalidate(user_id)
+
+
+def clear_cache():
+    _ids.clear()
@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+MEDIA_SERVE_MODES = ('sendfile', 'x-accel-redirect', 'x-sendfile')
+
+
+def performance_issues():
+    """ Return warnings for settings that slow down or bloat workers """
+    issues = []
+    if settings.DEBUG:
+        issues.append(Warning(
+            'DEBUG is on, every SQL query is kept in connection.queries '
+            'and worker memory grows without bound.',
+            hint='Set SETTINGS_PROFILE=prod or DEBUG=False.',
+            id='core.W001',
+        ))
+
+    for alias, database in settings.DATABASES.items():
+        if not database.get('CONN_MAX_AGE'):
+            issues.append(Warning(
+                f'Database {alias!r} has no CONN_MAX_AGE, a new connection '
+                'is opened for every request.',
+                hint='Set CONN_MAX_AGE, the prod profile uses 60 seconds.',
+                id='core.W002',
+            ))
+
+    backend = settings.CACHES['default']['BACKEND']
+    if backend in PROCESS_LOCAL_CACHES:
+        issues.append(Warning(
+            f'The default cache {backend} is local to one process, cached '
+            'data and index versions are not shared between workers.',
+            hint='Use core.shmcache.SharedMemoryCache, as the prod profile '
+                 'does.',
+            id='core.W003',
+        ))
+    return issues
+
+
+@register(Tags.caches, deploy=True)
+def check_deploy_performance(app_configs, **kwargs):
+    """ Report performance-harmful settings with `check --deploy` """
+    # fast profiles already report them on every startup
+    if settings.FAST_DEFAULTS:
+        return []
+    return performance_issues()
+
+
+@register()
+def check_profile_performance(app_configs, **kwargs):
+    """ Report performance-harmful settings on startup of fast profiles """
+    if not settings.FAST_DEFAULTS:
+        return []
+    return performance_issues()
+
+
+@register()
+def check_media_serve_mode(app_configs, **kwargs):
+    if settings.MEDIA_SERVE_MODE not in MEDIA_SERVE_MODES:
+        return [Error(
+            f'Unknown MEDIA_SERVE_MODE {settings.MEDIA_SERVE_MODE!r}.',
+            hint=f'Use one of {", ".join(MEDIA_SERVE_MODES)}.',
+            id='core.E001',
+        )]
+    return []
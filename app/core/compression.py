@@ -0,0 +1,201 @@
+import mimetypes
+import os
+import zlib
+from functools import partial
+
+import brotli
+from django.conf import settings
+from django.contrib.staticfiles.storage import StaticFilesStorage
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# file suffix of the precompressed siblings written by collectstatic
+SUFFIXES = {'gzip': '.gz', 'br': '.br'}
+
+# levels used for static files, compressed once at deploy time
+STATIC_LEVELS = {'gzip': 9, 'br': 11}
+
+
+def _gzip(level):
+    stream = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return (
+        stream.compress, partial(stream.flush, zlib.Z_SYNC_FLUSH), stream.flush
+    )
+
+
+def _brotli(level):
+    stream = brotli.Compressor(quality=level)
+    return stream.process, stream.flush, stream.finish
+
+
+def _zstd(level):
+    stream = zstandard.ZstdCompressor(level=level).compressobj()
+    return (
+        stream.compress,
+        partial(stream.flush, zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+        stream.flush,
+    )
+
+
+# encoding: factory of (compress, flush, finish) for a compression level
+ENCODERS = {'gzip': _gzip, 'br': _brotli}
+if zstandard is not None:
+    ENCODERS['zstd'] = _zstd
+
+
+def accepted_encodings(header):
+    """ Return the codings of an Accept-Encoding header with their quality """
+    accepted = {}
+    for part in (header or '').split(','):
+        coding, *params = [value.strip() for value in part.split(';')]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding.lower()] = quality
+    return accepted
+
+
+def negotiate_encoding(header, available):
+    """
+    Return the available encoding the client prefers, ties broken by the
+    order of COMPRESSION_ENCODINGS, or None to send the identity
+    """
+    accepted = accepted_encodings(header)
+    preference = [
+        encoding for encoding in settings.COMPRESSION_ENCODINGS
+        if encoding in available
+    ]
+    best, best_quality = None, 0.0
+    for encoding in preference:
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compression_levels(content_type):
+    """ Return {encoding: level} for a content type, empty to not compress """
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    return {
+        encoding: level
+        for encoding, level in settings.COMPRESSION_LEVELS.get(
+            media_type, {}
+        ).items()
+        if encoding in ENCODERS
+    }
+
+
+def compress(data, encoding, level):
+    compress_chunk, _, finish = ENCODERS[encoding](level)
+    return compress_chunk(data) + finish()
+
+
+def compress_stream(chunks, encoding, level):
+    """ Compress an iterable of chunks, flushing after every chunk """
+    compress_chunk, flush, finish = ENCODERS[encoding](level)
+    for chunk in chunks:
+        # flushing keeps streamed rows from waiting for the compressor's
+        # buffer to fill
+        data = compress_chunk(chunk) + flush()
+        if data:
+            yield data
+    yield finish()
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compress responses with the best encoding the client accepts.
+
+    Only content types listed in COMPRESSION_LEVELS are compressed, at the
+    level configured for the type. Streaming responses are compressed
+    chunk by chunk as they are sent.
+    """
+
+    def process_response(self, request, response):
+        levels = compression_levels(response.get('Content-Type'))
+        if (not levels or response.has_header('Content-Encoding')
+                or response.status_code in (204, 206, 304)):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        if response.streaming:
+            length = response.get('Content-Length')
+            if length and int(length) < settings.COMPRESSION_MIN_SIZE:
+                return response
+        elif len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+
+        encoding = negotiate_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING'), levels
+        )
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_stream(
+                response.streaming_content, encoding, levels[encoding]
+            )
+            del response['Content-Length']
+        else:
+            content = compress(response.content, encoding, levels[encoding])
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response['Content-Length'] = str(len(content))
+
+        # the compressed body is another representation of the same
+        # resource, so a strong validator no longer applies
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+
+class CompressedStaticFilesStorage(StaticFilesStorage):
+    """
+    Static files storage writing .gz and .br siblings of compressible files
+    in collectstatic, served in place of the file by serve_static
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            return
+        for name in paths:
+            yield name, name, self.precompress(name)
+
+    def precompress(self, name):
+        """ Write the compressed siblings of a file, True when written """
+        content_type = mimetypes.guess_type(name)[0]
+        path = self.path(name)
+        if (not compression_levels(content_type)
+                or os.path.getsize(path) < settings.COMPRESSION_MIN_SIZE):
+            return False
+
+        with open(path, 'rb') as file:
+            data = file.read()
+        written = False
+        for encoding, suffix in SUFFIXES.items():
+            content = compress(data, encoding, STATIC_LEVELS[encoding])
+            if len(content) >= len(data):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+                continue
+            tmp = f'{path}{suffix}.part'
+            with open(tmp, 'wb') as file:
+                file.write(content)
+            os.replace(tmp, path + suffix)
+            written = True
+        return written
@@ -0,0 +1,210 @@
+from django.conf import settings
+
+from .lru import LRUCache
+from .models import RecipeSummary
+from .versioning import bump_version, get_version
+
+MAX_MISSING = 2
+
+_indexes = LRUCache(maxsize=getattr(settings, 'COOKABLE_INDEX_MAX_USERS', 256))
+
+
+def _namespace(user_id):
+    return f'cookable:{user_id}'
+
+
+def _positions(bits):
+    """ Yield positions of the set bits of an int """
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+def _bits(positions):
+    """ Return an int with the given bit positions set """
+    positions = list(positions)
+    if not positions:
+        return 0
+    bitmap = bytearray(max(positions) // 8 + 1)
+    for position in positions:
+        bitmap[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bitmap, 'little')
+
+
+class CookableIndex:
+    """
+    Inverted index of one user's recipes by ingredient.
+
+    Every recipe gets a bit position and each ingredient maps to an int
+    used as a bitset of the recipes containing it, so set operations over
+    thousands of recipes are single big-int operations.
+    """
+
+    def __init__(self, rows=(), version=None):
+        self.version = version
+        self.recipe_ids = []
+        self.position_of = {}
+        self.sizes = []
+
+        positions = {}
+        for recipe_id, ingredient_ids in rows:
+            position = self._position(recipe_id)
+            ingredient_ids = set(ingredient_ids)
+            self.sizes[position] = len(ingredient_ids)
+            for ingredient_id in ingredient_ids:
+                positions.setdefault(ingredient_id, []).append(position)
+
+        self.postings = {
+            ingredient_id: _bits(recipe_positions)
+            for ingredient_id, recipe_positions in positions.items()
+        }
+        self.nonempty = _bits(
+            position for position, size in enumerate(self.sizes) if size
+        )
+
+    def _position(self, recipe_id):
+        position = self.position_of.get(recipe_id)
+        if position is None:
+            position = len(self.recipe_ids)
+            self.position_of[recipe_id] = position
+            self.recipe_ids.append(recipe_id)
+            self.sizes.append(0)
+        return position
+
+    def copy(self):
+        """ Return an index that can be changed without affecting this one """
+        index = CookableIndex(version=self.version)
+        index.recipe_ids = list(self.recipe_ids)
+        index.position_of = dict(self.position_of)
+        index.sizes = list(self.sizes)
+        index.postings = dict(self.postings)
+        index.nonempty = self.nonempty
+        return index
+
+    def add(self, recipe_id, ingredient_ids):
+        position = self._position(recipe_id)
+        bit = 1 << position
+        for ingredient_id in ingredient_ids:
+            posting = self.postings.get(ingredient_id, 0)
+            if not posting & bit:
+                self.postings[ingredient_id] = posting | bit
+                self.sizes[position] += 1
+        if self.sizes[position]:
+            self.nonempty |= bit
+
+    def remove(self, recipe_id, ingredient_ids):
+        position = self.position_of.get(recipe_id)
+        if position is None:
+            return
+        bit = 1 << position
+        for ingredient_id in ingredient_ids:
+            posting = self.postings.get(ingredient_id, 0)
+            if posting & bit:
+                self._set_posting(ingredient_id, posting & ~bit)
+                self.sizes[position] -= 1
+        if not self.sizes[position]:
+            self.nonempty &= ~bit
+
+    def discard_recipe(self, recipe_id):
+        position = self.position_of.get(recipe_id)
+        if position is None:
+            return
+        bit = 1 << position
+        for ingredient_id, posting in list(self.postings.items()):
+            if posting & bit:
+                self._set_posting(ingredient_id, posting & ~bit)
+        self.sizes[position] = 0
+        self.nonempty &= ~bit
+
+    def _set_posting(self, ingredient_id, posting):
+        if posting:
+            self.postings[ingredient_id] = posting
+        else:
+            del self.postings[ingredient_id]
+
+    def search(self, have, max_missing=MAX_MISSING):
+        """
+        Return [(recipe_id, missing, coverage)] for recipes using at least
+        one of the ingredients on hand and missing at most max_missing.
+        """
+        have = set(have)
+        candidates = 0
+        for ingredient_id in have:
+            candidates |= self.postings.get(ingredient_id, 0)
+        candidates &= self.nonempty
+
+        # saturating two-bit counter of missing ingredients per recipe,
+        # ones/twos both set means three or more
+        ones = twos = 0
+        for ingredient_id, posting in self.postings.items():
+            if ingredient_id in have:
+                continue
+            posting &= candidates
+            if not posting:
+                continue
+            saturated = ones & twos
+            carry = ones & posting
+            ones ^= posting
+            saturated |= twos & carry
+            twos ^= carry
+            ones |= saturated
+            twos |= saturated
+
+        by_missing = [
+            candidates & ~(ones | twos),
+            ones & ~twos,
+            twos & ~ones,
+        ]
+        results = []
+        for missing, bits in enumerate(by_missing[:max_missing + 1]):
+            for position in _positions(bits):
+                size = self.sizes[position]
+                results.append((
+                    self.recipe_ids[position],
+                    missing,
+                    round((size - missing) / size, 4),
+                ))
+
+        results.sort(key=lambda item: (-item[2], item[1], -item[0]))
+        return results
+
+
+def build_index(user_id, using='default', version=None):
+    rows = RecipeSummary.objects.using(using).filter(
+        user_id=user_id
+    ).order_by('recipe_id').values_list('recipe_id', 'ingredient_ids')
+    return CookableIndex(rows.iterator(), version=version)
+
+
+def get_index(user_id, using='default'):
+    """ Return the user's index, building it lazily when missing or stale """
+    version = get_version(_namespace(user_id))
+    index = _indexes.get(user_id)
+    if index is None or index.version != version:
+        index = build_index(user_id, using=using, version=version)
+        _indexes.set(user_id, index)
+    return index
+
+
+def apply_change(user_id, change=None):
+    """
+    Publish a change of the user's recipes to every process.
+
+    The local index is replaced by a copy passed to change(index) when it
+    was current; other processes see the new version and rebuild. Indexes
+    are never changed once published, threads searching one meanwhile keep
+    a consistent view.
+    """
+    index = _indexes.get(user_id)
+    version = bump_version(_namespace(user_id))
+    if index is None:
+        return
+    if change is None or index.version != version - 1:
+        _indexes.pop(user_id)
+        return
+
+    index = index.copy()
+    change(index)
+    index.version = version
+    _indexes.set(user_id, index)
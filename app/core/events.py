@@ -0,0 +1,353 @@
+import asyncio
+import json
+import logging
+from urllib.parse import parse_qs
+
+import psycopg2
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.db import close_old_connections, connections
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from .sharding import data_databases
+
+logger = logging.getLogger(__name__)
+
+# channel the change triggers notify on
+CHANNEL = 'core_change'
+
+# sent to subscribers that may have missed events, they catch up with
+# /api/recipe/sync/ and reconnect
+RESYNC = {'type': 'resync'}
+
+TICKET_SALT = 'core.events'
+
+
+class Listener:
+    """
+    One LISTEN connection per database and process, fanning notifications
+    out to the queues of the subscribed users.
+
+    The connection is opened on a thread and read from the event loop when
+    it becomes readable, so idle subscribers cost a queue and no thread or
+    connection.
+    """
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.connection = None
+        self.subscribers = {}
+        self._connecting = None
+        self._reconnecting = None
+
+    async def subscribe(self, user_id):
+        """
+        Return a queue receiving the events of a user, raising
+        psycopg2.Error when the database can not be listened to
+        """
+        queue = asyncio.Queue(maxsize=settings.EVENTS_QUEUE_SIZE)
+        self.subscribers.setdefault(user_id, set()).add(queue)
+        try:
+            if self.connection is None and self._reconnecting is None:
+                if self._connecting is None:
+                    # subscribers arriving meanwhile wait for the same one
+                    self._connecting = asyncio.ensure_future(self._connect())
+                await asyncio.shield(self._connecting)
+        except BaseException:
+            self.unsubscribe(user_id, queue)
+            raise
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        queues = self.subscribers.get(user_id, set())
+        queues.discard(queue)
+        if not queues:
+            self.subscribers.pop(user_id, None)
+        if not self.subscribers:
+            self.close()
+
+    @staticmethod
+    def _listen(params):
+        connection = psycopg2.connect(**params)
+        try:
+            connection.set_session(autocommit=True)
+            with connection.cursor() as cursor:
+                cursor.execute(f'LISTEN {CHANNEL}')
+        except psycopg2.Error:
+            connection.close()
+            raise
+        return connection
+
+    async def _connect(self):
+        params = connections[self.alias].get_connection_params()
+        loop = asyncio.get_running_loop()
+        try:
+            connection = await loop.run_in_executor(None, self._listen, params)
+        finally:
+            self._connecting = None
+        if not self.subscribers:
+            # everybody left while connecting
+            connection.close()
+            return
+        loop.add_reader(connection, self._read)
+        self.connection = connection
+
+    def _read(self):
+        try:
+            self.connection.poll()
+        except psycopg2.Error:
+            logger.warning('Lost the %s event listener', self.alias)
+            self._drop()
+            self._reconnecting = asyncio.ensure_future(self._reconnect())
+            return
+        while self.connection.notifies:
+            notify = self.connection.notifies.pop(0)
+            try:
+                event = json.loads(notify.payload)
+            except ValueError:
+                continue
+            self.publish(event['user'], event)
+
+    def publish(self, user_id, event):
+        for queue in list(self.subscribers.get(user_id, ())):
+            self._put(queue, event)
+
+    def _put(self, queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # a subscriber too slow to keep up resyncs instead of holding
+            # back the others
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(RESYNC)
+
+    async def _reconnect(self):
+        delay = 0.5
+        while self.subscribers:
+            await asyncio.sleep(delay)
+            try:
+                await self._connect()
+            except psycopg2.Error:
+                delay = min(delay * 2, 30)
+                continue
+            # notifications sent while disconnected are lost
+            for queues in self.subscribers.values():
+                for queue in queues:
+                    self._put(queue, RESYNC)
+            break
+        self._reconnecting = None
+
+    def _drop(self):
+        if self.connection is None:
+            return
+        try:
+            asyncio.get_running_loop().remove_reader(self.connection)
+        except RuntimeError:
+            pass
+        self.connection.close()
+        self.connection = None
+
+    def close(self):
+        if self._reconnecting is not None:
+            self._reconnecting.cancel()
+            self._reconnecting = None
+        self._drop()
+
+
+_listeners = {}
+
+
+def get_listeners():
+    """ Return the listeners of the data databases for this event loop """
+    loop = asyncio.get_running_loop()
+    if _listeners.get('loop') is not loop:
+        close_listeners()
+        _listeners['loop'] = loop
+        _listeners['databases'] = {
+            alias: Listener(alias) for alias in data_databases()
+        }
+    return _listeners['databases']
+
+
+def close_listeners():
+    for listener in _listeners.pop('databases', {}).values():
+        listener.close()
+    _listeners.pop('loop', None)
+
+
+def format_event(event):
+    """ Return a change notification as a server-sent event """
+    if event is RESYNC:
+        return b'event: resync\ndata: {}\n\n'
+    data = json.dumps({'id': event['id']})
+    return (
+        f"id: {event['seq']}\nevent: {event['type']}.{event['op']}\n"
+        f'data: {data}\n\n'
+    ).encode()
+
+
+def issue_ticket(user):
+    """
+    Return a ticket letting the user open the event stream during the
+    next EVENTS_TICKET_MAX_AGE seconds, in place of the auth token
+    """
+    return signing.dumps(user.pk, salt=TICKET_SALT)
+
+
+def _ticket_user(ticket):
+    try:
+        user_id = signing.loads(
+            ticket, salt=TICKET_SALT, max_age=settings.EVENTS_TICKET_MAX_AGE
+        )
+    except signing.BadSignature:
+        return None
+    return get_user_model().objects.filter(pk=user_id, is_active=True).first()
+
+
+def _authenticate(key, ticket):
+    close_old_connections()
+    try:
+        if ticket is not None:
+            return _ticket_user(ticket)
+        user, _ = TokenAuthentication().authenticate_credentials(key)
+    except AuthenticationFailed:
+        return None
+    finally:
+        close_old_connections()
+    return user
+
+
+def _credentials(scope):
+    """ Return the (auth token, stream ticket) of a request, or Nones """
+    for name, value in scope.get('headers', ()):
+        if name == b'authorization':
+            keyword, _, key = value.decode('latin-1').partition(' ')
+            if keyword == 'Token':
+                return key.strip(), None
+    # EventSource can not set headers, it sends a short-lived ticket
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    return None, query.get('ticket', [None])[0]
+
+
+async def _disconnected(receive):
+    """ Wait until the client goes away, skipping the request body """
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _respond(send, status, body):
+    await send({'type': 'http.response.start', 'status': status, 'headers': [
+        (b'content-type', b'application/json'),
+    ]})
+    await send({'type': 'http.response.body',
+                'body': json.dumps(body).encode()})
+
+
+class EventStreamApp:
+    """
+    ASGI application streaming the recipe, tag and ingredient changes of
+    the authenticated user as server-sent events, passing every other
+    request to the Django application.
+
+    Event ids are change sequence numbers: a client that lost events
+    catches up with /api/recipe/sync/ before listening again.
+    """
+
+    def __init__(self, application, path=None):
+        self.application = application
+        self.path = path or settings.EVENTS_PATH
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http' and scope['path'] == self.path:
+            return await self.stream(scope, receive, send)
+        return await self.application(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                close_listeners()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def stream(self, scope, receive, send):
+        if scope['method'] != 'GET':
+            return await _respond(send, 405, {
+                'detail': f"Method \"{scope['method']}\" not allowed."
+            })
+        key, ticket = _credentials(scope)
+        user = None
+        if key or ticket:
+            user = await sync_to_async(_authenticate)(key, ticket)
+        if user is None:
+            return await _respond(send, 401, {
+                'detail': 'Authentication credentials were not provided.'
+            })
+
+        subscriptions = []
+        try:
+            try:
+                for listener in get_listeners().values():
+                    subscriptions.append(
+                        (listener, await listener.subscribe(user.pk))
+                    )
+            except psycopg2.Error:
+                logger.warning('Could not listen for changes', exc_info=True)
+                return await _respond(send, 503, {
+                    'detail': 'Change events are unavailable, try again later.'
+                })
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [
+                            (b'content-type', b'text/event-stream'),
+                            (b'cache-control', b'no-cache'),
+                            (b'x-accel-buffering', b'no'),
+                        ]})
+            await send({'type': 'http.response.body',
+                        'body': b': connected\n\n', 'more_body': True})
+            await self._send_events(
+                [queue for _, queue in subscriptions], receive, send
+            )
+        finally:
+            for listener, queue in subscriptions:
+                listener.unsubscribe(user.pk, queue)
+
+    async def _send_events(self, queues, receive, send):
+        disconnect = asyncio.ensure_future(_disconnected(receive))
+        gets = {asyncio.ensure_future(queue.get()): queue for queue in queues}
+        try:
+            while True:
+                done, _ = await asyncio.wait(
+                    [disconnect, *gets],
+                    timeout=settings.EVENTS_HEARTBEAT,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if disconnect in done:
+                    return
+                if not done:
+                    # keeps proxies from closing an idle stream
+                    await send({'type': 'http.response.body',
+                                'body': b': heartbeat\n\n',
+                                'more_body': True})
+                    continue
+                for get in done:
+                    queue = gets.pop(get)
+                    event = get.result()
+                    await send({'type': 'http.response.body',
+                                'body': format_event(event),
+                                'more_body': True})
+                    if event is RESYNC:
+                        await send({'type': 'http.response.body',
+                                    'body': b''})
+                        return
+                    gets[asyncio.ensure_future(queue.get())] = queue
+        finally:
+            for pending in (disconnect, *gets):
+                pending.cancel()
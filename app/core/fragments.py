@@ -0,0 +1,70 @@
+from django.conf import settings
+from django.core.cache import cache
+
+# cache keys counting fragment lookups, shared by all workers
+HITS_KEY = 'fragments:hits'
+MISSES_KEY = 'fragments:misses'
+
+
+def fragment_key(obj, variant):
+    """
+    Return the cache key of an object's representation. change_seq is
+    renumbered by the database on every change of the row, its relations
+    and the names of its tags and ingredients, so keys never go stale.
+    """
+    model = obj._meta.label_lower
+    return f'fragment:{model}:{variant}:{obj.pk}:{obj.change_seq}'
+
+
+def _count(key, delta):
+    if not delta:
+        return
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key, delta)
+
+
+def render(objects, serialize, variant):
+    """
+    Return the representations of objects, from the cache where possible.
+
+    Cached fragments are read with one get_many, serialize is called once
+    with the list of misses and must return their representations in
+    order. variant names everything else the representation depends on.
+    """
+    objects = list(objects)
+    if not settings.FRAGMENT_CACHE_ENABLED:
+        return list(serialize(objects))
+
+    keys = [fragment_key(obj, variant) for obj in objects]
+    cached = cache.get_many(keys)
+    misses = [obj for obj, key in zip(objects, keys) if key not in cached]
+    if misses:
+        fresh = dict(zip(
+            (fragment_key(obj, variant) for obj in misses),
+            (dict(data) for data in serialize(misses)),
+        ))
+        cache.set_many(fresh, timeout=settings.FRAGMENT_CACHE_TIMEOUT)
+        cached.update(fresh)
+
+    _count(HITS_KEY, len(objects) - len(misses))
+    _count(MISSES_KEY, len(misses))
+    return [cached[key] for key in keys]
+
+
+def stats():
+    """ Return the hits, misses and hit rate of the fragment cache """
+    counts = cache.get_many([HITS_KEY, MISSES_KEY])
+    hits, misses = counts.get(HITS_KEY, 0), counts.get(MISSES_KEY, 0)
+    lookups = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / lookups if lookups else 0.0,
+    }
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
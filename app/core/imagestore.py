@@ -0,0 +1,255 @@
+import hashlib
+import os
+import re
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .sharding import data_databases, global_database
+
+RECIPE_IMAGE_DIR = 'uploads/recipe/'
+
+_CONTENT_NAME = re.compile(
+    r'^uploads/recipe/[0-9a-f]{2}/(?P<digest>[0-9a-f]{64})\.\w+$'
+)
+
+
+def file_content_hash(file):
+    """ Return the SHA-256 hex digest of a file, reusing a streamed one """
+    digest = getattr(file, 'content_hash', None)
+    if digest:
+        return digest
+
+    sha = hashlib.sha256()
+    for chunk in file.chunks():
+        sha.update(chunk)
+    file.seek(0)
+    return sha.hexdigest()
+
+
+def content_addressed_name(digest, ext):
+    return f'{RECIPE_IMAGE_DIR}{digest[:2]}/{digest}.{ext.lower()}'
+
+
+def content_digest(name):
+    """ Return the content hash of a content-addressed name, or None """
+    match = _CONTENT_NAME.match(name or '')
+    return match.group('digest') if match else None
+
+
+def is_content_addressed(name):
+    return content_digest(name) is not None
+
+
+class MediaStorage(FileSystemStorage):
+    """
+    File system storage saving recipe images under the hash of their
+    content, so identical uploads are written once and share one file
+    """
+
+    def save(self, name, content, max_length=None):
+        if (settings.RECIPE_IMAGE_CONTENT_ADDRESSED and name
+                and name.startswith(RECIPE_IMAGE_DIR)):
+            if not hasattr(content, 'chunks'):
+                content = File(content, name)
+            name = content_addressed_name(
+                file_content_hash(content), name.split('.')[-1]
+            )
+        return super().save(name, content, max_length=max_length)
+
+    def get_available_name(self, name, max_length=None):
+        if is_content_addressed(name):
+            return name
+        return super().get_available_name(name, max_length=max_length)
+
+    def _save(self, name, content):
+        if not is_content_addressed(name):
+            return super()._save(name, content)
+        if _reuse_stored(name, self.exists):
+            return name
+
+        # write under a unique name and rename so concurrent uploads of
+        # the same bytes never observe a partial file
+        partial = super()._save(f'{name}.{uuid.uuid4().hex}.part', content)
+        os.replace(self.path(partial), self.path(name))
+        return name
+
+
+def _reuse_stored(name, exists):
+    """
+    Return whether the stored file of name can be reused. An orphaned
+    blob is refreshed first, waiting for a collection holding it, so the
+    GC leaves the file alone until the new reference is counted.
+    """
+    from .models import ImageBlob
+
+    with transaction.atomic(using=global_database()):
+        ImageBlob.objects.using(global_database()).filter(name=name).update(
+            updated_at=timezone.now()
+        )
+        return exists(name)
+
+
+def add_reference(name):
+    """ Count a new reference to a stored image """
+    from .models import ImageBlob
+
+    if not name:
+        return
+    blobs = ImageBlob.objects.using(global_database())
+    with transaction.atomic(using=global_database()):
+        _, created = blobs.select_for_update().get_or_create(
+            name=name, defaults={'ref_count': 1}
+        )
+        if not created:
+            blobs.filter(name=name).update(
+                ref_count=F('ref_count') + 1,
+                updated_at=timezone.now(),
+            )
+
+
+def remove_reference(name, count=1):
+    """ Drop references to a stored image, leaving orphans for the GC """
+    from .models import ImageBlob
+
+    if not name:
+        return
+    ImageBlob.objects.using(global_database()).filter(name=name).update(
+        ref_count=F('ref_count') - count,
+        updated_at=timezone.now(),
+    )
+
+
+def collect_garbage(grace=timedelta(hours=1), storage=None, dry_run=False):
+    """
+    Delete image files that no recipe has referenced for the grace
+    period and return their names
+    """
+    from .models import ImageBlob
+
+    storage = storage or default_storage
+    cutoff = timezone.now() - grace
+    deleted = []
+    blobs = ImageBlob.objects.using(global_database())
+    orphans = blobs.filter(
+        ref_count__lte=0, updated_at__lt=cutoff
+    ).values_list('name', flat=True)
+
+    for name in list(orphans.iterator()):
+        with transaction.atomic(using=global_database()):
+            blob = blobs.select_for_update(skip_locked=True).filter(
+                name=name, ref_count__lte=0, updated_at__lt=cutoff
+            ).first()
+            if blob is None:
+                continue
+            if not dry_run:
+                storage.delete(name)
+                blob.delete()
+        deleted.append(name)
+    return deleted
+
+
+def rebuild_references(storage=None, include_unreferenced=False):
+    """
+    Recount image references of every recipe on every database.
+
+    With include_unreferenced, files under the recipe image directory no
+    recipe points at are recorded with no references so the GC removes
+    them.
+    """
+    from .models import ImageBlob, Recipe
+
+    counts = {}
+    for alias in data_databases():
+        rows = Recipe.objects.using(alias).exclude(image='').filter(
+            image__isnull=False
+        ).values('image').annotate(n=Count('*')).order_by()
+        for row in rows.iterator():
+            counts[row['image']] = counts.get(row['image'], 0) + row['n']
+
+    if include_unreferenced:
+        for name in _stored_names(storage or default_storage):
+            counts.setdefault(name, 0)
+
+    blobs = ImageBlob.objects.using(global_database())
+    with transaction.atomic(using=global_database()):
+        blobs.exclude(name__in=list(counts)).update(ref_count=0)
+        existing = set(blobs.filter(
+            name__in=list(counts)
+        ).values_list('name', flat=True))
+        for name in existing:
+            blobs.filter(name=name).exclude(ref_count=counts[name]).update(
+                ref_count=counts[name]
+            )
+        blobs.bulk_create([
+            ImageBlob(name=name, ref_count=count)
+            for name, count in counts.items() if name not in existing
+        ], batch_size=1000)
+    return counts
+
+
+def _stored_names(storage, path=RECIPE_IMAGE_DIR.rstrip('/')):
+    """ Yield names of every file stored under the given directory """
+    if not storage.exists(path):
+        return
+    directories, files = storage.listdir(path)
+    for name in files:
+        if not name.endswith('.part'):
+            yield f'{path}/{name}'
+    for directory in directories:
+        yield from _stored_names(storage, f'{path}/{directory}')
+
+
+def deduplicate_images(using, storage=None, batch_size=500):
+    """
+    Move recipe images stored under random names to their content
+    address, merging files with identical bytes.
+
+    Returns (moved, merged, missing) counts. Rows are updated without
+    signals, references must be rebuilt afterwards.
+    """
+    from .models import Recipe
+
+    storage = storage or default_storage
+    moved = merged = missing = 0
+    last_id = 0
+    while True:
+        batch = list(Recipe.objects.using(using).filter(
+            pk__gt=last_id, image__isnull=False
+        ).exclude(image='').order_by('pk').values_list('pk', 'image')[
+            :batch_size
+        ])
+        if not batch:
+            break
+        last_id = batch[-1][0]
+
+        for recipe_id, name in batch:
+            if is_content_addressed(name):
+                continue
+            if not storage.exists(name):
+                missing += 1
+                continue
+
+            with storage.open(name) as file:
+                digest = file_content_hash(file)
+            target = content_addressed_name(digest, name.split('.')[-1])
+            if storage.exists(target):
+                # the duplicate is left for the GC once references are
+                # rebuilt, other rows may still point at it
+                merged += 1
+            else:
+                os.makedirs(os.path.dirname(storage.path(target)),
+                            exist_ok=True)
+                os.replace(storage.path(name), storage.path(target))
+                moved += 1
+
+            Recipe.objects.using(using).filter(pk=recipe_id).update(
+                image=target
+            )
+    return moved, merged, missing
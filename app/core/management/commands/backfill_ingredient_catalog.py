@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from core import catalog, sharding
+from core.models import CanonicalIngredient
+
+
+class Command(BaseCommand):
+    """ Django command to link existing ingredients to the global catalog """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        for using in sharding.data_databases():
+            linked = catalog.backfill(
+                using, batch_size=options['batch_size']
+            )
+            self.stdout.write(f'{using}: {linked} ingredients linked')
+
+        names = CanonicalIngredient.objects.count()
+        self.stdout.write(
+            self.style.SUCCESS(f'ingredient catalog holds {names} names')
+        )
@@ -0,0 +1,96 @@
+import multiprocessing
+import random
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'shm': 'core.shmcache.SharedMemoryCache',
+}
+
+
+def _workload(cache, options, seed, start, results):
+    """ Read through keys like a view would and bump a shared counter """
+    rnd = random.Random(seed)
+    value = 'x' * options['value_size']
+    hits = 0
+    start.wait()
+    began = time.perf_counter()
+    for _ in range(options['operations']):
+        key = f'bench:{rnd.randrange(options["keys"])}'
+        if cache.get(key) is None:
+            cache.set(key, value, 300)
+        else:
+            hits += 1
+    for _ in range(options['increments']):
+        try:
+            cache.incr('bench:counter')
+        except ValueError:
+            cache.add('bench:counter', 0, None)
+            cache.incr('bench:counter')
+    results.put((hits, time.perf_counter() - began))
+
+
+class Command(BaseCommand):
+    """ Django command to compare cache backends shared by workers """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', action='append', default=[],
+                            choices=sorted(BACKENDS),
+                            help='Backend to measure (repeatable, '
+                                 'default all)')
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--operations', type=int, default=20000,
+                            help='Reads per process')
+        parser.add_argument('--increments', type=int, default=1000,
+                            help='Counter increments per process')
+        parser.add_argument('--keys', type=int, default=2000)
+        parser.add_argument('--value-size', type=int, default=512)
+
+    def handle(self, *args, **options):
+        context = multiprocessing.get_context('fork')
+        self.stdout.write(
+            f'{"backend":<8} {"ops/s":>10} {"hit rate":>9} {"counter":>15}'
+        )
+        for name in options['backend'] or sorted(BACKENDS):
+            with tempfile.TemporaryDirectory() as directory:
+                # room for every key, so misses come from not sharing
+                cache = import_string(BACKENDS[name])(
+                    f'{directory}/{name}', {
+                        'timeout': 300,
+                        'OPTIONS': {'MAX_ENTRIES': options['keys'] * 2},
+                    }
+                )
+                start, results = context.Event(), context.Queue()
+                workers = [
+                    context.Process(
+                        target=_workload,
+                        args=(cache, options, seed, start, results),
+                    )
+                    for seed in range(options['processes'])
+                ]
+                for worker in workers:
+                    worker.start()
+                began = time.perf_counter()
+                start.set()
+                reports = [results.get() for _ in workers]
+                elapsed = time.perf_counter() - began
+                for worker in workers:
+                    worker.join()
+
+                # process local caches only see their own increments
+                counter = cache.get('bench:counter', 0)
+                expected = options['increments'] * options['processes']
+                operations = (
+                    options['operations'] + options['increments']
+                ) * options['processes']
+                hits = sum(hits for hits, _ in reports)
+                self.stdout.write(
+                    f'{name:<8} {operations / elapsed:>10.0f} '
+                    f'{hits / (options["operations"] * len(workers)):>9.1%} '
+                    f'{f"{counter}/{expected}":>15}'
+                )
@@ -0,0 +1,90 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core import fragments
+from core.models import Ingredient, Recipe, Tag
+from core.sharding import global_database, shard_for_user
+
+
+def _ensure_recipes(user, count):
+    """ Give the user count recipes with a few tags and ingredients each """
+    using = shard_for_user(user)
+    missing = count - Recipe.objects.using(using).filter(user=user).count()
+    if missing <= 0:
+        return
+    tags = Tag.objects.using(using).bulk_create(
+        Tag(user=user, name=f'tag {n}') for n in range(20)
+    )
+    ingredients = Ingredient.objects.using(using).bulk_create(
+        Ingredient(user=user, name=f'ingredient {n}') for n in range(50)
+    )
+    recipes = Recipe.objects.using(using).bulk_create(
+        Recipe(user=user, title=f'recipe {n}', time_minutes=n % 120 + 1,
+               price=n % 100 + 0.5)
+        for n in range(missing)
+    )
+    Recipe.tags.through.objects.using(using).bulk_create(
+        Recipe.tags.through(recipe_id=recipe.id, tag_id=tags[n % 20].id)
+        for n, recipe in enumerate(recipes)
+    )
+    Recipe.ingredients.through.objects.using(using).bulk_create(
+        Recipe.ingredients.through(
+            recipe_id=recipe.id, ingredient_id=ingredients[(n + k) % 50].id
+        )
+        for n, recipe in enumerate(recipes) for k in range(3)
+    )
+
+
+class Command(BaseCommand):
+    """ Django command to time the recipe list with and without fragments """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=500)
+        parser.add_argument('--requests', type=int, default=50)
+        parser.add_argument('--limit', type=int, default=100,
+                            help='Page size when the list is paginated')
+        parser.add_argument('--expand', default='',
+                            help='Relations to expand, e.g. tags,ingredients')
+
+    def handle(self, *args, **options):
+        # imported here so that the URLconf is loaded by Django first
+        from recipe.views import RecipeAPIViewSet
+
+        user, _ = get_user_model().objects.using(
+            global_database()
+        ).get_or_create(email='bench@example.com', defaults={'name': 'bench'})
+        _ensure_recipes(user, options['recipes'])
+        view = RecipeAPIViewSet.as_view({'get': 'list'})
+        factory = APIRequestFactory(SERVER_NAME='localhost')
+        params = {'limit': options['limit']}
+        if options['expand']:
+            params['expand'] = options['expand']
+
+        def run():
+            began = time.perf_counter()
+            for _ in range(options['requests']):
+                request = factory.get('/api/recipe/recipes/', params)
+                force_authenticate(request, user=user)
+                response = view(request)
+                response.render()
+            return (time.perf_counter() - began) / options['requests']
+
+        self.stdout.write(
+            f'{"fragments":<10} {"ms/request":>11} {"req/s":>8} '
+            f'{"hit rate":>9}'
+        )
+        with override_settings(ALLOWED_HOSTS=['localhost']):
+            for name, enabled in (('off', False), ('on', True)):
+                fragments.reset_stats()
+                with override_settings(FRAGMENT_CACHE_ENABLED=enabled):
+                    run()
+                    elapsed = run()
+                stats = fragments.stats()
+                self.stdout.write(
+                    f'{name:<10} {elapsed * 1000:>11.2f} '
+                    f'{1 / elapsed:>8.1f} {stats["hit_rate"]:>9.1%}'
+                )
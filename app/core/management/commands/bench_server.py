@@ -0,0 +1,139 @@
+import http.client
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from core.sharding import global_database
+
+SERVERS = {
+    'runserver': lambda port, options: [
+        'runserver', f'127.0.0.1:{port}', '--noreload',
+    ],
+    'serve': lambda port, options: [
+        'serve', '--bind', f'127.0.0.1:{port}',
+    ] + (['--workers', str(options['workers'])] if options['workers'] else []),
+}
+
+
+def _wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def _client(port, path, headers, deadline, results):
+    latencies, errors = [], 0
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 400:
+                errors += 1
+            if response.getheader('Connection', '').lower() == 'close':
+                connection.close()
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+            continue
+        latencies.append(time.perf_counter() - start)
+    connection.close()
+    results.append((latencies, errors))
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    """ Django command to compare request throughput of HTTP servers """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', action='append', default=[],
+                            choices=sorted(SERVERS),
+                            help='Server to measure (repeatable, '
+                                 'default all)')
+        parser.add_argument('--path', default='/api/recipe/tags/')
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--duration', type=float, default=10)
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Workers of the serve command')
+
+    def handle(self, *args, **options):
+        user, _ = get_user_model().objects.using(
+            global_database()
+        ).get_or_create(email='bench@example.com', defaults={'name': 'bench'})
+        token, _ = Token.objects.using(global_database()).get_or_create(
+            user=user
+        )
+        headers = {'Authorization': f'Token {token.key}'}
+        manage = os.path.join(settings.BASE_DIR, 'manage.py')
+
+        self.stdout.write(
+            f'{"server":<10} {"requests":>9} {"req/s":>9} '
+            f'{"p50 ms":>8} {"p99 ms":>8} {"errors":>7}'
+        )
+        for name in options['server'] or sorted(SERVERS):
+            port = options['port']
+            process = subprocess.Popen(
+                [sys.executable, manage] + SERVERS[name](port, options),
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            try:
+                if not _wait_for_port(port):
+                    raise CommandError(f'{name} did not start')
+                # warm up every worker before measuring
+                self._run(port, options, headers, duration=1)
+                latencies, errors = self._run(
+                    port, options, headers, duration=options['duration']
+                )
+            finally:
+                process.send_signal(signal.SIGTERM)
+                process.wait()
+
+            latencies.sort()
+            if not latencies:
+                raise CommandError(f'{name} served no requests')
+            self.stdout.write(
+                f'{name:<10} {len(latencies):>9} '
+                f'{len(latencies) / options["duration"]:>9.1f} '
+                f'{_percentile(latencies, 0.5) * 1000:>8.1f} '
+                f'{_percentile(latencies, 0.99) * 1000:>8.1f} '
+                f'{errors:>7}'
+            )
+
+    def _run(self, port, options, headers, duration):
+        deadline = time.monotonic() + duration
+        results = []
+        clients = [
+            threading.Thread(
+                target=_client,
+                args=(port, options['path'], headers, deadline, results),
+            )
+            for _ in range(options['concurrency'])
+        ]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+
+        latencies = [value for values, _ in results for value in values]
+        return latencies, sum(errors for _, errors in results)
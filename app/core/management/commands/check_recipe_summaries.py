@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import sharding, summaries
+
+
+class Command(BaseCommand):
+    """ Django command to verify the recipe summary table """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', action='append', default=[],
+                            help='Database alias to check (repeatable)')
+        parser.add_argument('--fix', action='store_true',
+                            help='Refresh inconsistent summaries')
+
+    def handle(self, *args, **options):
+        broken = 0
+        for alias in options['database'] or sharding.data_databases():
+            recipe_ids = summaries.inconsistent_summaries(using=alias)
+            if not recipe_ids:
+                continue
+
+            self.stdout.write(
+                f'{alias}: {len(recipe_ids)} inconsistent summaries '
+                f'(recipes {", ".join(map(str, recipe_ids[:20]))})'
+            )
+            if options['fix']:
+                summaries.refresh_summaries(recipe_ids, using=alias)
+            else:
+                broken += len(recipe_ids)
+
+        if broken:
+            raise CommandError(f'{broken} inconsistent recipe summaries')
+        self.stdout.write(self.style.SUCCESS('recipe summaries consistent'))
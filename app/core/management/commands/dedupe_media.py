@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from core import imagestore
+from core.sharding import data_databases
+
+
+class Command(BaseCommand):
+    """ Django command to move recipe images to content-addressed names """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        for alias in data_databases():
+            moved, merged, missing = imagestore.deduplicate_images(
+                using=alias, batch_size=options['batch_size']
+            )
+            self.stdout.write(
+                f'{alias}: {moved} moved, {merged} merged, {missing} missing'
+            )
+
+        counts = imagestore.rebuild_references(include_unreferenced=True)
+        orphans = sum(1 for count in counts.values() if not count)
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(counts) - orphans} files referenced, '
+            f'{orphans} left for gc_media'
+        ))
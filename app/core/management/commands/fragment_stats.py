@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from core import fragments
+
+
+class Command(BaseCommand):
+    """ Django command to report the hit rate of the fragment cache """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help='Start counting again afterwards')
+
+    def handle(self, *args, **options):
+        stats = fragments.stats()
+        self.stdout.write(self.style.SUCCESS(
+            f'hits {stats["hits"]}, misses {stats["misses"]}, '
+            f'hit rate {stats["hit_rate"]:.1%}'
+        ))
+        if options['reset']:
+            fragments.reset_stats()
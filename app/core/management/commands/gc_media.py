@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import imagestore
+
+
+class Command(BaseCommand):
+    """ Django command to delete media files no recipe references """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=int,
+                            default=settings.MEDIA_GC_GRACE_PERIOD,
+                            help='Seconds a file must stay unreferenced')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='List files without deleting them')
+
+    def handle(self, *args, **options):
+        deleted = imagestore.collect_garbage(
+            grace=timedelta(seconds=options['grace']),
+            dry_run=options['dry_run'],
+        )
+        for name in deleted:
+            self.stdout.write(name)
+
+        verb = 'would be deleted' if options['dry_run'] else 'deleted'
+        self.stdout.write(self.style.SUCCESS(f'{len(deleted)} files {verb}'))
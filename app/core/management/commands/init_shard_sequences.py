@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, models
+
+from core import sharding
+
+
+class Command(BaseCommand):
+    """ Django command to give every shard its own primary key block """
+
+    def handle(self, *args, **options):
+        if not sharding.is_sharded():
+            raise CommandError('DATABASE_SHARDS is not configured')
+
+        for index, alias in enumerate(sharding.get_ring().nodes):
+            start = index * sharding.SHARD_ID_BLOCK + 1
+            with connections[alias].cursor() as cursor:
+                for model, _ in sharding.sharded_models():
+                    pk = model._meta.pk
+                    if not isinstance(pk, models.AutoField):
+                        # keyed by their recipe or user, no sequence
+                        continue
+                    table = model._meta.db_table
+                    cursor.execute(
+                        f'SELECT setval(pg_get_serial_sequence(%s, %s), '
+                        f'GREATEST(%s, (SELECT COALESCE(MAX("{pk.column}"), '
+                        f'0) + 1 FROM "{table}")), false)',
+                        [table, pk.column, start],
+                    )
+            self.stdout.write(f'{alias}: ids start at {start}')
+
+        self.stdout.write(self.style.SUCCESS('shard sequences initialised'))
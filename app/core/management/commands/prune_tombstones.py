@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core import sharding, sync
+
+
+class Command(BaseCommand):
+    """ Django command to delete tombstones no sync token can need """
+
+    def handle(self, *args, **options):
+        deleted = sum(
+            sync.prune_tombstones(using)
+            for using in sharding.data_databases()
+        )
+        self.stdout.write(self.style.SUCCESS(f'{deleted} tombstones deleted'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from core import purge
+
+
+class Command(BaseCommand):
+    """ Django command to purge data of deleted user accounts """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def report(self, record):
+        state = 'done' if record.finished_at else 'purging'
+        self.stdout.write(
+            f'{record}: {state}, {record.recipes_deleted} recipes, '
+            f'{record.tags_deleted} tags, '
+            f'{record.ingredients_deleted} ingredients deleted'
+        )
+
+    def handle(self, *args, **options):
+        finished = 0
+        for record in purge.pending_purges():
+            report = self.report if options['verbosity'] > 1 else None
+            if purge.purge_user(record, batch_size=options['batch_size'],
+                                progress=report):
+                finished += 1
+                self.report(record)
+            else:
+                self.stdout.write(f'{record}: shard move in progress')
+
+        self.stdout.write(self.style.SUCCESS(f'{finished} users purged'))
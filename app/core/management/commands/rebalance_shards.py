@@ -0,0 +1,47 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core import sharding
+
+
+class Command(BaseCommand):
+    """ Django command to move users' data between database shards """
+
+    help = 'Move users to the shard given by the hash ring or --to'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', default=[],
+                            help='Email of a user to move (repeatable)')
+        parser.add_argument('--to', dest='target',
+                            help='Target shard alias')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not sharding.is_sharded():
+            raise CommandError('DATABASE_SHARDS is not configured')
+
+        target = options['target']
+        if target and target not in sharding.get_ring().nodes:
+            raise CommandError(f'Unknown shard "{target}"')
+
+        users = get_user_model().objects.using(
+            sharding.global_database()
+        ).order_by('pk')
+        if options['user']:
+            users = users.filter(email__in=options['user'])
+
+        moved = 0
+        for user in users.iterator():
+            destination = target or sharding.placement_for_user_id(user.pk)
+            source = sharding.shard_for_user(user)
+            if source == destination:
+                continue
+
+            rows = sharding.move_user(user, destination,
+                                      batch_size=options['batch_size'])
+            moved += 1
+            self.stdout.write(
+                f'{user.email}: {source} -> {destination} ({rows} rows)'
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'{moved} users moved'))
@@ -0,0 +1,27 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from core import stats
+from core.sharding import global_database, shard_for_user
+
+
+class Command(BaseCommand):
+    """ Django command to recompute per-user recipe statistics """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', default=[],
+                            help='Email of a user to rebuild (repeatable)')
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.using(
+            global_database()
+        ).order_by('pk')
+        if options['user']:
+            users = users.filter(email__in=options['user'])
+
+        rebuilt = 0
+        for user in users.iterator():
+            stats.rebuild_stats(user, using=shard_for_user(user))
+            rebuilt += 1
+
+        self.stdout.write(self.style.SUCCESS(f'{rebuilt} users rebuilt'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from core import sharding, summaries
+
+
+class Command(BaseCommand):
+    """ Django command to recompute the recipe summary table """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', action='append', default=[],
+                            help='Database alias to rebuild (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        for alias in options['database'] or sharding.data_databases():
+            rows = summaries.rebuild_summaries(
+                using=alias, batch_size=options['batch_size']
+            )
+            self.stdout.write(f'{alias}: {rows} summaries rebuilt')
+
+        self.stdout.write(self.style.SUCCESS('recipe summaries rebuilt'))
@@ -0,0 +1,41 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.taskqueue import Worker
+
+
+class Command(BaseCommand):
+    """ Django command to run task queue jobs """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue', action='append', default=[],
+                            help='Queue to work on as name[:concurrency] '
+                                 '(repeatable, default all queues)')
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--burst', action='store_true',
+                            help='Run due jobs in this thread and exit')
+
+    def handle(self, *args, **options):
+        queues = {}
+        for value in options['queue']:
+            name, _, concurrency = value.partition(':')
+            if not concurrency and name not in settings.TASK_QUEUES:
+                raise CommandError(f'Unknown queue {name}')
+            queues[name] = int(concurrency or settings.TASK_QUEUES[name])
+        worker = Worker(queues or None, batch_size=options['batch_size'])
+
+        if options['burst']:
+            count = worker.run_burst()
+            self.stdout.write(self.style.SUCCESS(f'{count} jobs run'))
+            return
+
+        signal.signal(signal.SIGTERM, worker.stop)
+        signal.signal(signal.SIGINT, worker.stop)
+        self.stdout.write(
+            f'worker {worker.name} on '
+            + ', '.join(f'{q}:{n}' for q, n in worker.queues.items())
+        )
+        worker.run()
+        self.stdout.write(self.style.SUCCESS('worker stopped'))
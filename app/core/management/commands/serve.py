@@ -0,0 +1,114 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils.module_loading import import_string
+
+from core.checks import PROCESS_LOCAL_CACHES
+
+INTERFACES = {
+    'wsgi': ('app.wsgi.application', 'sync'),
+    'asgi': ('app.asgi.application', 'uvicorn.workers.UvicornWorker'),
+}
+
+
+def cpu_count():
+    """ Return the CPUs this process may run on, honouring cpusets """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def default_workers(interface):
+    if settings.SERVE_WORKERS:
+        return settings.SERVE_WORKERS
+    # sync workers block on I/O, event loop workers do not
+    if interface == 'wsgi':
+        return cpu_count() * 2 + 1
+    return cpu_count()
+
+
+def build_server(application_path, options):
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        """ Gunicorn arbiter serving the Django application """
+
+        def load_config(self):
+            for key, value in options.items():
+                if value is not None:
+                    self.cfg.set(key, value)
+
+        def load(self):
+            application = import_string(application_path)
+            # connections opened while loading must not be shared by the
+            # forked workers
+            connections.close_all()
+            return application
+
+    return Server()
+
+
+class Command(BaseCommand):
+    """
+    Django command to serve the application with pre-forked workers.
+
+    The application is loaded once in the master and shared copy-on-write
+    by the workers. kill -HUP restarts the workers gracefully, kill -USR2
+    starts a new master running new code next to the old one, which is
+    then stopped with kill -QUIT.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bind', default='0.0.0.0:8000')
+        parser.add_argument('--interface', choices=sorted(INTERFACES),
+                            default='wsgi')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Defaults to the CPU count (x2 + 1 for '
+                                 'WSGI) unless SERVE_WORKERS is set')
+        parser.add_argument('--threads', type=int, default=1,
+                            help='Threads per WSGI worker')
+        parser.add_argument('--max-requests', type=int,
+                            default=settings.SERVE_MAX_REQUESTS,
+                            help='Recycle a worker after this many requests')
+        parser.add_argument('--max-requests-jitter', type=int,
+                            default=settings.SERVE_MAX_REQUESTS // 10)
+        parser.add_argument('--timeout', type=int, default=30)
+        parser.add_argument('--graceful-timeout', type=int, default=30)
+        parser.add_argument('--pid', default=None,
+                            help='File to write the master pid to')
+
+    def handle(self, *args, **options):
+        interface = options['interface']
+        application_path, worker_class = INTERFACES[interface]
+        if interface == 'wsgi' and options['threads'] > 1:
+            worker_class = 'gthread'
+
+        workers = options['workers'] or default_workers(interface)
+        backend = settings.CACHES['default']['BACKEND']
+        if workers > 1 and backend in PROCESS_LOCAL_CACHES:
+            # index versions bumped by one worker would never reach the
+            # others, which keep serving stale results
+            raise CommandError(
+                f'{workers} workers cannot share the process-local cache '
+                f'{backend}. Use SETTINGS_PROFILE=prod or a shared cache, '
+                f'or serve with --workers 1.'
+            )
+
+        build_server(application_path, {
+            'bind': options['bind'],
+            'workers': workers,
+            'worker_class': worker_class,
+            'threads': options['threads'],
+            'preload_app': True,
+            'max_requests': options['max_requests'],
+            'max_requests_jitter': options['max_requests_jitter'],
+            'timeout': options['timeout'],
+            'graceful_timeout': options['graceful_timeout'],
+            'keepalive': 5,
+            'pidfile': options['pid'],
+            'proc_name': 'recipe-app',
+            'accesslog': '-' if options['verbosity'] > 1 else None,
+        }).run()
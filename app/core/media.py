@@ -0,0 +1,271 @@
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseNotModified,
+)
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags, quote_etag
+from django.views.decorators.http import require_safe
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from .compression import SUFFIXES, negotiate_encoding
+from .imagestore import content_digest
+from .models import Recipe
+from .sharding import shard_for_user
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+SIGNING_SALT = 'core.media'
+
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeFile:
+    """
+    File object limited to a byte range.
+
+    The file is positioned at the range start and WSGI servers with a
+    sendfile based wsgi.file_wrapper send Content-Length bytes from its
+    descriptor with os.sendfile, other servers read it in blocks.
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.remaining = length
+        file.seek(start)
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """
+    Return the (start, end) byte positions of a single range header, None
+    to serve the whole file or raise ValueError when unsatisfiable.
+    """
+    match = _RANGE.match(header or '')
+    if not match or not any(match.groups()):
+        return None
+
+    first, last = match.groups()
+    if not first:
+        length = min(int(last), size)
+        if not length:
+            raise ValueError(header)
+        return size - length, size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def _validators(name, stat, scope='public'):
+    """ Return (etag, cache_control) for a stored media file """
+    digest = content_digest(name)
+    if digest:
+        return quote_etag(digest), IMMUTABLE_CACHE_CONTROL.replace(
+            'public', scope
+        )
+    return (
+        quote_etag(f'{stat.st_mtime_ns:x}-{stat.st_size:x}'),
+        f'{scope}, max-age={settings.MEDIA_CACHE_MAX_AGE}',
+    )
+
+
+def signed_media_url(user, name):
+    """
+    Return the URL of a media file signed for the user, valid for
+    MEDIA_SIGNED_URL_MAX_AGE seconds
+    """
+    signature = signing.dumps([user.pk, name], salt=SIGNING_SALT)
+    return f'{settings.MEDIA_URL}{name}?{urlencode({"signature": signature})}'
+
+
+def _signed_user(signature, name):
+    try:
+        user_id, signed_name = signing.loads(
+            signature, salt=SIGNING_SALT,
+            max_age=settings.MEDIA_SIGNED_URL_MAX_AGE,
+        )
+    except (signing.BadSignature, ValueError):
+        return None
+    if signed_name != name:
+        return None
+    return get_user_model().objects.filter(
+        pk=user_id, is_active=True
+    ).first()
+
+
+def _request_user(request, name):
+    """ Return the user of the session, auth token or signature, or None """
+    if request.user.is_authenticated:
+        return request.user
+    if 'signature' in request.GET:
+        return _signed_user(request.GET['signature'], name)
+    try:
+        credentials = TokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    return credentials[0] if credentials else None
+
+
+def _can_read(user, name):
+    """ Return whether one of the user's recipes shows the media file """
+    if user.is_staff:
+        return True
+    return Recipe.objects.using(shard_for_user(user)).filter(
+        user=user, image=name
+    ).exists()
+
+
+def _media_name(path):
+    return posixpath.normpath(path).lstrip('/')
+
+
+def _resolve(path):
+    """ Check a media path and return (name, absolute path) """
+    name = _media_name(path)
+    if name.startswith('.') or not any(
+        name.startswith(prefix) for prefix in settings.MEDIA_SERVE_PREFIXES
+    ):
+        raise Http404('Media file not found')
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, name)
+    except ValueError:
+        raise Http404('Media file not found')
+    if not os.path.isfile(full_path):
+        raise Http404('Media file not found')
+    return name, full_path
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    Serve a media file to the owner of a recipe showing it, handing the
+    transfer to the front server when one is configured to deliver the
+    bytes. Elements that can not send headers use a signed URL instead.
+    """
+    user = _request_user(request, _media_name(path))
+    if user is None:
+        response = HttpResponse(status=401)
+        response['WWW-Authenticate'] = 'Token'
+        return response
+    name, full_path = _resolve(path)
+    if not _can_read(user, name):
+        raise Http404('Media file not found')
+
+    stat = os.stat(full_path)
+    etag, cache_control = _validators(name, stat, scope='private')
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+    elif settings.MEDIA_SERVE_MODE == 'x-accel-redirect':
+        # nginx answers range and conditional requests itself
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = (
+            settings.MEDIA_ACCEL_REDIRECT_PREFIX + name
+        )
+    elif settings.MEDIA_SERVE_MODE == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+    else:
+        response = _file_response(request, full_path, stat.st_size,
+                                  content_type, etag)
+
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    response['Vary'] = 'Authorization, Cookie'
+    if response.status_code != 304:
+        response['Last-Modified'] = http_date(stat.st_mtime)
+    return response
+
+
+@require_safe
+def serve_static(request, path):
+    """
+    Serve a collected static file, or its precompressed sibling when the
+    client accepts its encoding
+    """
+    name = posixpath.normpath(path).lstrip('/')
+    try:
+        full_path = safe_join(settings.STATIC_ROOT, name)
+    except ValueError:
+        raise Http404('Static file not found')
+    if name.startswith('.') or not os.path.isfile(full_path):
+        raise Http404('Static file not found')
+
+    precompressed = [
+        encoding for encoding, suffix in SUFFIXES.items()
+        if os.path.isfile(full_path + suffix)
+    ]
+    encoding = negotiate_encoding(
+        request.META.get('HTTP_ACCEPT_ENCODING'), precompressed
+    )
+    if encoding:
+        full_path += SUFFIXES[encoding]
+    stat = os.stat(full_path)
+    etag, cache_control = _validators(name, stat)
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = _file_response(request, full_path, stat.st_size,
+                                  content_type, etag)
+    if encoding and response.status_code != 304:
+        response['Content-Encoding'] = encoding
+    if precompressed:
+        response['Vary'] = 'Accept-Encoding'
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    if response.status_code != 304:
+        response['Last-Modified'] = http_date(stat.st_mtime)
+    return response
+
+
+def _file_response(request, full_path, size, content_type, etag):
+    byte_range = None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range is None or if_range == etag:
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    start, end = byte_range or (0, size - 1)
+    response = FileResponse(
+        RangeFile(open(full_path, 'rb'), start, end - start + 1),
+        content_type=content_type,
+        status=206 if byte_range else 200,
+    )
+    response.block_size = 64 * 1024
+    response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+    if byte_range:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
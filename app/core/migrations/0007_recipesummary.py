@@ -0,0 +1,63 @@
+# Generated by Django 3.2.25 on 2026-10-19 08:51
+
+from django.conf import settings
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+BACKFILL_SQL = """
+INSERT INTO core_recipesummary (recipe_id, user_id, tag_ids, tag_names,
+                                ingredient_ids, ingredient_names)
+SELECT r.id, r.user_id,
+       COALESCE(t.ids, '{}'), COALESCE(t.names, '{}'),
+       COALESCE(i.ids, '{}'), COALESCE(i.names, '{}')
+FROM core_recipe r
+LEFT JOIN LATERAL (
+    SELECT array_agg(x.id ORDER BY x.id) AS ids,
+           array_agg(x.name ORDER BY x.id) AS names
+    FROM core_recipe_tags rt JOIN core_tag x ON x.id = rt.tag_id
+    WHERE rt.recipe_id = r.id
+) t ON true
+LEFT JOIN LATERAL (
+    SELECT array_agg(x.id ORDER BY x.id) AS ids,
+           array_agg(x.name ORDER BY x.id) AS names
+    FROM core_recipe_ingredients ri
+    JOIN core_ingredient x ON x.id = ri.ingredient_id
+    WHERE ri.recipe_id = r.id
+) i ON true
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_user_shard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeSummary',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='core.recipe')),
+                ('tag_ids', django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), default=list, size=None)),
+                ('tag_names', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=256), default=list, size=None)),
+                ('ingredient_ids', django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), default=list, size=None)),
+                ('ingredient_names', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=256), default=list, size=None)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='recipesummary',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['tag_ids'], name='recipesummary_tag_ids_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='recipesummary',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['ingredient_ids'], name='recipesummary_ingr_ids_gin'),
+        ),
+        migrations.RunSQL(
+            sql=BACKFILL_SQL,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.25 on 2026-10-19 09:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_imageblob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserPurge',
+            fields=[
+                ('user_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('email', models.EmailField(max_length=128)),
+                ('requested_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(null=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('recipes_deleted', models.PositiveIntegerField(default=0)),
+                ('tags_deleted', models.PositiveIntegerField(default=0)),
+                ('ingredients_deleted', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,191 @@
+# Generated by Django 3.2.25 on 2026-10-19 09:30
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+# Changes of a user are numbered while holding a per-user advisory lock, so
+# they commit in sequence order and a reader never sees a number before a
+# smaller one that is still in flight. Setting core.track_changes to off
+# for a transaction skips tombstones and recipe touches, for purges and
+# shard moves which delete everything of a user.
+TRIGGERS_SQL = """
+CREATE SEQUENCE core_change_seq;
+
+CREATE FUNCTION core_number_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(NEW.user_id);
+    NEW.change_seq := nextval('core_change_seq');
+    IF TG_OP = 'UPDATE' THEN
+        NEW.updated_at := now();
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION core_record_tombstones() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('core.track_changes', true) = 'off' THEN
+        RETURN NULL;
+    END IF;
+    PERFORM pg_advisory_xact_lock(user_id)
+        FROM (SELECT DISTINCT user_id FROM old_rows ORDER BY user_id) users;
+    INSERT INTO core_tombstone (user_id, model, object_id, change_seq,
+                                deleted_at)
+    SELECT user_id, TG_ARGV[0], id, nextval('core_change_seq'), now()
+    FROM old_rows ORDER BY id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION core_touch_recipes() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('core.track_changes', true) = 'off' THEN
+        RETURN NULL;
+    END IF;
+    UPDATE core_recipe SET updated_at = now()
+    WHERE id IN (SELECT recipe_id FROM changed_rows);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER core_tag_change BEFORE INSERT OR UPDATE ON core_tag
+    FOR EACH ROW EXECUTE PROCEDURE core_number_change();
+CREATE TRIGGER core_ingredient_change
+    BEFORE INSERT OR UPDATE ON core_ingredient
+    FOR EACH ROW EXECUTE PROCEDURE core_number_change();
+CREATE TRIGGER core_recipe_change BEFORE INSERT OR UPDATE ON core_recipe
+    FOR EACH ROW EXECUTE PROCEDURE core_number_change();
+
+CREATE TRIGGER core_tag_tombstones AFTER DELETE ON core_tag
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT
+    EXECUTE PROCEDURE core_record_tombstones('tag');
+CREATE TRIGGER core_ingredient_tombstones AFTER DELETE ON core_ingredient
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT
+    EXECUTE PROCEDURE core_record_tombstones('ingredient');
+CREATE TRIGGER core_recipe_tombstones AFTER DELETE ON core_recipe
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT
+    EXECUTE PROCEDURE core_record_tombstones('recipe');
+
+CREATE TRIGGER core_recipe_tags_added AFTER INSERT ON core_recipe_tags
+    REFERENCING NEW TABLE AS changed_rows FOR EACH STATEMENT
+    EXECUTE PROCEDURE core_touch_recipes();
+CREATE TRIGGER core_recipe_tags_removed AFTER DELETE ON core_recipe_tags
+    REFERENCING OLD TABLE AS changed_rows FOR EACH STATEMENT
+    EXECUTE PROCEDURE core_touch_recipes();
+CREATE TRIGGER core_recipe_ingredients_added
+    AFTER INSERT ON core_recipe_ingredients
+    REFERENCING NEW TABLE AS changed_rows FOR EACH STATEMENT
+    EXECUTE PROCEDURE core_touch_recipes();
+CREATE TRIGGER core_recipe_ingredients_removed
+    AFTER DELETE ON core_recipe_ingredients
+    REFERENCING OLD TABLE AS changed_rows FOR EACH STATEMENT
+    EXECUTE PROCEDURE core_touch_recipes();
+"""
+
+DROP_TRIGGERS_SQL = """
+DROP TRIGGER core_recipe_ingredients_removed ON core_recipe_ingredients;
+DROP TRIGGER core_recipe_ingredients_added ON core_recipe_ingredients;
+DROP TRIGGER core_recipe_tags_removed ON core_recipe_tags;
+DROP TRIGGER core_recipe_tags_added ON core_recipe_tags;
+DROP TRIGGER core_recipe_tombstones ON core_recipe;
+DROP TRIGGER core_ingredient_tombstones ON core_ingredient;
+DROP TRIGGER core_tag_tombstones ON core_tag;
+DROP TRIGGER core_recipe_change ON core_recipe;
+DROP TRIGGER core_ingredient_change ON core_ingredient;
+DROP TRIGGER core_tag_change ON core_tag;
+DROP FUNCTION core_touch_recipes();
+DROP FUNCTION core_record_tombstones();
+DROP FUNCTION core_number_change();
+DROP SEQUENCE core_change_seq;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_task'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.BigIntegerField()),
+                ('model', models.CharField(max_length=32)),
+                ('object_id', models.BigIntegerField()),
+                ('change_seq', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='change_seq',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='change_seq',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='change_seq',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(fields=['user', 'change_seq'], name='ingredient_change_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'change_seq'], name='recipe_change_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['user', 'change_seq'], name='tag_change_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['user_id', 'change_seq'], name='tombstone_change_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['deleted_at'], name='tombstone_deleted_idx'),
+        ),
+        migrations.RunSQL(sql=TRIGGERS_SQL, reverse_sql=DROP_TRIGGERS_SQL),
+    ]
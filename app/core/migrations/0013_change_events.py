@@ -0,0 +1,94 @@
+from django.db import migrations
+
+
+# Every numbered change is also announced on the core_change channel once
+# its transaction commits, as {"user", "type", "op", "id", "seq"}.
+NOTIFY_SQL = """
+CREATE OR REPLACE FUNCTION core_number_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(NEW.user_id);
+    NEW.change_seq := nextval('core_change_seq');
+    IF TG_OP = 'UPDATE' THEN
+        NEW.updated_at := now();
+    END IF;
+    IF current_setting('core.track_changes', true) IS DISTINCT FROM 'off'
+    THEN
+        PERFORM pg_notify('core_change', json_build_object(
+            'user', NEW.user_id,
+            'type', substr(TG_TABLE_NAME, 6),
+            'op', CASE TG_OP WHEN 'INSERT' THEN 'create' ELSE 'update' END,
+            'id', NEW.id,
+            'seq', NEW.change_seq
+        )::text);
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION core_record_tombstones() RETURNS trigger AS $$
+DECLARE
+    tombstone record;
+BEGIN
+    IF current_setting('core.track_changes', true) = 'off' THEN
+        RETURN NULL;
+    END IF;
+    PERFORM pg_advisory_xact_lock(user_id)
+        FROM (SELECT DISTINCT user_id FROM old_rows ORDER BY user_id) users;
+    FOR tombstone IN
+        INSERT INTO core_tombstone (user_id, model, object_id, change_seq,
+                                    deleted_at)
+        SELECT user_id, TG_ARGV[0], id, nextval('core_change_seq'), now()
+        FROM old_rows ORDER BY id
+        RETURNING user_id, model, object_id, change_seq
+    LOOP
+        PERFORM pg_notify('core_change', json_build_object(
+            'user', tombstone.user_id,
+            'type', tombstone.model,
+            'op', 'delete',
+            'id', tombstone.object_id,
+            'seq', tombstone.change_seq
+        )::text);
+    END LOOP;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+SILENT_SQL = """
+CREATE OR REPLACE FUNCTION core_number_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(NEW.user_id);
+    NEW.change_seq := nextval('core_change_seq');
+    IF TG_OP = 'UPDATE' THEN
+        NEW.updated_at := now();
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION core_record_tombstones() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('core.track_changes', true) = 'off' THEN
+        RETURN NULL;
+    END IF;
+    PERFORM pg_advisory_xact_lock(user_id)
+        FROM (SELECT DISTINCT user_id FROM old_rows ORDER BY user_id) users;
+    INSERT INTO core_tombstone (user_id, model, object_id, change_seq,
+                                deleted_at)
+    SELECT user_id, TG_ARGV[0], id, nextval('core_change_seq'), now()
+    FROM old_rows ORDER BY id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_change_tracking'),
+    ]
+
+    operations = [
+        migrations.RunSQL(sql=NOTIFY_SQL, reverse_sql=SILENT_SQL),
+    ]
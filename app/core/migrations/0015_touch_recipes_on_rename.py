@@ -0,0 +1,49 @@
+from django.db import migrations
+
+
+# Renaming a tag or ingredient renumbers the recipes using it, whose
+# representations carry the name.
+TRIGGERS_SQL = """
+CREATE FUNCTION core_touch_renamed_recipes() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('core.track_changes', true) = 'off' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_TABLE_NAME = 'core_tag' THEN
+        UPDATE core_recipe SET updated_at = now() WHERE id IN (
+            SELECT recipe_id FROM core_recipe_tags WHERE tag_id = NEW.id
+        );
+    ELSE
+        UPDATE core_recipe SET updated_at = now() WHERE id IN (
+            SELECT recipe_id FROM core_recipe_ingredients
+            WHERE ingredient_id = NEW.id
+        );
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER core_tag_renamed AFTER UPDATE OF name ON core_tag
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE PROCEDURE core_touch_renamed_recipes();
+CREATE TRIGGER core_ingredient_renamed AFTER UPDATE OF name ON core_ingredient
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE PROCEDURE core_touch_renamed_recipes();
+"""
+
+DROP_TRIGGERS_SQL = """
+DROP TRIGGER core_ingredient_renamed ON core_ingredient;
+DROP TRIGGER core_tag_renamed ON core_tag;
+DROP FUNCTION core_touch_renamed_recipes();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_recipe_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(sql=TRIGGERS_SQL, reverse_sql=DROP_TRIGGERS_SQL),
+    ]
@@ -0,0 +1,78 @@
+import django.contrib.postgres.indexes
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.expressions
+import django.db.models.functions.text
+
+import core.search
+
+
+# accented latin letters and the letters they are folded to
+ACCENTED = (
+    'ÀÁÂÃÄÅÇÈÉÊËÌÍÎÏÑÒÓÔÕÖÙÚÛÜÝàáâãäåçèéêëìíîïñòóôõöùúûüýÿĀāĂăĄąĆ'
+    'ćĈĉĊċČčĎďĒēĔĕĖėĘęĚěĜĝĞğĠġĢģĤĥĨĩĪīĬĭĮįİĴĵĶķĹĺĻļĽľŃńŅņŇňŌōŎŏŐő'
+    'ŔŕŖŗŘřŚśŜŝŞşŠšŢţŤťŨũŪūŬŭŮůŰűŲųŴŵŶŷŸŹźŻżŽžƠơƯưǍǎǏǐǑǒǓǔǕǖǗǘǙǚǛ'
+    'ǜǞǟǠǡǦǧǨǩǪǫǬǭǰǴǵǸǹǺǻȀȁȂȃȄȅȆȇȈȉȊȋȌȍȎȏȐȑȒȓȔȕȖȗȘșȚțȞȟȦȧȨȩȪȫȬȭȮȯ'
+    'ȰȱȲȳØøĐđŁłĦħıŦŧ'
+)
+FOLDED = (
+    'AAAAAACEEEEIIIINOOOOOUUUUYaaaaaaceeeeiiiinooooouuuuyyAaAaAaC'
+    'cCcCcCcDdEeEeEeEeEeGgGgGgGgHhIiIiIiIiIJjKkLlLlLlNnNnNnOoOoOo'
+    'RrRrRrSsSsSsSsTtTtUuUuUuUuUuUuWwYyYZzZzZzOoUuAaIiOoUuUuUuUuU'
+    'uAaAaGgKkOoOojGgNnAaAaAaEeEeIiIiOoOoRrRrUuUuSsTtHhAaEeOoOoOo'
+    'OoYyOoDdLlHhiTt'
+)
+
+# unaccent() from contrib is only STABLE and can not be indexed, this
+# folds the latin letters with translate(), which is immutable
+UNACCENT_SQL = f"""
+CREATE FUNCTION core_unaccent(text) RETURNS text AS $$
+    SELECT replace(replace(replace(replace(replace(
+        translate($1, '{ACCENTED}', '{FOLDED}'),
+        'Æ', 'AE'), 'æ', 'ae'), 'Œ', 'OE'), 'œ', 'oe'), 'ß', 'ss')
+$$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE;
+"""
+
+DROP_UNACCENT_SQL = 'DROP FUNCTION core_unaccent(text);'
+
+# Django 3.2 puts OpClass inside the parentheses of the index expression,
+# so the indexes are created here
+INDEXES_SQL = """
+CREATE INDEX tag_name_prefix_idx ON core_tag
+    (user_id, (lower(core_unaccent(name))) text_pattern_ops);
+CREATE INDEX ingredient_name_prefix_idx ON core_ingredient
+    (user_id, (lower(core_unaccent(name))) text_pattern_ops);
+"""
+
+DROP_INDEXES_SQL = """
+DROP INDEX ingredient_name_prefix_idx;
+DROP INDEX tag_name_prefix_idx;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0015_touch_recipes_on_rename'),
+    ]
+
+    operations = [
+        migrations.RunSQL(sql=UNACCENT_SQL, reverse_sql=DROP_UNACCENT_SQL),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(sql=INDEXES_SQL,
+                                  reverse_sql=DROP_INDEXES_SQL),
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='ingredient',
+                    index=models.Index(django.db.models.expressions.F('user'), django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Lower(core.search.Unaccent('name')), 'text_pattern_ops'), name='ingredient_name_prefix_idx'),
+                ),
+                migrations.AddIndex(
+                    model_name='tag',
+                    index=models.Index(django.db.models.expressions.F('user'), django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Lower(core.search.Unaccent('name')), 'text_pattern_ops'), name='tag_name_prefix_idx'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,81 @@
+from django.db import migrations, models
+
+
+# Updates made with change tracking off, such as backfills of derived
+# columns, keep their change number so clients do not fetch the rows again.
+KEEP_SEQ_SQL = """
+CREATE OR REPLACE FUNCTION core_number_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND current_setting('core.track_changes', true) = 'off' THEN
+        RETURN NEW;
+    END IF;
+    PERFORM pg_advisory_xact_lock(NEW.user_id);
+    NEW.change_seq := nextval('core_change_seq');
+    IF TG_OP = 'UPDATE' THEN
+        NEW.updated_at := now();
+    END IF;
+    IF current_setting('core.track_changes', true) IS DISTINCT FROM 'off'
+    THEN
+        PERFORM pg_notify('core_change', json_build_object(
+            'user', NEW.user_id,
+            'type', substr(TG_TABLE_NAME, 6),
+            'op', CASE TG_OP WHEN 'INSERT' THEN 'create' ELSE 'update' END,
+            'id', NEW.id,
+            'seq', NEW.change_seq
+        )::text);
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+RENUMBER_SQL = """
+CREATE OR REPLACE FUNCTION core_number_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(NEW.user_id);
+    NEW.change_seq := nextval('core_change_seq');
+    IF TG_OP = 'UPDATE' THEN
+        NEW.updated_at := now();
+    END IF;
+    IF current_setting('core.track_changes', true) IS DISTINCT FROM 'off'
+    THEN
+        PERFORM pg_notify('core_change', json_build_object(
+            'user', NEW.user_id,
+            'type', substr(TG_TABLE_NAME, 6),
+            'op', CASE TG_OP WHEN 'INSERT' THEN 'create' ELSE 'update' END,
+            'id', NEW.id,
+            'seq', NEW.change_seq
+        )::text);
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_name_prefix_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CanonicalIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=256, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='canonical_id',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(fields=['canonical_id'], name='ingredient_canonical_idx'),
+        ),
+        migrations.RunSQL(sql=KEEP_SEQ_SQL, reverse_sql=RENUMBER_SQL),
+    ]
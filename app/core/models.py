@@ -1,6 +1,11 @@
 import uuid
 import os
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Lower
+from django.utils import timezone
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
@@ -8,6 +13,9 @@ from django.contrib.auth.models import (
 )
 from django.conf import settings
 
+from .search import search_name
+from .sharding import shard_for_user
+
 
 def recipe_image_file_path(instance, filename):
     """ Generate filepath for new recipe image """
@@ -17,6 +25,16 @@ def recipe_image_file_path(instance, filename):
     return os.path.join('uploads/recipe/', filename)
 
 
+class UserDataQuerySet(models.QuerySet):
+    """ Queryset creating per-user rows on the shard of their user """
+
+    def create(self, **kwargs):
+        user = kwargs.get('user')
+        if self._db is None and user is not None:
+            return self.using(shard_for_user(user)).create(**kwargs)
+        return super().create(**kwargs)
+
+
 class UserManager(BaseUserManager):
     def create_user(self, email, password=None, **kwargs):
         """ Creates and saves a new user """
@@ -49,30 +67,95 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
 
+    # database alias holding the user's tags, ingredients and recipes
+    shard = models.CharField(max_length=64, blank=True)
+    shard_moving = models.BooleanField(default=False)
+
     objects = UserManager()
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['name']
 
 
-class Tag(models.Model):
+class ChangeTrackedModel(models.Model):
+    """
+    Per-user model whose changes are numbered for delta sync.
+
+    change_seq is assigned from the database's change sequence by a
+    trigger on every insert and update, including queryset updates and
+    raw SQL. Deleted rows are recorded as tombstones by another trigger.
+    Recipes are also renumbered when their tags or ingredients change or
+    are renamed.
+    """
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    change_seq = models.BigIntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+        indexes = [
+            models.Index(fields=['user', 'change_seq'],
+                         name='%(class)s_change_idx'),
+        ]
+
+
+class Tag(ChangeTrackedModel):
     """ Tag to be used for a recipe """
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     name = models.CharField(max_length=256)
 
+    objects = UserDataQuerySet.as_manager()
+
+    class Meta(ChangeTrackedModel.Meta):
+        indexes = ChangeTrackedModel.Meta.indexes + [
+            # prefix matches of autocomplete
+            models.Index(
+                F('user'), OpClass(search_name('name'), 'text_pattern_ops'),
+                name='tag_name_prefix_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class CanonicalIngredient(models.Model):
+    """
+    Normalized ingredient name shared by the ingredients of all users,
+    kept in the global database. Names are interned and never deleted.
+    """
+    name = models.CharField(max_length=256, unique=True)
+
     def __str__(self):
         return self.name
 
 
-class Ingredient(models.Model):
+class Ingredient(ChangeTrackedModel):
     """ Ingredient to be used in recipe """
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     name = models.CharField(max_length=256)
+    # CanonicalIngredient of the name, which lives in the global database
+    # rather than the user's shard, so there is no foreign key
+    canonical_id = models.BigIntegerField(null=True, blank=True,
+                                          editable=False)
+
+    objects = UserDataQuerySet.as_manager()
+
+    class Meta(ChangeTrackedModel.Meta):
+        indexes = ChangeTrackedModel.Meta.indexes + [
+            # prefix matches of autocomplete
+            models.Index(
+                F('user'), OpClass(search_name('name'), 'text_pattern_ops'),
+                name='ingredient_name_prefix_idx',
+            ),
+            models.Index(fields=['canonical_id'],
+                         name='ingredient_canonical_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
-class Recipe(models.Model):
+class Recipe(ChangeTrackedModel):
     """ Recipe object """
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     title = models.CharField(max_length=128)
@@ -83,5 +166,185 @@ class Recipe(models.Model):
     tags = models.ManyToManyField(Tag)
     image = models.ImageField(null=True, upload_to=recipe_image_file_path)
 
+    objects = UserDataQuerySet.as_manager()
+
+    class Meta(ChangeTrackedModel.Meta):
+        # the sort orders of the recipe list, ending in id so that pages
+        # are index range scans and can be continued from their last row
+        indexes = ChangeTrackedModel.Meta.indexes + [
+            models.Index(fields=['user', 'price', 'id'],
+                         name='recipe_price_idx'),
+            models.Index(fields=['user', 'time_minutes', 'id'],
+                         name='recipe_time_idx'),
+            models.Index(F('user'), Lower('title'), F('id'),
+                         name='recipe_title_idx'),
+        ]
+
     def __str__(self):
         return self.title
+
+
+class Tombstone(models.Model):
+    """
+    Deleted tag, ingredient or recipe, kept for delta sync. Rows deleted
+    together with their user leave tombstones, so there is no foreign key.
+    """
+    user_id = models.BigIntegerField()
+    model = models.CharField(max_length=32)
+    object_id = models.BigIntegerField()
+    change_seq = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_id', 'change_seq'],
+                         name='tombstone_change_idx'),
+            models.Index(fields=['deleted_at'], name='tombstone_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.model} {self.object_id}'
+
+
+class RecipeSummary(models.Model):
+    """ Denormalized tags and ingredients of a recipe used for list reads """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='summary',
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE
+    )
+    tag_ids = ArrayField(models.BigIntegerField(), default=list)
+    tag_names = ArrayField(models.CharField(max_length=256), default=list)
+    ingredient_ids = ArrayField(models.BigIntegerField(), default=list)
+    ingredient_names = ArrayField(
+        models.CharField(max_length=256),
+        default=list,
+    )
+
+    objects = UserDataQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['tag_ids'], name='recipesummary_tag_ids_gin'),
+            GinIndex(
+                fields=['ingredient_ids'],
+                name='recipesummary_ingr_ids_gin',
+            ),
+        ]
+
+    def __str__(self):
+        return str(self.recipe_id)
+
+
+class RecipeStats(models.Model):
+    """ Per-user recipe statistics maintained incrementally """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='recipe_stats',
+    )
+    recipe_count = models.PositiveIntegerField(default=0)
+    price_total = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        default=0,
+    )
+    time_total = models.BigIntegerField(default=0)
+    # value -> number of recipes, used for percentiles
+    price_counts = models.JSONField(default=dict)
+    time_counts = models.JSONField(default=dict)
+    # tag / ingredient id -> number of recipes using it
+    tag_counts = models.JSONField(default=dict)
+    ingredient_counts = models.JSONField(default=dict)
+
+    objects = UserDataQuerySet.as_manager()
+
+    def __str__(self):
+        return str(self.user_id)
+
+
+class ImageBlob(models.Model):
+    """ Reference count of a stored media file shared by recipes """
+    name = models.CharField(max_length=255, primary_key=True)
+    ref_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['updated_at'],
+                name='imageblob_orphans_idx',
+                condition=models.Q(ref_count__lte=0),
+            ),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class UserPurge(models.Model):
+    """ Progress of the background deletion of a user account """
+    user_id = models.BigIntegerField(primary_key=True)
+    email = models.EmailField(max_length=128)
+    requested_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+    recipes_deleted = models.PositiveIntegerField(default=0)
+    tags_deleted = models.PositiveIntegerField(default=0)
+    ingredients_deleted = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.email} ({self.user_id})'
+
+
+class Task(models.Model):
+    """ Job of the database-backed task queue """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (FAILED, 'Failed'),
+    ]
+
+    queue = models.CharField(max_length=64, default='default')
+    name = models.CharField(max_length=255)
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    # higher priorities are claimed first
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(
+        max_length=16,
+        choices=STATUS_CHOICES,
+        default=QUEUED,
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=128, blank=True)
+    locked_at = models.DateTimeField(null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['queue', '-priority', 'run_at', 'id'],
+                name='task_claim_idx',
+                condition=models.Q(status='queued'),
+            ),
+            models.Index(
+                fields=['locked_at'],
+                name='task_running_idx',
+                condition=models.Q(status='running'),
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.pk})'
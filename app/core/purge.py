@@ -0,0 +1,172 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from . import cookable, imagestore, similarity, sync
+from .models import (
+    User,
+    Tag,
+    Ingredient,
+    Recipe,
+    RecipeStats,
+    RecipeSummary,
+    Tombstone,
+    UserPurge,
+)
+from .sharding import global_database, shard_for_user
+
+
+def request_purge(user):
+    """
+    Deactivate a user and record the deletion of the account, freeing
+    the email address right away. Returns the purge record.
+    """
+    with transaction.atomic(using=global_database()):
+        purge, _ = UserPurge.objects.using(global_database()).get_or_create(
+            user_id=user.pk, defaults={'email': user.email}
+        )
+        user.is_active = False
+        user.email = f'{user.pk}@deleted.invalid'
+        user.set_unusable_password()
+        user.save(using=global_database())
+        Token.objects.using(global_database()).filter(user=user).delete()
+    return purge
+
+
+def _quote(connection, model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def _delete_recipe_batch(connection, user_id, batch_size):
+    """ Delete one batch of recipes with their relations in one statement """
+    qn = connection.ops.quote_name
+    recipe = _quote(connection, Recipe)
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            WITH batch AS (
+                SELECT id FROM {recipe}
+                WHERE user_id = %(user)s
+                ORDER BY id
+                LIMIT %(limit)s
+                FOR UPDATE
+            ), tags AS (
+                DELETE FROM {_quote(connection, Recipe.tags.through)}
+                WHERE recipe_id IN (SELECT id FROM batch)
+            ), ingredients AS (
+                DELETE FROM {_quote(connection, Recipe.ingredients.through)}
+                WHERE recipe_id IN (SELECT id FROM batch)
+            ), summaries AS (
+                DELETE FROM {_quote(connection, RecipeSummary)}
+                WHERE recipe_id IN (SELECT id FROM batch)
+            )
+            DELETE FROM {recipe}
+            WHERE id IN (SELECT id FROM batch)
+            RETURNING {qn('image')}
+        """, {'user': user_id, 'limit': batch_size})
+        return [image for image, in cursor.fetchall()]
+
+
+def _delete_attribute_batch(connection, model, user_id, batch_size):
+    """ Delete one batch of tags or ingredients and their recipe links """
+    if model is Tag:
+        column, through = 'tag_id', Recipe.tags.through
+    else:
+        column, through = 'ingredient_id', Recipe.ingredients.through
+    table = _quote(connection, model)
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            WITH batch AS (
+                SELECT id FROM {table}
+                WHERE user_id = %(user)s
+                ORDER BY id
+                LIMIT %(limit)s
+                FOR UPDATE
+            ), links AS (
+                DELETE FROM {_quote(connection, through)}
+                WHERE {column} IN (SELECT id FROM batch)
+            )
+            DELETE FROM {table}
+            WHERE id IN (SELECT id FROM batch)
+        """, {'user': user_id, 'limit': batch_size})
+        return cursor.rowcount
+
+
+def purge_user(purge, batch_size=None, progress=None):
+    """
+    Delete everything owned by the user of a purge record in bounded
+    batches, each in its own short transaction, then the user itself.
+
+    progress(purge) is called after every batch. Returns False when the
+    user is being moved to another shard and the purge must be retried.
+    """
+    batch_size = batch_size or settings.USER_PURGE_BATCH_SIZE
+    purges = UserPurge.objects.using(global_database())
+    user = User.objects.using(global_database()).filter(
+        pk=purge.user_id
+    ).first()
+    if user is not None and user.shard_moving:
+        return False
+
+    if purge.started_at is None:
+        purge.started_at = timezone.now()
+        purges.filter(pk=purge.pk).update(started_at=purge.started_at)
+
+    if user is not None:
+        using = shard_for_user(user)
+        connection = connections[using]
+        RecipeStats.objects.using(using).filter(user_id=user.pk).delete()
+
+        while True:
+            with transaction.atomic(using=using):
+                sync.skip_change_tracking(using)
+                images = _delete_recipe_batch(connection, user.pk, batch_size)
+            if not images:
+                break
+            for name, count in Counter(filter(None, images)).items():
+                imagestore.remove_reference(name, count=count)
+            _advance(purge, 'recipes_deleted', len(images), progress)
+
+        for model, field in ((Tag, 'tags_deleted'),
+                             (Ingredient, 'ingredients_deleted')):
+            while True:
+                with transaction.atomic(using=using):
+                    sync.skip_change_tracking(using)
+                    deleted = _delete_attribute_batch(
+                        connection, model, user.pk, batch_size
+                    )
+                if not deleted:
+                    break
+                _advance(purge, field, deleted, progress)
+
+        # only the user rows, tombstones and small global relations are left
+        Tombstone.objects.using(using).filter(user_id=user.pk).delete()
+        if using != global_database():
+            User.objects.using(using).filter(pk=user.pk).delete()
+        User.objects.using(global_database()).filter(pk=user.pk).delete()
+        similarity.invalidate(user.pk)
+        cookable.apply_change(user.pk)
+
+    purge.finished_at = timezone.now()
+    purges.filter(pk=purge.pk).update(finished_at=purge.finished_at)
+    if progress is not None:
+        progress(purge)
+    return True
+
+
+def _advance(purge, field, count, progress):
+    setattr(purge, field, getattr(purge, field) + count)
+    UserPurge.objects.using(global_database()).filter(pk=purge.pk).update(
+        **{field: F(field) + count}
+    )
+    if progress is not None:
+        progress(purge)
+
+
+def pending_purges():
+    return UserPurge.objects.using(global_database()).filter(
+        finished_at__isnull=True
+    ).order_by('requested_at')
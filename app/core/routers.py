@@ -0,0 +1,54 @@
+from django.conf import settings
+
+from .sharding import (
+    global_database,
+    is_sharded,
+    is_sharded_model,
+    shard_for_user,
+    shard_for_user_id,
+)
+
+
+class UserShardRouter:
+    """
+    Route per-user models (tags, ingredients, recipes) to the shard owning
+    their user and everything else to the global database
+    """
+
+    def _db_for_model(self, model, **hints):
+        if not is_sharded():
+            return None
+
+        instance = hints.get('instance')
+        if not is_sharded_model(model):
+            if instance is None or is_sharded_model(type(instance)):
+                return global_database()
+            return None
+
+        if instance is None:
+            return None
+        if instance._meta.label == settings.AUTH_USER_MODEL:
+            return shard_for_user(instance)
+        if instance._state.db:
+            return instance._state.db
+
+        if getattr(instance, 'user_id', None) is None:
+            return None
+        if type(instance).user.is_cached(instance):
+            return shard_for_user(instance.user)
+        return shard_for_user_id(instance.user_id)
+
+    def db_for_read(self, model, **hints):
+        return self._db_for_model(model, **hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for_model(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """ Users are mirrored to every shard holding their data """
+        if is_sharded_model(type(obj1)) or is_sharded_model(type(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
@@ -0,0 +1,59 @@
+from django.db import connections
+from django.db.models import CharField, Func
+from django.db.models.functions import Lower
+
+# sorts after every character, ends the range of names with a prefix
+MAX_CHAR = '\U0010ffff'
+
+
+class Unaccent(Func):
+    """ core_unaccent() of the database, folding accented latin letters """
+    function = 'core_unaccent'
+    output_field = CharField()
+
+
+def search_name(expression):
+    """ Return the case and accent insensitive form names are matched on """
+    return Lower(Unaccent(expression))
+
+
+def autocomplete(model, user_id, prefix, limit, using='default'):
+    """
+    Return (id, name, uses) of the user's tags or ingredients whose name
+    starts with prefix, most used in recipes first.
+
+    The prefix is matched as a range of the name prefix index rather than
+    with LIKE, which would fold the name of every candidate again. Uses
+    come from the counts kept in the user's RecipeStats row, read once
+    and hash joined, so one-letter prefixes matching most of a large
+    catalog count nothing per candidate. The row must exist.
+    """
+    # models build their name indexes with search_name()
+    from .models import RecipeStats
+
+    counts = f'{model._meta.model_name}_counts'
+    name = 'lower(core_unaccent(x.name))'
+    sql = f'''
+        WITH counts AS (
+            SELECT c.key::bigint AS id, c.value::bigint AS uses
+            FROM "{RecipeStats._meta.db_table}" s,
+                 jsonb_each_text(s.{counts}) c
+            WHERE s.user_id = %(user)s
+        )
+        SELECT x.id, x.name, COALESCE(counts.uses, 0) AS uses
+        FROM "{model._meta.db_table}" x
+        LEFT JOIN counts ON counts.id = x.id
+        WHERE x.user_id = %(user)s
+          AND {name} ~>=~ lower(core_unaccent(%(start)s))
+          AND {name} ~<~ lower(core_unaccent(%(end)s))
+        ORDER BY uses DESC, x.name, x.id
+        LIMIT %(limit)s
+    '''
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, {
+            'user': user_id,
+            'start': prefix,
+            'end': prefix + MAX_CHAR,
+            'limit': limit,
+        })
+        return cursor.fetchall()
@@ -0,0 +1,19 @@
+from django.conf import settings
+from rest_framework import serializers
+
+METHODS = ('GET', 'HEAD', 'OPTIONS', 'POST', 'PUT', 'PATCH', 'DELETE')
+
+
+class BatchRequestSerializer(serializers.Serializer):
+    """ Serializer of one request of a batch """
+    method = serializers.ChoiceField(choices=METHODS, default='GET')
+    path = serializers.CharField(max_length=2000)
+    body = serializers.JSONField(required=False)
+
+
+class BatchSerializer(serializers.Serializer):
+    """ Serializer of a batch of API requests """
+    requests = BatchRequestSerializer(
+        many=True, allow_empty=False, max_length=settings.BATCH_MAX_REQUESTS
+    )
+    parallel = serializers.BooleanField(default=False)
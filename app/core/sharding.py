@@ -0,0 +1,182 @@
+import bisect
+import hashlib
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+
+GLOBAL_DATABASE = 'default'
+
+# Every shard allocates primary keys from its own block so rows keep their
+# ids when a user is moved to another shard.
+SHARD_ID_BLOCK = 1 << 40
+
+
+class HashRing:
+    """ Consistent hash ring mapping keys to database aliases """
+
+    def __init__(self, nodes, replicas=64):
+        self.nodes = list(nodes)
+        self._ring = sorted(
+            (self._hash(f'{node}:{replica}'), node)
+            for node in self.nodes
+            for replica in range(replicas)
+        )
+        self._keys = [key for key, _ in self._ring]
+
+    @staticmethod
+    def _hash(value):
+        digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'big')
+
+    def get_node(self, key):
+        """ Return the node owning the given key """
+        if not self._ring:
+            raise ValueError('Hash ring has no nodes')
+
+        idx = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._ring[idx][1]
+
+
+@lru_cache(maxsize=8)
+def _ring_for(shards):
+    return HashRing(shards)
+
+
+def get_ring():
+    """ Return the hash ring for the configured shards """
+    return _ring_for(tuple(settings.DATABASE_SHARDS))
+
+
+def is_sharded():
+    return bool(settings.DATABASE_SHARDS)
+
+
+def global_database():
+    return getattr(settings, 'SHARD_GLOBAL_DATABASE', GLOBAL_DATABASE)
+
+
+def data_databases():
+    """ Return the aliases of every database holding user data """
+    if not is_sharded():
+        return [global_database()]
+    return list(settings.DATABASE_SHARDS)
+
+
+def placement_for_user_id(user_id):
+    """ Return the shard the hash ring assigns to a user id """
+    if not is_sharded():
+        return global_database()
+    return get_ring().get_node(user_id)
+
+
+def shard_for_user(user):
+    """ Return the database alias holding the user's data """
+    if not is_sharded():
+        return global_database()
+    return getattr(user, 'shard', '') or placement_for_user_id(user.pk)
+
+
+def shard_for_user_id(user_id):
+    """ Return the database alias holding data of the user with given id """
+    if not is_sharded():
+        return global_database()
+
+    from .models import User
+
+    shard = User.objects.using(global_database()).filter(
+        pk=user_id
+    ).values_list('shard', flat=True).first()
+    return shard or placement_for_user_id(user_id)
+
+
+def sharded_models():
+    """
+    Return per-user models in insertion order with the lookup selecting
+    rows that belong to a user
+    """
+    from .models import (
+        Tag, Ingredient, Recipe, RecipeSummary, RecipeStats, Tombstone,
+    )
+
+    return [
+        (Tag, 'user_id'),
+        (Ingredient, 'user_id'),
+        (Recipe, 'user_id'),
+        (Recipe.tags.through, 'recipe__user_id'),
+        (Recipe.ingredients.through, 'recipe__user_id'),
+        (RecipeSummary, 'user_id'),
+        (RecipeStats, 'user_id'),
+        (Tombstone, 'user_id'),
+    ]
+
+
+def is_sharded_model(model):
+    return any(model is sharded for sharded, _ in sharded_models())
+
+
+def mirror_user(user, using):
+    """ Copy the user row to a shard so foreign keys there stay valid """
+    from .models import User
+
+    fields = {
+        field.attname: getattr(user, field.attname)
+        for field in User._meta.concrete_fields
+        if not field.primary_key
+    }
+    User.objects.using(using).update_or_create(pk=user.pk, defaults=fields)
+
+
+def move_user(user, target, batch_size=1000):
+    """
+    Move all per-user rows of the user to the target shard.
+
+    Reads keep being served from the source shard while rows are copied;
+    writes are rejected until the directory entry is flipped.
+    """
+    from . import sync
+    from .models import User
+
+    source = shard_for_user(user)
+    if source == target:
+        return 0
+
+    users = User.objects.using(global_database()).filter(pk=user.pk)
+    users.update(shard_moving=True)
+    copied = 0
+    try:
+        mirror_user(user, using=target)
+        # copied rows are numbered after every change the client saw
+        sync.align_sequence(source, target)
+        with transaction.atomic(using=target):
+            # the rows are not new to the user, send no change events
+            sync.skip_change_tracking(target)
+            for model, lookup in sharded_models():
+                rows = model.objects.using(source).filter(
+                    **{lookup: user.pk}
+                ).order_by('pk')
+                batch = []
+                for row in rows.iterator(chunk_size=batch_size):
+                    batch.append(row)
+                    if len(batch) >= batch_size:
+                        model.objects.using(target).bulk_create(batch)
+                        copied += len(batch)
+                        batch = []
+                model.objects.using(target).bulk_create(batch)
+                copied += len(batch)
+    except Exception:
+        users.update(shard_moving=False)
+        raise
+
+    users.update(shard=target, shard_moving=False)
+
+    user.shard = target
+    user.shard_moving = False
+    with transaction.atomic(using=source):
+        sync.skip_change_tracking(source)
+        for model, lookup in reversed(sharded_models()):
+            model.objects.using(source).filter(
+                **{lookup: user.pk}
+            )._raw_delete(source)
+
+    return copied
@@ -0,0 +1,431 @@
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+MAGIC = b'RCPSHM01'
+
+# magic, slot size, ways, sets
+HEADER = struct.Struct('<8sIII')
+HEADER_SIZE = 64
+
+# key hash, expiry (0 never expires), value length, key length,
+# used flag, CLOCK reference bit
+SLOT = struct.Struct('<QdIHBB')
+
+# byte of the file locked while creating or resizing it, stripe locks
+# follow it
+INIT_LOCK = 0
+
+# values larger than a slot are split into chunks stored under keys of
+# their own, the slot of the key then holds CHUNKED (no pickle starts with
+# it) and the nonce naming the chunks, their count and the value length
+CHUNKED = b'\x00chunks'
+MANIFEST = struct.Struct('<8sII')
+
+logger = logging.getLogger(__name__)
+
+_regions = {}
+_regions_lock = threading.Lock()
+
+
+class Region:
+    """
+    Memory-mapped table of fixed-size slots shared by the processes of a host.
+
+    Keys hash to a set of `ways` slots. Every set belongs to one of
+    `stripes` locks, taken with a thread lock inside the process and a
+    byte-range lock on the file across processes. A full set evicts with
+    the CLOCK algorithm, a reference bit per slot and a hand per set.
+    """
+
+    def __init__(self, path, size, slot_size, ways, stripes):
+        self.path = path
+        self.slot_size = slot_size
+        self.ways = ways
+        self.sets = max(1, size // (slot_size * ways))
+        self.stripes = min(stripes, self.sets)
+        self.capacity = slot_size - SLOT.size
+        self.hands_offset = HEADER_SIZE
+        self.slots_offset = HEADER_SIZE + -(-self.sets // 8) * 8
+        self.length = self.slots_offset + self.sets * ways * slot_size
+        self.locks = [threading.Lock() for _ in range(self.stripes)]
+        self.fd = self._open()
+        self.map = mmap.mmap(self.fd, self.length)
+
+    def _header(self):
+        return HEADER.pack(MAGIC, self.slot_size, self.ways, self.sets)
+
+    def _open(self):
+        """ Open the file, creating it or replacing one of another layout """
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX, 1, INIT_LOCK)
+                try:
+                    ready = self._prepare(fd)
+                finally:
+                    fcntl.lockf(fd, fcntl.LOCK_UN, 1, INIT_LOCK)
+            except BaseException:
+                os.close(fd)
+                raise
+            if ready:
+                return fd
+            os.close(fd)
+
+    def _prepare(self, fd):
+        """ Initialise the locked file, False if it has to be reopened """
+        try:
+            if os.stat(self.path).st_ino != os.fstat(fd).st_ino:
+                # replaced while waiting for the lock
+                return False
+        except FileNotFoundError:
+            return False
+        size = os.fstat(fd).st_size
+        if size == 0:
+            os.ftruncate(fd, self.length)
+            os.pwrite(fd, self._header(), 0)
+        elif (size != self.length
+                or os.pread(fd, HEADER.size, 0) != self._header()):
+            # processes running with the old layout keep their mapping of
+            # the unlinked file instead of crashing
+            self._replace()
+            return False
+        return True
+
+    def _replace(self):
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.ftruncate(fd, self.length)
+            os.pwrite(fd, self._header(), 0)
+        finally:
+            os.close(fd)
+        os.replace(tmp, self.path)
+
+    @contextmanager
+    def locked(self, index):
+        stripe = index % self.stripes
+        with self.locks[stripe]:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, INIT_LOCK + 1 + stripe)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, INIT_LOCK + 1 + stripe)
+
+    @contextmanager
+    def locked_all(self):
+        # thread locks first, file locks are shared by the whole process
+        for lock in self.locks:
+            lock.acquire()
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, self.stripes, INIT_LOCK + 1)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, self.stripes,
+                            INIT_LOCK + 1)
+        finally:
+            for lock in self.locks:
+                lock.release()
+
+    def set_of(self, digest):
+        return digest % self.sets
+
+    def _slots(self, index):
+        start = self.slots_offset + index * self.ways * self.slot_size
+        return range(start, start + self.ways * self.slot_size, self.slot_size)
+
+    def find(self, index, digest, key, now):
+        """ Return the offset of the live slot holding key, the lock held """
+        for offset in self._slots(index):
+            slot_hash, expires, _, key_length, used, _ = SLOT.unpack_from(
+                self.map, offset
+            )
+            if not used or slot_hash != digest:
+                continue
+            start = offset + SLOT.size
+            if self.map[start:start + key_length] != key:
+                continue
+            if expires and expires <= now:
+                self.free(offset)
+                return None
+            return offset
+        return None
+
+    def free(self, offset):
+        self.map[offset + SLOT.size - 2] = 0
+
+    def read(self, offset, reference=True):
+        _, expires, value_length, key_length, _, _ = SLOT.unpack_from(
+            self.map, offset
+        )
+        if reference:
+            self.map[offset + SLOT.size - 1] = 1
+        start = offset + SLOT.size + key_length
+        return self.map[start:start + value_length], expires
+
+    def write(self, offset, digest, key, value, expires, referenced=True):
+        start = offset + SLOT.size
+        self.map[start:start + len(key) + len(value)] = key + value
+        SLOT.pack_into(self.map, offset, digest, expires or 0.0, len(value),
+                       len(key), 1, int(referenced))
+
+    def victim(self, index, now):
+        """ Return a free or expired slot of the set, else run the CLOCK """
+        slots = self._slots(index)
+        for offset in slots:
+            _, expires, _, _, used, _ = SLOT.unpack_from(self.map, offset)
+            if not used or (expires and expires <= now):
+                return offset
+        hand = self.map[self.hands_offset + index]
+        while True:
+            offset = slots[hand % self.ways]
+            hand = (hand + 1) % self.ways
+            if self.map[offset + SLOT.size - 1]:
+                # recently used, give it another round
+                self.map[offset + SLOT.size - 1] = 0
+                continue
+            self.map[self.hands_offset + index] = hand
+            return offset
+
+    def clear(self):
+        empty = bytes(self.ways * self.slot_size)
+        for index in range(self.sets):
+            start = self.slots_offset + index * len(empty)
+            self.map[start:start + len(empty)] = empty
+            self.map[self.hands_offset + index] = 0
+
+
+def get_region(path, size, slot_size, ways, stripes):
+    """ Return the process' mapping of a region, remapping after a fork """
+    layout = (path, size, slot_size, ways, stripes)
+    with _regions_lock:
+        if _regions.get(layout, (None,))[0] != os.getpid():
+            if layout in _regions:
+                # inherited from the parent, its thread locks may be held
+                _, region = _regions.pop(layout)
+                region.map.close()
+                os.close(region.fd)
+            _regions[layout] = (os.getpid(), Region(*layout))
+        return _regions[layout][1]
+
+
+class SharedMemoryCache(BaseCache):
+    """
+    Cache backend storing entries in a memory-mapped file.
+
+    Every worker on the host maps the same file, so entries and version
+    counters are shared and survive worker restarts. Entries live in
+    fixed-size slots, values that do not fit in SLOT_SIZE are split over
+    several. Values larger than MAX_VALUE_SIZE, an eighth of the cache by
+    default, are not cached and a warning is logged.
+    """
+
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._path = location
+        self._geometry = (
+            options.get('SIZE', 64 * 1024 * 1024),
+            options.get('SLOT_SIZE', 4096),
+            options.get('WAYS', 8),
+            options.get('STRIPES', 64),
+        )
+        self._max_value_size = options.get(
+            'MAX_VALUE_SIZE', self._geometry[0] // 8
+        )
+        self._pid = None
+
+    @property
+    def _region(self):
+        if self._pid != os.getpid():
+            self._mapped = get_region(self._path, *self._geometry)
+            self._pid = os.getpid()
+        return self._mapped
+
+    def _locate(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self._locate_raw(key.encode())
+
+    def _locate_raw(self, key):
+        digest = int.from_bytes(
+            hashlib.blake2b(key, digest_size=8).digest(), 'little'
+        )
+        region = self._region
+        return region, region.set_of(digest), digest, key
+
+    @staticmethod
+    def _chunk_key(key, nonce, number):
+        # not a valid cache key, so it never collides with one
+        return b'\x00%s\x00%s\x00%d' % (key, nonce.hex().encode(), number)
+
+    def _chunk_keys(self, key, manifest):
+        nonce, count, _ = MANIFEST.unpack_from(manifest, len(CHUNKED))
+        return [self._chunk_key(key, nonce, n) for n in range(count)]
+
+    def _split(self, key, value, expires, now):
+        """ Store the chunks of a value, return its manifest or None """
+        nonce = os.urandom(8)
+        step = (self._region.capacity
+                - len(self._chunk_key(key, nonce, len(value))))
+        if len(value) > self._max_value_size or step <= 0:
+            logger.warning(
+                'Cache value of %d bytes for %s exceeds MAX_VALUE_SIZE of '
+                '%d bytes, it is not cached.',
+                len(value), key.decode(), self._max_value_size,
+            )
+            return None
+        count = -(-len(value) // step)
+        for n in range(count):
+            region, index, digest, chunk_key = self._locate_raw(
+                self._chunk_key(key, nonce, n)
+            )
+            with region.locked(index):
+                offset = region.find(index, digest, chunk_key, now)
+                referenced = offset is not None
+                if offset is None:
+                    offset = region.victim(index, now)
+                region.write(offset, digest, chunk_key,
+                             value[n * step:(n + 1) * step], expires,
+                             referenced)
+        return CHUNKED + MANIFEST.pack(nonce, count, len(value))
+
+    def _chunks(self, key, manifest, expires=False):
+        """
+        Return the value of a manifest, None once a chunk is gone. Gives
+        the chunks a new expiry unless expires is False.
+        """
+        chunks = []
+        now = time.time()
+        for chunk_key in self._chunk_keys(key, manifest):
+            region, index, digest, chunk_key = self._locate_raw(chunk_key)
+            with region.locked(index):
+                offset = region.find(index, digest, chunk_key, now)
+                if offset is None:
+                    return None
+                chunk, _ = region.read(offset)
+                if expires is not False:
+                    region.write(offset, digest, chunk_key, chunk, expires)
+            chunks.append(chunk)
+        value = b''.join(chunks)
+        _, _, length = MANIFEST.unpack_from(manifest, len(CHUNKED))
+        return value if len(value) == length else None
+
+    def _free_chunks(self, key, manifest):
+        now = time.time()
+        for chunk_key in self._chunk_keys(key, manifest):
+            region, index, digest, chunk_key = self._locate_raw(chunk_key)
+            with region.locked(index):
+                offset = region.find(index, digest, chunk_key, now)
+                if offset is not None:
+                    region.free(offset)
+
+    def _store(self, key, value, timeout, version, only_new=False):
+        region, index, digest, key = self._locate(key, version)
+        value = pickle.dumps(value, self.pickle_protocol)
+        expires = self.get_backend_timeout(timeout)
+        now = time.time()
+        if (len(key) + len(value) > region.capacity
+                and (expires is None or expires > now)):
+            # chunks go first, readers see the old value or the whole new one
+            value = self._split(key, value, expires, now)
+        replaced = b''
+        with region.locked(index):
+            offset = region.find(index, digest, key, now)
+            if offset is not None and only_new:
+                # the chunks just written are left for eviction
+                return False
+            if offset is not None:
+                replaced, _ = region.read(offset, reference=False)
+            if value is None or (expires is not None and expires <= now):
+                # never leave an older value readable
+                if offset is not None:
+                    region.free(offset)
+                stored = False
+            else:
+                # new entries earn their reference bit with a second
+                # access, so a burst of one-off keys does not flush the hot
+                # ones
+                referenced = offset is not None
+                if offset is None:
+                    offset = region.victim(index, now)
+                region.write(offset, digest, key, value, expires, referenced)
+                stored = True
+        if replaced.startswith(CHUNKED):
+            self._free_chunks(key, replaced)
+        return stored
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._store(key, value, timeout, version, only_new=True)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._store(key, value, timeout, version)
+
+    def get(self, key, default=None, version=None):
+        region, index, digest, key = self._locate(key, version)
+        with region.locked(index):
+            offset = region.find(index, digest, key, time.time())
+            if offset is None:
+                return default
+            value, _ = region.read(offset)
+        if value.startswith(CHUNKED):
+            value = self._chunks(key, value)
+            if value is None:
+                return default
+        return pickle.loads(value)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        region, index, digest, key = self._locate(key, version)
+        expires = self.get_backend_timeout(timeout)
+        with region.locked(index):
+            offset = region.find(index, digest, key, time.time())
+            if offset is None:
+                return False
+            value, _ = region.read(offset)
+            region.write(offset, digest, key, value, expires)
+        if value.startswith(CHUNKED):
+            self._chunks(key, value, expires)
+        return True
+
+    def incr(self, key, delta=1, version=None):
+        """ Atomically add delta to a stored number across all processes """
+        region, index, digest, key = self._locate(key, version)
+        with region.locked(index):
+            offset = region.find(index, digest, key, time.time())
+            if offset is None:
+                raise ValueError(f"Key '{key.decode()}' not found")
+            value, expires = region.read(offset)
+            value = pickle.loads(value) + delta
+            region.write(offset, digest, key,
+                         pickle.dumps(value, self.pickle_protocol), expires)
+        return value
+
+    def delete(self, key, version=None):
+        region, index, digest, key = self._locate(key, version)
+        with region.locked(index):
+            offset = region.find(index, digest, key, time.time())
+            if offset is None:
+                return False
+            value, _ = region.read(offset, reference=False)
+            region.free(offset)
+        if value.startswith(CHUNKED):
+            self._free_chunks(key, value)
+        return True
+
+    def clear(self):
+        region = self._region
+        with region.locked_all():
+            region.clear()
@@ -0,0 +1,33 @@
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db.models import BigIntegerField, F, Min
+from django.db.models.functions import Coalesce
+
+from .models import Recipe
+
+
+def shopping_list(user_id, recipe_ids, using='default'):
+    """
+    Return (ingredient ids, name, recipe ids) of the ingredients of the
+    user's recipes among recipe_ids, by name, with one grouped query over
+    the recipe ingredient links. Ingredients sharing a catalog entry, like
+    "Salt" and "salt ", are listed once, those not in the catalog on their
+    own. Ids of other users' recipes are ignored.
+    """
+    links = Recipe.ingredients.through.objects.using(using).filter(
+        recipe__user_id=user_id, recipe_id__in=recipe_ids,
+    )
+    return links.annotate(
+        # catalog ids are positive, so unlinked ingredients never share one
+        entry=Coalesce(
+            'ingredient__canonical_id', -F('ingredient_id'),
+            output_field=BigIntegerField(),
+        ),
+    ).values('entry').annotate(
+        ingredient_ids=ArrayAgg(
+            'ingredient_id', distinct=True, ordering='ingredient_id'
+        ),
+        name=Min('ingredient__name'),
+        recipe_ids=ArrayAgg('recipe_id', distinct=True, ordering='recipe_id'),
+    ).values_list('ingredient_ids', 'name', 'recipe_ids').order_by(
+        'name', 'entry'
+    )
@@ -0,0 +1,343 @@
+from functools import partial
+
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.conf import settings
+from django.db import transaction
+from django.dispatch import receiver
+
+from . import (
+    catalog,
+    cookable,
+    imagestore,
+    sharding,
+    similarity,
+    stats,
+    summaries,
+)
+from .models import User, Tag, Ingredient, Recipe, RecipeSummary
+
+
+@receiver(post_save, sender=User)
+def place_user_on_shard(sender, instance, using, **kwargs):
+    """ Assign a shard to a new user and keep its mirror row up to date """
+    if not sharding.is_sharded() or using != sharding.global_database():
+        return
+
+    if not instance.shard:
+        instance.shard = sharding.placement_for_user_id(instance.pk)
+        User.objects.using(using).filter(pk=instance.pk).update(
+            shard=instance.shard
+        )
+
+    if instance.shard != using:
+        sharding.mirror_user(instance, using=instance.shard)
+
+
+def _recipe_ids_for(instance, using):
+    """ Return ids of recipes using the given tag or ingredient """
+    related = 'tags' if isinstance(instance, Tag) else 'ingredients'
+    return list(Recipe.objects.using(using).filter(
+        **{related: instance}
+    ).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Recipe)
+def create_recipe_summary(sender, instance, created, using, raw, **kwargs):
+    """ Create the summary row together with a new recipe """
+    if created and not raw:
+        summaries.refresh_summaries([instance.pk], using=using)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def refresh_recipe_summary(sender, instance, action, reverse, pk_set,
+                           using, **kwargs):
+    """ Keep recipe summaries in sync with tag and ingredient changes """
+    if action == 'pre_clear' and reverse:
+        instance._cleared_recipe_ids = _recipe_ids_for(instance, using)
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        recipe_ids = [instance.pk]
+    elif action == 'post_clear':
+        recipe_ids = getattr(instance, '_cleared_recipe_ids', [])
+    else:
+        recipe_ids = pk_set
+    summaries.refresh_summaries(recipe_ids, using=using)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def rename_in_recipe_summaries(sender, instance, created, using, raw,
+                               **kwargs):
+    """ Propagate tag and ingredient names into recipe summaries """
+    if not created and not raw:
+        summaries.refresh_summaries(
+            _recipe_ids_for(instance, using),
+            using=using,
+            existing_only=True,
+        )
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def collect_recipes_of_deleted(sender, instance, using, **kwargs):
+    instance._deleted_recipe_ids = _recipe_ids_for(instance, using)
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def remove_from_recipe_summaries(sender, instance, using, **kwargs):
+    """ Drop deleted tags and ingredients from recipe summaries """
+    summaries.refresh_summaries(
+        getattr(instance, '_deleted_recipe_ids', []),
+        using=using,
+        existing_only=True,
+    )
+
+
+@receiver(pre_save, sender=Recipe)
+def remember_recipe_values(sender, instance, using, raw, **kwargs):
+    if instance.pk is None or raw:
+        return
+    instance._previous = Recipe.objects.using(using).filter(
+        pk=instance.pk
+    ).values('price', 'time_minutes', 'image').first()
+
+
+@receiver(post_save, sender=Recipe)
+def count_saved_recipe(sender, instance, created, using, raw, **kwargs):
+    """ Update statistics with a created or edited recipe """
+    if raw:
+        return
+
+    old = None if created else getattr(instance, '_previous', None)
+    if not created and old is None:
+        return
+    price_deltas = [(instance.price, 1)]
+    time_deltas = [(instance.time_minutes, 1)]
+    if old is not None:
+        price_deltas.append((old['price'], -1))
+        time_deltas.append((old['time_minutes'], -1))
+
+    stats.update_stats(
+        instance.user_id,
+        using=using,
+        recipe_delta=1 if created else 0,
+        price_deltas=price_deltas,
+        time_deltas=time_deltas,
+    )
+
+
+@receiver(pre_delete, sender=Recipe)
+def remember_recipe_relations(sender, instance, using, **kwargs):
+    instance._stats_relations = RecipeSummary.objects.using(using).filter(
+        recipe_id=instance.pk
+    ).values_list('tag_ids', 'ingredient_ids').first()
+
+
+@receiver(post_delete, sender=Recipe)
+def uncount_deleted_recipe(sender, instance, using, **kwargs):
+    """ Remove a deleted recipe from statistics """
+    tag_ids, ingredient_ids = getattr(
+        instance, '_stats_relations', None
+    ) or ([], [])
+    stats.update_stats(
+        instance.user_id,
+        using=using,
+        recipe_delta=-1,
+        price_deltas=[(instance.price, -1)],
+        time_deltas=[(instance.time_minutes, -1)],
+        tag_deltas=[(pk, -1) for pk in tag_ids],
+        ingredient_deltas=[(pk, -1) for pk in ingredient_ids],
+    )
+
+
+def _linked_ids(through, instance, reverse, pk_set, using):
+    """ Return the pks of pk_set actually linked to instance """
+    related = 'tag_id' if through is Recipe.tags.through else 'ingredient_id'
+    links = through.objects.using(using)
+    if reverse:
+        return set(links.filter(
+            **{related: instance.pk}, recipe_id__in=pk_set
+        ).values_list('recipe_id', flat=True))
+    return set(links.filter(
+        recipe_id=instance.pk, **{f'{related}__in': pk_set}
+    ).values_list(related, flat=True))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def count_recipe_relations(sender, instance, action, reverse, pk_set,
+                           using, **kwargs):
+    """ Update tag and ingredient usage counts """
+    if sender is Recipe.tags.through:
+        relation, deltas_arg = 'tags', 'tag_deltas'
+    else:
+        relation, deltas_arg = 'ingredients', 'ingredient_deltas'
+    if action == 'pre_clear' and not reverse:
+        instance._stats_cleared_ids = list(
+            getattr(instance, relation).values_list('id', flat=True)
+        )
+        return
+    if action == 'pre_remove':
+        # pk_set holds every pk asked for, linked or not
+        instance._stats_removed_ids = _linked_ids(
+            sender, instance, reverse, pk_set, using
+        )
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    sign = 1 if action == 'post_add' else -1
+    if action == 'post_remove':
+        pk_set = getattr(instance, '_stats_removed_ids', set())
+    if not reverse:
+        if action == 'post_clear':
+            pk_set = getattr(instance, '_stats_cleared_ids', [])
+        deltas = [(pk, sign) for pk in pk_set]
+    elif action == 'post_clear':
+        cleared = getattr(instance, '_cleared_recipe_ids', [])
+        deltas = [(instance.pk, -len(cleared))]
+    else:
+        deltas = [(instance.pk, sign * len(pk_set))]
+
+    stats.update_stats(
+        instance.user_id,
+        using=using,
+        **{deltas_arg: deltas},
+    )
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def uncount_deleted_relation(sender, instance, using, **kwargs):
+    """ Drop usage counts of deleted tags and ingredients """
+    recipe_ids = getattr(instance, '_deleted_recipe_ids', [])
+    deltas = [(instance.pk, -len(recipe_ids))]
+    if sender is Tag:
+        stats.update_stats(instance.user_id, using=using, tag_deltas=deltas)
+    else:
+        stats.update_stats(
+            instance.user_id, using=using, ingredient_deltas=deltas
+        )
+
+
+def _after_commit(using, func, *args):
+    """ Publish an in-memory index change once the write is committed """
+    transaction.on_commit(partial(func, *args), using=using)
+
+
+@receiver(post_save, sender=Recipe)
+def invalidate_similarity_on_create(sender, instance, created, using, raw,
+                                    **kwargs):
+    """ Drop the user's similarity matrix when a recipe is added """
+    if created and not raw:
+        _after_commit(using, similarity.invalidate, instance.user_id)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_similarity_on_delete(sender, instance, using, **kwargs):
+    """ Drop the user's similarity matrix when its rows are deleted """
+    _after_commit(using, similarity.invalidate, instance.user_id)
+
+
+@receiver(pre_save, sender=Ingredient)
+def link_canonical_ingredient(sender, instance, using, raw, **kwargs):
+    """ Point the ingredient at the catalog entry of its name """
+    if raw:
+        return
+
+    canonical_id = None
+    if settings.INGREDIENT_CATALOG_ENABLED:
+        canonical_id = catalog.canonical_id(instance.name)
+    if canonical_id != instance.canonical_id:
+        instance.canonical_id = canonical_id
+        if instance.pk is not None:
+            # recipes are compared on catalog entries
+            _after_commit(using, similarity.invalidate, instance.user_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def invalidate_similarity_on_m2m(sender, instance, action, using, **kwargs):
+    """ Drop the user's similarity matrix when recipe features change """
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        _after_commit(using, similarity.invalidate, instance.user_id)
+
+
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def update_cookable_index(sender, instance, action, reverse, pk_set, using,
+                          **kwargs):
+    """ Apply ingredient changes of a recipe to the cookable index """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    change = None
+    if not reverse and action == 'post_add':
+        change = partial(_add_ingredients, instance.pk, set(pk_set))
+    elif not reverse and action == 'post_remove':
+        change = partial(_remove_ingredients, instance.pk, set(pk_set))
+    _after_commit(using, cookable.apply_change, instance.user_id, change)
+
+
+def _add_ingredients(recipe_id, ingredient_ids, index):
+    index.add(recipe_id, ingredient_ids)
+
+
+def _remove_ingredients(recipe_id, ingredient_ids, index):
+    index.remove(recipe_id, ingredient_ids)
+
+
+def _discard_recipe(recipe_id, index):
+    index.discard_recipe(recipe_id)
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_from_cookable_index(sender, instance, using, **kwargs):
+    _after_commit(
+        using,
+        cookable.apply_change,
+        instance.user_id,
+        partial(_discard_recipe, instance.pk),
+    )
+
+
+@receiver(post_delete, sender=Ingredient)
+def drop_cookable_index(sender, instance, using, **kwargs):
+    _after_commit(using, cookable.apply_change, instance.user_id)
+
+
+@receiver(post_save, sender=Recipe)
+def count_image_references(sender, instance, created, using, raw, **kwargs):
+    """ Move the image reference when a recipe image is set or replaced """
+    if raw:
+        return
+
+    old = None if created else getattr(instance, '_previous', None)
+    if not created and old is None:
+        return
+    old_name = old['image'] if old else None
+    new_name = instance.image.name if instance.image else None
+    if old_name == new_name:
+        return
+
+    _after_commit(using, imagestore.add_reference, new_name)
+    _after_commit(using, imagestore.remove_reference, old_name)
+
+
+@receiver(post_delete, sender=Recipe)
+def release_image_reference(sender, instance, using, **kwargs):
+    """ Release the image of a deleted recipe """
+    if instance.image:
+        _after_commit(using, imagestore.remove_reference, instance.image.name)
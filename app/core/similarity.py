@@ -0,0 +1,141 @@
+import numpy as np
+from django.core.cache import cache
+
+from .lru import LRUCache
+from .models import Ingredient, RecipeSummary
+from .versioning import bump_version, get_version
+
+METRICS = ('jaccard', 'cosine')
+
+# unpickled indexes of recently used users, on top of the shared cache
+_local_indexes = LRUCache(maxsize=32)
+
+
+def _namespace(user_id):
+    return f'similar:{user_id}'
+
+
+def invalidate(user_id):
+    """ Drop the cached incidence matrix of the user """
+    bump_version(_namespace(user_id))
+
+
+class IncidenceIndex:
+    """
+    Sparse recipe x feature incidence matrix of one user.
+
+    Tags and ingredients share the feature space (3 * tag id, 3 *
+    ingredient id + 1, or 3 * catalog id + 2 for ingredients found in
+    canonical, a mapping of ingredient id to catalog id, so differently
+    spelled ingredients match) and the matrix is kept in both row (CSR)
+    and column (CSC) form so a query only touches the postings of its own
+    features. Rows must be given in ascending recipe id order.
+    """
+
+    def __init__(self, rows, canonical=None):
+        canonical = canonical or {}
+        recipe_ids, features, row_of = [], [], []
+        for row, (recipe_id, tag_ids, ingredient_ids) in enumerate(rows):
+            recipe_ids.append(recipe_id)
+            row_features = [3 * pk for pk in tag_ids]
+            row_features += [
+                3 * canonical[pk] + 2 if pk in canonical else 3 * pk + 1
+                for pk in ingredient_ids
+            ]
+            # ingredients of a recipe may share a catalog entry
+            row_features = list(dict.fromkeys(row_features))
+            features.extend(row_features)
+            row_of.extend([row] * len(row_features))
+
+        self.recipe_ids = np.asarray(recipe_ids, dtype=np.int64)
+        features = np.asarray(features, dtype=np.int64)
+        row_of = np.asarray(row_of, dtype=np.int32)
+
+        self.columns, column_of = np.unique(features, return_inverse=True)
+        row_counts = np.bincount(row_of, minlength=len(recipe_ids))
+        self.sizes = row_counts.astype(np.float64)
+
+        self.row_indices = column_of.astype(np.int32)
+        self.row_indptr = np.concatenate(([0], np.cumsum(row_counts)))
+
+        order = np.argsort(column_of, kind='stable')
+        self.column_rows = row_of[order]
+        self.column_indptr = np.concatenate(
+            ([0], np.cumsum(np.bincount(
+                column_of, minlength=len(self.columns)
+            ), dtype=np.int64))
+        )
+
+    def __len__(self):
+        return len(self.recipe_ids)
+
+    def similar(self, recipe_id, k=10, metric='jaccard'):
+        """ Return [(recipe_id, score)] of the k most similar recipes """
+        row = int(np.searchsorted(self.recipe_ids, recipe_id))
+        if row == len(self) or self.recipe_ids[row] != recipe_id:
+            return []
+
+        columns = self.row_indices[
+            self.row_indptr[row]:self.row_indptr[row + 1]
+        ]
+        if not len(columns):
+            return []
+        postings = np.concatenate([
+            self.column_rows[self.column_indptr[c]:self.column_indptr[c + 1]]
+            for c in columns
+        ])
+        overlap = np.bincount(postings, minlength=len(self)).astype(
+            np.float64
+        )
+        overlap[row] = 0
+
+        if metric == 'cosine':
+            denominator = np.sqrt(self.sizes * self.sizes[row])
+        else:
+            denominator = self.sizes + self.sizes[row] - overlap
+        scores = np.divide(
+            overlap,
+            denominator,
+            out=np.zeros_like(overlap),
+            where=denominator > 0,
+        )
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            top = np.argpartition(-scores[candidates], k - 1)[:k]
+            candidates = candidates[top]
+        candidates = candidates[
+            np.lexsort((self.recipe_ids[candidates], -scores[candidates]))
+        ]
+
+        return [
+            (int(self.recipe_ids[c]), round(float(scores[c]), 4))
+            for c in candidates
+        ]
+
+
+def build_index(user_id, using='default'):
+    rows = RecipeSummary.objects.using(using).filter(
+        user_id=user_id
+    ).order_by('recipe_id').values_list(
+        'recipe_id', 'tag_ids', 'ingredient_ids'
+    )
+    canonical = dict(Ingredient.objects.using(using).filter(
+        user_id=user_id, canonical_id__isnull=False,
+    ).values_list('id', 'canonical_id'))
+    return IncidenceIndex(rows.iterator(), canonical=canonical)
+
+
+def get_index(user_id, using='default'):
+    """ Return the user's incidence matrix, building it when stale """
+    version = get_version(_namespace(user_id))
+    key = f'{_namespace(user_id)}:{version}'
+
+    index = _local_indexes.get(key)
+    if index is None:
+        index = cache.get(key)
+    if index is None:
+        index = build_index(user_id, using=using)
+        cache.set(key, index, timeout=24 * 60 * 60)
+    _local_indexes.set(key, index)
+    return index
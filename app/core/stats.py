@@ -0,0 +1,157 @@
+import math
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from .models import Tag, Ingredient, Recipe, RecipeStats
+
+CENT = Decimal('0.01')
+
+
+def price_key(price):
+    """ Return the JSON key of a recipe price """
+    return str(Decimal(str(price)).quantize(CENT))
+
+
+def _bump(counts, key, delta):
+    key = str(key)
+    value = counts.get(key, 0) + delta
+    if value > 0:
+        counts[key] = value
+    else:
+        counts.pop(key, None)
+
+
+def update_stats(user_id, using='default', recipe_delta=0, price_deltas=(),
+                 time_deltas=(), tag_deltas=(), ingredient_deltas=()):
+    """
+    Apply (value, delta) changes to the user's statistics row.
+
+    Users without a row are skipped, their statistics are computed from
+    scratch on first read.
+    """
+    with transaction.atomic(using=using):
+        stats = RecipeStats.objects.using(using).select_for_update().filter(
+            user_id=user_id
+        ).first()
+        if stats is None:
+            return
+
+        stats.recipe_count += recipe_delta
+        for price, delta in price_deltas:
+            key = price_key(price)
+            stats.price_total += Decimal(key) * delta
+            _bump(stats.price_counts, key, delta)
+        for minutes, delta in time_deltas:
+            stats.time_total += int(minutes) * delta
+            _bump(stats.time_counts, int(minutes), delta)
+        for tag_id, delta in tag_deltas:
+            _bump(stats.tag_counts, tag_id, delta)
+        for ingredient_id, delta in ingredient_deltas:
+            _bump(stats.ingredient_counts, ingredient_id, delta)
+        stats.save()
+
+
+def _counts(queryset, field):
+    return {
+        str(row[field]): row['n']
+        for row in queryset.values(field).annotate(n=Count('*')).order_by()
+    }
+
+
+def rebuild_stats(user, using='default'):
+    """ Compute the user's statistics row from scratch """
+    recipes = Recipe.objects.using(using).filter(user=user)
+    totals = recipes.aggregate(
+        recipe_count=Count('id'),
+        price_total=Sum('price'),
+        time_total=Sum('time_minutes'),
+    )
+    tags = Recipe.tags.through.objects.using(using).filter(recipe__user=user)
+    ingredients = Recipe.ingredients.through.objects.using(using).filter(
+        recipe__user=user
+    )
+
+    stats, _ = RecipeStats.objects.using(using).update_or_create(
+        user=user,
+        defaults={
+            'recipe_count': totals['recipe_count'],
+            'price_total': totals['price_total'] or 0,
+            'time_total': totals['time_total'] or 0,
+            'price_counts': {
+                price_key(price): n
+                for price, n in _counts(recipes, 'price').items()
+            },
+            'time_counts': _counts(recipes, 'time_minutes'),
+            'tag_counts': _counts(tags, 'tag_id'),
+            'ingredient_counts': _counts(ingredients, 'ingredient_id'),
+        },
+    )
+    return stats
+
+
+def get_stats(user, using='default'):
+    """ Return the user's statistics row, computing it on first read """
+    stats = RecipeStats.objects.using(using).filter(user=user).first()
+    if stats is None:
+        stats = rebuild_stats(user, using=using)
+    return stats
+
+
+def _percentile(counts, fraction, key=Decimal):
+    """ Return the nearest-rank percentile of a value -> count mapping """
+    total = sum(counts.values())
+    if not total:
+        return None
+
+    rank = max(1, math.ceil(fraction * total))
+    seen = 0
+    for value in sorted(counts, key=key):
+        seen += counts[value]
+        if seen >= rank:
+            return value
+
+
+def _top(counts, model, limit, using):
+    top = sorted(counts.items(), key=lambda item: (-item[1], int(item[0])))
+    top = top[:limit]
+    names = dict(model.objects.using(using).filter(
+        pk__in=[int(pk) for pk, _ in top]
+    ).values_list('id', 'name'))
+
+    return [
+        {'id': int(pk), 'name': names.get(int(pk)), 'count': count}
+        for pk, count in top
+    ]
+
+
+def describe_stats(stats, top=5, using='default'):
+    """ Return the dashboard representation of a statistics row """
+    count = stats.recipe_count
+    price_average = time_average = None
+    if count:
+        price_average = str((stats.price_total / count).quantize(CENT))
+        time_average = round(stats.time_total / count, 2)
+
+    return {
+        'recipe_count': count,
+        'price': {
+            'average': price_average,
+            'p50': _percentile(stats.price_counts, 0.5),
+            'p90': _percentile(stats.price_counts, 0.9),
+        },
+        'time_minutes': {
+            'average': time_average,
+            'p50': _int_or_none(_percentile(stats.time_counts, 0.5, int)),
+            'p90': _int_or_none(_percentile(stats.time_counts, 0.9, int)),
+        },
+        'top_tags': _top(stats.tag_counts, Tag, top, using),
+        'top_ingredients': _top(
+            stats.ingredient_counts, Ingredient, top, using
+        ),
+    }
+
+
+def _int_or_none(value):
+    return None if value is None else int(value)
@@ -0,0 +1,106 @@
+from django.db import connections
+
+from .models import Recipe, RecipeSummary
+
+
+def _summary_select(where):
+    """ Return SELECT computing summary rows of recipes matching where """
+    recipe = Recipe._meta.db_table
+    recipe_tags = Recipe.tags.through._meta.db_table
+    recipe_ingredients = Recipe.ingredients.through._meta.db_table
+    tag = Recipe.tags.field.related_model._meta.db_table
+    ingredient = Recipe.ingredients.field.related_model._meta.db_table
+
+    return f'''
+        SELECT r.id, r.user_id,
+               COALESCE(t.ids, '{{}}'), COALESCE(t.names, '{{}}'),
+               COALESCE(i.ids, '{{}}'), COALESCE(i.names, '{{}}')
+        FROM "{recipe}" r
+        LEFT JOIN LATERAL (
+            SELECT array_agg(x.id ORDER BY x.id) AS ids,
+                   array_agg(x.name ORDER BY x.id) AS names
+            FROM "{recipe_tags}" rt JOIN "{tag}" x ON x.id = rt.tag_id
+            WHERE rt.recipe_id = r.id
+        ) t ON true
+        LEFT JOIN LATERAL (
+            SELECT array_agg(x.id ORDER BY x.id) AS ids,
+                   array_agg(x.name ORDER BY x.id) AS names
+            FROM "{recipe_ingredients}" ri
+            JOIN "{ingredient}" x ON x.id = ri.ingredient_id
+            WHERE ri.recipe_id = r.id
+        ) i ON true
+        WHERE {where}
+    '''
+
+
+def _upsert(where, params, using):
+    summary = RecipeSummary._meta.db_table
+    sql = f'''
+        INSERT INTO "{summary}" (recipe_id, user_id, tag_ids, tag_names,
+                                 ingredient_ids, ingredient_names)
+        {_summary_select(where)}
+        ON CONFLICT (recipe_id) DO UPDATE SET
+            user_id = EXCLUDED.user_id,
+            tag_ids = EXCLUDED.tag_ids,
+            tag_names = EXCLUDED.tag_names,
+            ingredient_ids = EXCLUDED.ingredient_ids,
+            ingredient_names = EXCLUDED.ingredient_names
+    '''
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def refresh_summaries(recipe_ids, using='default', existing_only=False):
+    """
+    Recompute summary rows of the given recipes in one statement.
+
+    With existing_only, recipes without a summary row are skipped so rows
+    of recipes deleted in the same transaction are not recreated.
+    """
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return 0
+
+    where = 'r.id = ANY(%s)'
+    if existing_only:
+        summary = RecipeSummary._meta.db_table
+        where += (f' AND EXISTS (SELECT 1 FROM "{summary}" s '
+                  f'WHERE s.recipe_id = r.id)')
+    return _upsert(where, [recipe_ids], using)
+
+
+def rebuild_summaries(using='default', batch_size=5000):
+    """ Recompute every summary row in batches of recipe ids """
+    recipes = Recipe.objects.using(using).order_by('id')
+    last_id = 0
+    rows = 0
+    while True:
+        batch = list(recipes.filter(id__gt=last_id).values_list(
+            'id', flat=True
+        )[:batch_size])
+        if not batch:
+            return rows
+        rows += refresh_summaries(batch, using=using)
+        last_id = batch[-1]
+
+
+def inconsistent_summaries(using='default'):
+    """ Return ids of recipes whose summary row is missing or stale """
+    summary = RecipeSummary._meta.db_table
+    sql = f'''
+        SELECT expected.id FROM ({_summary_select('true')})
+            AS expected (id, user_id, tag_ids, tag_names,
+                         ingredient_ids, ingredient_names)
+        LEFT JOIN "{summary}" s ON s.recipe_id = expected.id
+        WHERE s.recipe_id IS NULL
+           OR s.user_id <> expected.user_id
+           OR s.tag_ids <> expected.tag_ids
+           OR s.tag_names <> expected.tag_names
+           OR s.ingredient_ids <> expected.ingredient_ids
+           OR s.ingredient_names <> expected.ingredient_names
+        ORDER BY expected.id
+    '''
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql)
+        return [row[0] for row in cursor.fetchall()]
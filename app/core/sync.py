@@ -0,0 +1,121 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import Tombstone
+
+SEQUENCE = 'core_change_seq'
+
+# token of a client that has nothing yet, rows older than the change
+# tracking have change_seq 0
+INITIAL_SEQ = -1
+
+
+class TokenExpired(Exception):
+    """ The token predates tombstones that may have been pruned """
+
+
+def make_token(seq, issued):
+    return f'{seq}.{int(issued)}'
+
+
+def parse_token(token):
+    """
+    Return (seq, issued) of a sync token, raising ValueError when malformed
+    and TokenExpired when deletions after it may have been pruned
+    """
+    if not token:
+        return INITIAL_SEQ, time.time()
+    seq, issued = (int(part) for part in token.split('.'))
+    if issued < time.time() - settings.SYNC_TOMBSTONE_RETENTION:
+        raise TokenExpired(token)
+    return seq, issued
+
+
+def skip_change_tracking(using):
+    """
+    Record no tombstones, recipe touches or change events for the rest of
+    the current transaction, for deletions of everything a user owns and
+    copies of it. Updated rows keep their change number, for backfills of
+    columns clients do not see.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute("SET LOCAL core.track_changes = 'off'")
+
+
+def align_sequence(source, target):
+    """ Move the target's change sequence past the source's """
+    with connections[source].cursor() as cursor:
+        cursor.execute(f'SELECT last_value FROM {SEQUENCE}')
+        last_value, = cursor.fetchone()
+    with connections[target].cursor() as cursor:
+        cursor.execute(
+            f'SELECT setval(%s, GREATEST(last_value, %s)) FROM {SEQUENCE}',
+            [SEQUENCE, last_value],
+        )
+
+
+def _changed(queryset, since, limit):
+    """ Return up to limit rows changed after since and whether more exist """
+    rows = list(queryset.filter(
+        change_seq__gt=since
+    ).order_by('change_seq')[:limit + 1])
+    return rows[:limit], len(rows) > limit
+
+
+def read_changes(querysets, user, token, using, limit=None):
+    """
+    Return the rows of the querysets and the tombstones changed after a
+    sync token, with the token of the next call and whether more changes
+    are waiting.
+
+    All reads share one snapshot. A page cut short ends at the lowest last
+    change of the truncated streams, later rows of other streams are sent
+    again with the next page.
+    """
+    since, issued = parse_token(token)
+    limit = limit or settings.SYNC_PAGE_SIZE
+    outermost = not connections[using].in_atomic_block
+    with transaction.atomic(using=using):
+        if outermost:
+            with connections[using].cursor() as cursor:
+                cursor.execute(
+                    'SET TRANSACTION ISOLATION LEVEL REPEATABLE READ'
+                )
+        changed, truncated = {}, []
+        for name, queryset in querysets.items():
+            rows, more = _changed(queryset, since, limit)
+            changed[name] = rows
+            if more:
+                truncated.append(rows[-1].change_seq)
+        tombstones, more = _changed(
+            Tombstone.objects.using(using).filter(user_id=user.pk),
+            since, limit,
+        )
+        if more:
+            truncated.append(tombstones[-1].change_seq)
+
+    seqs = [row.change_seq for rows in changed.values() for row in rows]
+    seqs += [tombstone.change_seq for tombstone in tombstones]
+    if truncated:
+        # deletions after the page are still pending, keep the time the
+        # client was last complete
+        next_token = make_token(min(truncated), issued)
+    else:
+        next_token = make_token(max(seqs, default=since), time.time())
+    return changed, tombstones, next_token, bool(truncated)
+
+
+def prune_tombstones(using, retention=None):
+    """ Delete tombstones older than any token still accepted """
+    # the margin covers transactions that were running when a token was
+    # issued and committed deletions afterwards
+    retention = retention or settings.SYNC_TOMBSTONE_RETENTION
+    cutoff = timezone.now() - timedelta(seconds=retention + 5 * 60)
+    deleted, _ = Tombstone.objects.using(using).filter(
+        deleted_at__lt=cutoff
+    ).delete()
+    return deleted
@@ -0,0 +1,303 @@
+import importlib
+import os
+import random
+import select
+import socket
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Task
+from .sharding import global_database
+
+CHANNEL = 'core_task'
+
+_registry = {}
+
+
+class TaskFunction:
+    """ Function that can be run by queue workers """
+
+    def __init__(self, func, queue, priority, max_attempts):
+        self.func = func
+        self.name = f'{func.__module__}.{func.__qualname__}'
+        self.queue = queue
+        self.priority = priority
+        self.max_attempts = max_attempts
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def enqueue(self, args=(), kwargs=None, priority=None, delay=None):
+        """
+        Add a job to the queue and wake up its workers.
+
+        The job and its notification become visible when the current
+        transaction on the global database commits.
+        """
+        using = global_database()
+        job = Task.objects.using(using).create(
+            queue=self.queue,
+            name=self.name,
+            args=list(args),
+            kwargs=kwargs or {},
+            priority=self.priority if priority is None else priority,
+            max_attempts=self.max_attempts,
+            run_at=timezone.now() + (delay or timedelta(0)),
+        )
+        with connections[using].cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [CHANNEL, self.queue])
+        return job
+
+    def delay(self, *args, **kwargs):
+        return self.enqueue(args, kwargs)
+
+
+def task(queue='default', priority=0, max_attempts=5):
+    """ Register a function as a task run by queue workers """
+    def decorator(func):
+        wrapped = TaskFunction(func, queue, priority, max_attempts)
+        _registry[wrapped.name] = wrapped
+        return wrapped
+    return decorator
+
+
+def get_task(name):
+    """ Return a registered task, importing its module when needed """
+    if name not in _registry:
+        importlib.import_module(name.rsplit('.', 1)[0])
+    return _registry[name]
+
+
+def retry_delay(attempts):
+    """ Return the exponential backoff before retrying a failed job """
+    delay = min(
+        settings.TASK_RETRY_DELAY * 2 ** (attempts - 1),
+        settings.TASK_RETRY_MAX_DELAY,
+    )
+    return timedelta(seconds=delay * random.uniform(0.5, 1.5))
+
+
+class Worker:
+    """
+    Queue worker claiming jobs with SELECT ... FOR UPDATE SKIP LOCKED.
+
+    Every queue runs on its own thread pool sized by its concurrency, so
+    slow queues never starve the others. Idle workers sleep on LISTEN
+    until a job is enqueued or a retry becomes due.
+    """
+
+    def __init__(self, queues=None, batch_size=None, name=None):
+        self.queues = dict(queues or settings.TASK_QUEUES)
+        self.batch_size = batch_size or settings.TASK_BATCH_SIZE
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.using = global_database()
+        self.running = {queue: 0 for queue in self.queues}
+        self.lock = threading.Lock()
+        # finished jobs write to the pipe to wake the dispatcher
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        self.stopping = threading.Event()
+        self.pools = {}
+
+    def claim(self, queue, limit):
+        """ Mark up to limit due jobs of a queue as running and return them """
+        table = connections[self.using].ops.quote_name(Task._meta.db_table)
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(f"""
+                UPDATE {table}
+                SET status = %(running)s, locked_by = %(worker)s,
+                    locked_at = clock_timestamp(), attempts = attempts + 1
+                WHERE id IN (
+                    SELECT id FROM {table}
+                    WHERE queue = %(queue)s AND status = %(queued)s
+                        AND run_at <= clock_timestamp()
+                    ORDER BY priority DESC, run_at, id
+                    LIMIT %(limit)s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id
+            """, {
+                'running': Task.RUNNING,
+                'queued': Task.QUEUED,
+                'worker': self.name,
+                'queue': queue,
+                'limit': limit,
+            })
+            ids = [pk for pk, in cursor.fetchall()]
+        jobs = Task.objects.using(self.using).in_bulk(ids)
+        return sorted(jobs.values(), key=lambda job: (-job.priority, job.pk))
+
+    def execute(self, job):
+        """ Run a claimed job, deleting it or scheduling a retry """
+        jobs = Task.objects.using(self.using).filter(pk=job.pk)
+        try:
+            get_task(job.name)(*job.args, **job.kwargs)
+        except Exception:
+            error = traceback.format_exc()
+            if job.attempts < job.max_attempts:
+                jobs.update(
+                    status=Task.QUEUED,
+                    run_at=timezone.now() + retry_delay(job.attempts),
+                    locked_by='',
+                    locked_at=None,
+                    last_error=error,
+                )
+            else:
+                jobs.update(status=Task.FAILED, last_error=error)
+            return False
+        jobs.delete()
+        return True
+
+    def requeue_stale(self):
+        """
+        Put back jobs of workers that died while running them, or mark
+        them failed once they used all their attempts. Returns the number
+        of jobs queued again.
+        """
+        cutoff = timezone.now() - timedelta(seconds=settings.TASK_LOCK_TIMEOUT)
+        stale = Task.objects.using(self.using).filter(
+            status=Task.RUNNING, locked_at__lt=cutoff
+        )
+        stale.filter(attempts__gte=F('max_attempts')).update(
+            status=Task.FAILED,
+            last_error='The worker running the job stopped responding.',
+        )
+        return stale.filter(attempts__lt=F('max_attempts')).update(
+            status=Task.QUEUED, locked_by='', locked_at=None
+        )
+
+    def heartbeat(self):
+        """ Refresh the locks of the jobs this worker is running """
+        return Task.objects.using(self.using).filter(
+            status=Task.RUNNING, locked_by=self.name
+        ).update(locked_at=timezone.now())
+
+    def _beat(self, stopped):
+        try:
+            while not stopped.wait(settings.TASK_HEARTBEAT_INTERVAL):
+                self.heartbeat()
+        finally:
+            connections.close_all()
+
+    @contextmanager
+    def _heartbeats(self):
+        """ Refresh job locks from a thread while jobs run """
+        stopped = threading.Event()
+        thread = threading.Thread(
+            target=self._beat, args=(stopped,), name='task-heartbeat',
+            daemon=True,
+        )
+        thread.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            thread.join()
+
+    def run_burst(self):
+        """ Run every due job in this thread and return how many ran """
+        self.requeue_stale()
+        count = 0
+        with self._heartbeats():
+            while True:
+                jobs = [
+                    job for queue in self.queues
+                    for job in self.claim(queue, self.batch_size)
+                ]
+                if not jobs:
+                    return count
+                for job in jobs:
+                    self.execute(job)
+                count += len(jobs)
+
+    def _run_in_pool(self, queue, job):
+        try:
+            self.execute(job)
+        finally:
+            close_old_connections()
+            with self.lock:
+                self.running[queue] -= 1
+            os.write(self.wakeup_write, b'.')
+
+    def _dispatch(self):
+        """ Claim jobs for every queue with free slots """
+        claimed = 0
+        for queue, concurrency in self.queues.items():
+            with self.lock:
+                free = concurrency - self.running[queue]
+            if free <= 0:
+                continue
+            for job in self.claim(queue, min(free, self.batch_size)):
+                with self.lock:
+                    self.running[queue] += 1
+                self.pools[queue].submit(self._run_in_pool, queue, job)
+                claimed += 1
+        return claimed
+
+    def _next_run_in(self):
+        """ Return seconds until a job of a queue with free slots is due """
+        with self.lock:
+            queues = [queue for queue, concurrency in self.queues.items()
+                      if self.running[queue] < concurrency]
+        if not queues:
+            return settings.TASK_IDLE_TIMEOUT
+        next_run = Task.objects.using(self.using).filter(
+            queue__in=queues, status=Task.QUEUED
+        ).order_by('run_at').values_list('run_at', flat=True).first()
+        if next_run is None:
+            return settings.TASK_IDLE_TIMEOUT
+        seconds = (next_run - timezone.now()).total_seconds()
+        return min(max(seconds, 0), settings.TASK_IDLE_TIMEOUT)
+
+    def _wait(self, timeout):
+        """ Sleep until a notification, a finished job or the timeout """
+        connection = connections[self.using].connection
+        readable, _, _ = select.select(
+            [connection, self.wakeup_read], [], [], timeout
+        )
+        if self.wakeup_read in readable:
+            os.read(self.wakeup_read, 4096)
+        if connection in readable:
+            connection.poll()
+            del connection.notifies[:]
+
+    def run(self):
+        """ Process jobs until stop() is called """
+        self.pools = {
+            queue: ThreadPoolExecutor(
+                max_workers=concurrency, thread_name_prefix=f'task-{queue}'
+            )
+            for queue, concurrency in self.queues.items()
+        }
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(f'LISTEN {CHANNEL}')
+
+        last_requeue = None
+        # jobs still running at shutdown keep their locks fresh
+        with self._heartbeats():
+            try:
+                while not self.stopping.is_set():
+                    now = timezone.now()
+                    if (last_requeue is None
+                            or (now - last_requeue).total_seconds() > 60):
+                        self.requeue_stale()
+                        last_requeue = now
+                    if self._dispatch():
+                        continue
+                    self._wait(self._next_run_in())
+            finally:
+                for pool in self.pools.values():
+                    pool.shutdown(wait=True)
+                with connections[self.using].cursor() as cursor:
+                    cursor.execute(f'UNLISTEN {CHANNEL}')
+
+    def stop(self, *args):
+        self.stopping.set()
+        os.write(self.wakeup_write, b'.')
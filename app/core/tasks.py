@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from . import purge, variants
+from .taskqueue import task
+
+
+@task(queue='maintenance', max_attempts=20)
+def purge_user(user_id):
+    """ Delete the data of a deactivated account """
+    record = purge.pending_purges().filter(user_id=user_id).first()
+    if record is not None and not purge.purge_user(record):
+        raise RuntimeError(f'user {user_id} is being moved, retrying later')
+
+
+@task(queue='media', priority=-1)
+def render_image_variants(name):
+    """ Render the common variants of a new recipe image ahead of reads """
+    if not default_storage.exists(name):
+        return
+    path = default_storage.path(name)
+    for accept in ('image/webp', ''):
+        image_format, ext = variants.negotiate_format(accept, name)
+        for width in settings.RECIPE_IMAGE_PREWARM_WIDTHS:
+            key = variants.variant_key(name, path, width, ext)
+            variants.get_variant(key, path, width, image_format).close()
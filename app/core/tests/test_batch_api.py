@@ -0,0 +1,187 @@
+import threading
+import time
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag
+
+BATCH_URL = reverse('batch')
+
+
+class PublicBatchAPITests(TestCase):
+
+    def test_login_required(self):
+        """ Test authentication is required for batches """
+        response = APIClient().post(BATCH_URL, {'requests': [
+            {'path': '/api/user/me/'},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateBatchAPITests(TestCase):
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user(
+            email='test@gmail.com',
+            password='test_password',
+            name='test',
+        )
+        self.client = APIClient()
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        Tag.objects.create(user=self.user, name='vegan')
+        Recipe.objects.create(
+            user=self.user, title='soup', time_minutes=10, price=5.00
+        )
+
+    def test_home_screen_in_one_request(self):
+        """ Test sub-requests run with one authentication """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(BATCH_URL, {'requests': [
+                {'path': '/api/user/me/'},
+                {'path': '/api/recipe/tags/'},
+                {'path': '/api/recipe/ingredients/'},
+                {'path': '/api/recipe/recipes/?tags=1'},
+            ]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        responses = response.data['responses']
+        self.assertEqual([item['status'] for item in responses],
+                         [200, 200, 200, 200])
+        self.assertEqual(responses[0]['body']['email'], 'test@gmail.com')
+        self.assertEqual(responses[1]['body'][0]['name'], 'vegan')
+        self.assertEqual(responses[2]['body'], [])
+        token_queries = [
+            query for query in queries.captured_queries
+            if 'authtoken_token' in query['sql']
+        ]
+        self.assertEqual(len(token_queries), 1)
+
+    def test_writes_seen_by_later_requests(self):
+        """ Test sub-requests run in order with their own status codes """
+        response = self.client.post(BATCH_URL, {'requests': [
+            {'method': 'POST', 'path': '/api/recipe/tags/',
+             'body': {'name': 'dessert'}},
+            {'method': 'POST', 'path': '/api/recipe/tags/', 'body': {}},
+            {'path': '/api/recipe/tags/'},
+            {'path': '/api/recipe/unknown/'},
+        ]}, format='json')
+
+        responses = response.data['responses']
+        self.assertEqual([item['status'] for item in responses],
+                         [201, 400, 200, 404])
+        self.assertEqual(
+            [tag['name'] for tag in responses[2]['body']],
+            ['vegan', 'dessert'],
+        )
+
+    def test_paths_outside_api_rejected(self):
+        """ Test batches can not nest or reach other endpoints """
+        response = self.client.post(BATCH_URL, {'requests': [
+            {'method': 'POST', 'path': BATCH_URL, 'body': {}},
+            {'method': 'POST', 'path': '/api/user/token/', 'body': {}},
+        ]}, format='json')
+
+        self.assertEqual(
+            [item['status'] for item in response.data['responses']],
+            [400, 400],
+        )
+
+    def test_failing_request_isolated(self):
+        """ Test an error in a sub-request fails only that sub-request """
+        with self.assertLogs('core.batch', 'ERROR'):
+            response = self.client.post(BATCH_URL, {'requests': [
+                {'path': '/api/recipe/recipes/?tags=abc'},
+                {'path': '/api/recipe/tags/'},
+            ]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [item['status'] for item in response.data['responses']],
+            [500, 200],
+        )
+
+    def test_batch_size_limited(self):
+        """ Test batches are limited in size """
+        response = self.client.post(BATCH_URL, {'requests': [
+            {'path': '/api/recipe/tags/'},
+        ] * 21}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch('core.batch.run_request')
+    def test_parallel_reads(self, run_request):
+        """ Test consecutive reads run in parallel and writes alone """
+        run_request.side_effect = lambda request, item: {
+            'thread': threading.current_thread().name,
+        }
+
+        response = self.client.post(BATCH_URL, {'parallel': True, 'requests': [
+            {'path': '/api/recipe/tags/'},
+            {'path': '/api/recipe/ingredients/'},
+            {'method': 'POST', 'path': '/api/recipe/tags/', 'body': {}},
+        ]}, format='json')
+
+        threads = [item['thread'] for item in response.data['responses']]
+        self.assertNotEqual(threads[0], threading.current_thread().name)
+        self.assertEqual(threads[2], threading.current_thread().name)
+
+
+class ParallelBatchAPITests(TransactionTestCase):
+    """ Test parallel reads on the database connections of their threads """
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user(
+            email='test@gmail.com',
+            password='test_password',
+            name='test',
+        )
+        self.client = APIClient()
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        Tag.objects.create(user=self.user, name='vegan')
+
+    def _backends(self, expected):
+        """ Count the connections, waiting a while for closed ones to end """
+        deadline = time.monotonic() + 5
+        while True:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT count(*) FROM pg_stat_activity '
+                    'WHERE datname = current_database()'
+                )
+                count = cursor.fetchone()[0]
+            if count == expected or time.monotonic() > deadline:
+                return count
+            time.sleep(0.05)
+
+    def test_parallel_reads(self):
+        """ Test parallel reads answer and close their connections """
+        before = self._backends(1)
+
+        with self.assertLogs('core.batch', 'ERROR'):
+            response = self.client.post(BATCH_URL, {
+                'parallel': True,
+                'requests': [
+                    {'path': '/api/user/me/'},
+                    {'path': '/api/recipe/tags/'},
+                    {'path': '/api/recipe/recipes/?tags=abc'},
+                    {'path': '/api/recipe/ingredients/'},
+                ],
+            }, format='json')
+
+        responses = response.data['responses']
+        self.assertEqual([item['status'] for item in responses],
+                         [200, 200, 500, 200])
+        self.assertEqual(responses[0]['body']['email'], 'test@gmail.com')
+        self.assertEqual(responses[1]['body'][0]['name'], 'vegan')
+        self.assertEqual(self._backends(before), before)
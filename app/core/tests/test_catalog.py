@@ -0,0 +1,100 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from core import catalog
+from core.models import CanonicalIngredient, Ingredient
+
+
+class IngredientCatalogTests(TestCase):
+
+    def setUp(self) -> None:
+        catalog.clear_cache()
+        self.user = get_user_model().objects.create_user(
+            email='test@gmail.com',
+            password='test_password',
+        )
+        self.other = get_user_model().objects.create_user(
+            email='other@gmail.com',
+            password='test_password',
+        )
+
+    def test_normalize_name(self):
+        """ Test names are composed, case folded and whitespace collapsed """
+        self.assertEqual(
+            catalog.normalize_name('  Olive \t OIL '), 'olive oil'
+        )
+        self.assertEqual(catalog.normalize_name('Straße'), 'strasse')
+        self.assertEqual(catalog.normalize_name('ﬁsh ½'), 'fish 1⁄2')
+        self.assertEqual(
+            catalog.normalize_name('Crème'), catalog.normalize_name('Crème')
+        )
+        self.assertEqual(catalog.normalize_name('   '), '')
+
+    def test_users_share_catalog_entry(self):
+        """ Test spellings of one name by different users are interned once """
+        mine = Ingredient.objects.create(user=self.user, name='Olive Oil')
+        theirs = Ingredient.objects.create(user=self.other, name='olive  oil')
+
+        self.assertIsNotNone(mine.canonical_id)
+        self.assertEqual(mine.canonical_id, theirs.canonical_id)
+        self.assertEqual(
+            CanonicalIngredient.objects.get(pk=mine.canonical_id).name,
+            'olive oil',
+        )
+        self.assertEqual(mine.name, 'Olive Oil')
+
+    def test_rename_relinks(self):
+        """ Test renaming an ingredient points it at the new name """
+        ingredient = Ingredient.objects.create(user=self.user, name='salt')
+        ingredient.name = 'Sea Salt'
+        ingredient.save()
+
+        ingredient.refresh_from_db()
+        self.assertEqual(
+            CanonicalIngredient.objects.get(pk=ingredient.canonical_id).name,
+            'sea salt',
+        )
+
+    def test_canonical_ids_batch(self):
+        """ Test names are looked up and added in one batch """
+        existing = catalog.canonical_id('egg')
+
+        with self.assertNumQueries(3):
+            ids = catalog.canonical_ids(['Egg', 'milk', 'MILK', ' '])
+
+        self.assertEqual(ids['Egg'], existing)
+        self.assertEqual(ids['milk'], ids['MILK'])
+        self.assertNotIn(' ', ids)
+
+    @override_settings(INGREDIENT_CATALOG_ENABLED=False)
+    def test_disabled(self):
+        """ Test ingredients are not linked when the catalog is off """
+        ingredient = Ingredient.objects.create(user=self.user, name='salt')
+
+        self.assertIsNone(ingredient.canonical_id)
+        self.assertFalse(CanonicalIngredient.objects.exists())
+
+    def test_backfill_command(self):
+        """ Test existing ingredients are linked without renumbering them """
+        with override_settings(INGREDIENT_CATALOG_ENABLED=False):
+            Ingredient.objects.create(user=self.user, name='Salt')
+            Ingredient.objects.create(user=self.user, name='Pepper')
+            Ingredient.objects.create(user=self.other, name='salt ')
+        before = dict(Ingredient.objects.values_list('id', 'change_seq'))
+        out = StringIO()
+
+        call_command('backfill_ingredient_catalog', '--batch-size', '2',
+                     stdout=out)
+
+        ingredients = Ingredient.objects.order_by('id')
+        self.assertEqual(
+            dict(ingredients.values_list('id', 'change_seq')), before
+        )
+        salt, pepper, other_salt = ingredients
+        self.assertEqual(salt.canonical_id, other_salt.canonical_id)
+        self.assertNotEqual(salt.canonical_id, pepper.canonical_id)
+        self.assertIn('3 ingredients linked', out.getvalue())
+        self.assertIn('catalog holds 2 names', out.getvalue())
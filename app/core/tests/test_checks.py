@@ -0,0 +1,53 @@
+from django.test import SimpleTestCase, override_settings
+
+from core import checks
+
+FAST_SETTINGS = {
+    'DEBUG': False,
+    'FAST_DEFAULTS': True,
+    'DATABASES': {'default': {'CONN_MAX_AGE': 60}},
+    'CACHES': {'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    }},
+}
+
+
+def ids(messages):
+    return [message.id for message in messages]
+
+
+class PerformanceChecksTests(SimpleTestCase):
+
+    @override_settings(**FAST_SETTINGS)
+    def test_fast_settings_pass(self):
+        """ Test the fast profile settings raise no warnings """
+        self.assertEqual(checks.check_profile_performance(None), [])
+
+    @override_settings(**dict(
+        FAST_SETTINGS,
+        DEBUG=True,
+        DATABASES={'default': {}},
+        CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }},
+    ))
+    def test_harmful_settings_reported_on_startup(self):
+        """ Test fast profiles report harmful settings when starting """
+        self.assertEqual(
+            ids(checks.check_profile_performance(None)),
+            ['core.W001', 'core.W002', 'core.W003'],
+        )
+        self.assertEqual(checks.check_deploy_performance(None), [])
+
+    @override_settings(DEBUG=True, FAST_DEFAULTS=False)
+    def test_dev_profile_reported_on_deploy_only(self):
+        """ Test the dev profile is only flagged by check --deploy """
+        self.assertEqual(checks.check_profile_performance(None), [])
+        self.assertIn('core.W001', ids(checks.check_deploy_performance(None)))
+
+    @override_settings(MEDIA_SERVE_MODE='nginx')
+    def test_unknown_media_serve_mode(self):
+        """ Test an unknown media serve mode is an error """
+        self.assertEqual(
+            ids(checks.check_media_serve_mode(None)), ['core.E001']
+        )
@@ -1,7 +1,9 @@
+from io import StringIO
 from unittest.mock import patch
-from django.core.management import call_command
+from django.core.management import CommandError, call_command
+from django.db import connection
 from django.db.utils import OperationalError
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 
 class CommandsTest(TestCase):
@@ -19,3 +21,54 @@ class CommandsTest(TestCase):
             gi.side_effect = [OperationalError] * 5 + [True]
             call_command('wait_for_db')
             self.assertEqual(gi.call_count, 6)
+
+    @override_settings(DATABASE_SHARDS=['default'])
+    def test_init_shard_sequences(self):
+        """ Test the sequence of every sharded model is initialised """
+        out = StringIO()
+
+        call_command('init_shard_sequences', stdout=out)
+
+        self.assertIn('default: ids start at 1', out.getvalue())
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT nextval(pg_get_serial_sequence("
+                           "'core_recipe', 'id'))")
+            self.assertGreaterEqual(cursor.fetchone()[0], 1)
+
+    @patch('core.management.commands.serve.cpu_count', return_value=4)
+    def test_serve_workers_from_cpu_count(self, cc):
+        """ Test serve sizes its workers from the CPU count """
+        from core.management.commands import serve
+
+        self.assertEqual(serve.default_workers('wsgi'), 9)
+        self.assertEqual(serve.default_workers('asgi'), 4)
+        with override_settings(SERVE_WORKERS=2):
+            self.assertEqual(serve.default_workers('wsgi'), 2)
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': '/tmp/recipe-app-test-cache',
+    }})
+    @patch('core.management.commands.serve.build_server')
+    def test_serve_preloads_application(self, build_server):
+        """ Test serve preloads the app and recycles workers """
+        call_command('serve', interface='asgi', workers=3)
+
+        path, options = build_server.call_args[0]
+        self.assertEqual(path, 'app.asgi.application')
+        self.assertTrue(options['preload_app'])
+        self.assertEqual(options['workers'], 3)
+        self.assertEqual(
+            options['worker_class'], 'uvicorn.workers.UvicornWorker'
+        )
+        self.assertGreater(options['max_requests'], 0)
+
+    @patch('core.management.commands.serve.build_server')
+    def test_serve_refuses_workers_on_local_cache(self, build_server):
+        """ Test several workers are refused a process-local cache """
+        with self.assertRaisesMessage(CommandError, 'process-local cache'):
+            call_command('serve', workers=3)
+        build_server.assert_not_called()
+
+        call_command('serve', workers=1)
+        build_server.assert_called_once()
@@ -0,0 +1,140 @@
+import gzip
+import json
+import os
+import tempfile
+
+import brotli
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.urls import reverse
+
+from core import compression
+
+
+def json_response(size=2000):
+    return HttpResponse(
+        json.dumps([{'title': 'soup', 'id': index} for index in range(size)]),
+        content_type='application/json',
+    )
+
+
+class CompressionMiddlewareTests(SimpleTestCase):
+
+    def setUp(self) -> None:
+        self.factory = RequestFactory()
+
+    def process(self, response, accept='gzip, br'):
+        request = self.factory.get('/', HTTP_ACCEPT_ENCODING=accept)
+        middleware = compression.CompressionMiddleware(lambda r: response)
+        return middleware(request)
+
+    def test_negotiate_encoding(self):
+        """ Test the client's quality wins over the server order """
+        available = ['br', 'gzip']
+        self.assertEqual(
+            compression.negotiate_encoding('gzip, br', available), 'br'
+        )
+        self.assertEqual(
+            compression.negotiate_encoding('br;q=0.5, gzip', available),
+            'gzip',
+        )
+        self.assertEqual(
+            compression.negotiate_encoding('*;q=0.1, br;q=0', available),
+            'gzip',
+        )
+        self.assertIsNone(
+            compression.negotiate_encoding('identity', available)
+        )
+
+    def test_compress_json(self):
+        """ Test JSON responses are compressed with the preferred encoding """
+        original = json_response()
+        content = original.content
+        original['ETag'] = '"abc"'
+
+        response = self.process(original)
+
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), content)
+        self.assertLess(len(response.content) * 5, len(content))
+        self.assertEqual(response['ETag'], 'W/"abc"')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    def test_small_and_other_types_not_compressed(self):
+        """ Test small bodies and unlisted content types are sent as is """
+        small = self.process(json_response(size=1))
+        image = self.process(
+            HttpResponse(b'x' * 4096, content_type='image/jpeg')
+        )
+        identity = self.process(json_response(), accept='identity')
+
+        for response in (small, image, identity):
+            self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_compress_streaming(self):
+        """ Test streamed chunks are compressed as they are produced """
+        rows = [b'{"title": "soup"}\n' * 50 for _ in range(5)]
+        response = self.process(
+            StreamingHttpResponse(iter(rows), content_type='application/json'),
+            accept='gzip',
+        )
+
+        chunks = list(response.streaming_content)
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertGreaterEqual(len(chunks), len(rows))
+        self.assertEqual(gzip.decompress(b''.join(chunks)), b''.join(rows))
+
+    @override_settings(COMPRESSION_LEVELS={
+        'application/json': {'gzip': 1, 'br': 0},
+    })
+    def test_level_per_content_type(self):
+        """ Test the configured level is used """
+        response = self.process(json_response(), accept='br')
+        fastest = compression.compress(json_response().content, 'br', 0)
+
+        self.assertEqual(response.content, fastest)
+
+
+class PrecompressedStaticTests(SimpleTestCase):
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        self.script = os.path.join(self.root, 'app.js')
+        with open(self.script, 'w') as file:
+            file.write('console.log("recipe");\n' * 200)
+        override = override_settings(STATIC_ROOT=self.root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.storage = compression.CompressedStaticFilesStorage()
+
+    def test_post_process_writes_siblings(self):
+        """ Test collectstatic writes compressed siblings """
+        processed = list(self.storage.post_process({'app.js': None}))
+
+        self.assertEqual(processed, [('app.js', 'app.js', True)])
+        with open(self.script + '.br', 'rb') as file:
+            content = brotli.decompress(file.read())
+        with open(self.script, 'rb') as file:
+            self.assertEqual(content, file.read())
+        self.assertTrue(os.path.exists(self.script + '.gz'))
+
+    def test_serve_precompressed(self):
+        """ Test the static view sends the sibling the client accepts """
+        self.storage.precompress('app.js')
+        url = reverse('static', args=['app.js'])
+
+        encoded = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        plain = self.client.get(url)
+
+        self.assertEqual(encoded['Content-Encoding'], 'gzip')
+        self.assertEqual(encoded['Vary'], 'Accept-Encoding')
+        with open(self.script, 'rb') as file:
+            content = file.read()
+        self.assertEqual(
+            gzip.decompress(b''.join(encoded.streaming_content)), content
+        )
+        self.assertEqual(b''.join(plain.streaming_content), content)
+        self.assertNotEqual(encoded['ETag'], plain['ETag'])
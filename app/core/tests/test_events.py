@@ -0,0 +1,321 @@
+import asyncio
+import json
+import select
+import threading
+import time
+from unittest import mock
+
+import psycopg2
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.db import connection, connections, transaction
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import events
+from core.models import Recipe, Tag
+
+EVENTS_PATH = '/api/recipe/events/'
+
+
+def sample_user(email='test@gmail.com'):
+    return get_user_model().objects.create_user(
+        email=email, password='test_password'
+    )
+
+
+def _create_tag(user, name):
+    try:
+        return Tag.objects.create(user=user, name=name).id
+    finally:
+        connections.close_all()
+
+
+class FakeClient:
+    """ ASGI receive and send of a client that disconnects on demand """
+
+    def __init__(self):
+        self.sent = []
+        self.requested = False
+        self.body = asyncio.Event()
+        self.disconnected = asyncio.Event()
+
+    async def receive(self):
+        if not self.requested:
+            self.requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self.disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        self.sent.append(message)
+        self.body.set()
+
+    def text(self):
+        return b''.join(
+            message.get('body', b'') for message in self.sent
+        ).decode()
+
+    async def wait_for(self, text, timeout=5):
+        async def contains():
+            while text not in self.text():
+                self.body.clear()
+                await self.body.wait()
+        await asyncio.wait_for(contains(), timeout)
+
+
+def scope(path=EVENTS_PATH, method='GET', headers=(), query_string=b''):
+    return {
+        'type': 'http', 'method': method, 'path': path,
+        'headers': list(headers), 'query_string': query_string,
+    }
+
+
+class ChangeNotifyTest(TransactionTestCase):
+
+    def setUp(self) -> None:
+        self.user = sample_user()
+        params = connection.get_connection_params()
+        self.listener = psycopg2.connect(**params)
+        self.listener.set_session(autocommit=True)
+        with self.listener.cursor() as cursor:
+            cursor.execute(f'LISTEN {events.CHANNEL}')
+
+    def tearDown(self) -> None:
+        self.listener.close()
+
+    def notifications(self, count=None, timeout=2):
+        """ Return the payloads received until count arrived or timeout """
+        payloads = []
+        deadline = time.monotonic() + timeout
+        while count is None or len(payloads) < count:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            select.select([self.listener], [], [], remaining)
+            self.listener.poll()
+            payloads += [
+                json.loads(notify.payload)
+                for notify in self.listener.notifies
+            ]
+            self.listener.notifies.clear()
+        return payloads
+
+    def test_changes_notify(self):
+        """ Test creating, updating and deleting rows notifies the user """
+        recipe = Recipe.objects.create(
+            user=self.user, title='test', time_minutes=10, price=5.00
+        )
+        recipe.title = 'changed'
+        recipe.save()
+        recipe_id = recipe.id
+        recipe.delete()
+
+        payloads = self.notifications(count=3)
+        self.assertEqual(
+            [(p['type'], p['op'], p['id']) for p in payloads],
+            [('recipe', 'create', recipe_id), ('recipe', 'update', recipe_id),
+             ('recipe', 'delete', recipe_id)],
+        )
+        self.assertTrue(all(p['user'] == self.user.id for p in payloads))
+        seqs = [p['seq'] for p in payloads]
+        self.assertEqual(seqs, sorted(seqs))
+
+    def test_rolled_back_changes_not_notified(self):
+        """ Test changes of a rolled back transaction send no events """
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                Tag.objects.create(user=self.user, name='test')
+                raise RuntimeError()
+
+        self.assertEqual(self.notifications(timeout=0.5), [])
+
+
+@override_settings(EVENTS_HEARTBEAT=0.2)
+class EventStreamAppTest(TransactionTestCase):
+
+    def setUp(self) -> None:
+        self.user = sample_user()
+        self.token = Token.objects.create(user=self.user).key
+        self.django_scopes = []
+
+        async def django_application(scope, receive, send):
+            self.django_scopes.append(scope)
+
+        self.app = events.EventStreamApp(django_application)
+
+    def tearDown(self) -> None:
+        connections.close_all()
+
+    def run_app(self, request, until, timeout=5):
+        """ Run a request until until(client) returns, then disconnect """
+        client = None
+
+        async def main():
+            nonlocal client
+            client = FakeClient()
+            task = asyncio.ensure_future(
+                self.app(request, client.receive, client.send)
+            )
+            try:
+                await until(client)
+            finally:
+                client.disconnected.set()
+                await asyncio.wait_for(task, timeout)
+            events.close_listeners()
+
+        asyncio.run(main())
+        return client
+
+    def test_auth_required(self):
+        """ Test the stream is refused without a valid token """
+        for request in (
+            scope(),
+            scope(headers=[(b'authorization', b'Token wrong')]),
+        ):
+            client = self.run_app(request, lambda client: asyncio.sleep(0))
+            self.assertEqual(client.sent[0]['status'], 401)
+
+    def test_other_paths_passed_to_django(self):
+        """ Test other requests are handled by the Django application """
+        self.run_app(scope(path='/api/recipe/tags/'),
+                     lambda client: asyncio.sleep(0))
+
+        self.assertEqual(self.django_scopes[0]['path'], '/api/recipe/tags/')
+
+    def test_streams_own_changes(self):
+        """ Test the user's changes are streamed and others' are not """
+        other = sample_user('other@gmail.com')
+        tag_ids = []
+
+        async def until(client):
+            await client.wait_for(': connected')
+            await sync_to_async(_create_tag)(other, 'other')
+            tag_ids.append(await sync_to_async(_create_tag)(self.user, 'own'))
+            await client.wait_for('event: tag.create')
+
+        client = self.run_app(scope(
+            headers=[(b'authorization', f'Token {self.token}'.encode())]
+        ), until)
+
+        self.assertEqual(client.sent[0]['status'], 200)
+        self.assertIn(
+            (b'content-type', b'text/event-stream'), client.sent[0]['headers']
+        )
+        text = client.text()
+        self.assertIn(f'data: {{"id": {tag_ids[0]}}}', text)
+        self.assertEqual(text.count('event: tag.create'), 1)
+
+    def test_ticket_query_parameter(self):
+        """ Test EventSource clients connect with a short-lived ticket """
+        ticket = events.issue_ticket(self.user)
+        client = self.run_app(
+            scope(query_string=f'ticket={ticket}'.encode()),
+            lambda client: client.wait_for(': connected'),
+        )
+        self.assertEqual(client.sent[0]['status'], 200)
+
+        for query_string in (f'token={self.token}', f'ticket={self.token}'):
+            client = self.run_app(scope(query_string=query_string.encode()),
+                                  lambda client: asyncio.sleep(0))
+            self.assertEqual(client.sent[0]['status'], 401)
+
+        with mock.patch('django.core.signing.time.time',
+                        return_value=time.time() + 61):
+            client = self.run_app(
+                scope(query_string=f'ticket={ticket}'.encode()),
+                lambda client: asyncio.sleep(0),
+            )
+        self.assertEqual(client.sent[0]['status'], 401)
+
+    def test_ticket_endpoint(self):
+        """ Test the API issues stream tickets to authenticated users """
+        client = APIClient()
+        url = reverse('recipe:events-ticket')
+        self.assertEqual(client.post(url).status_code, 401)
+
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+        response = client.post(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            events._ticket_user(response.data['ticket']), self.user
+        )
+
+    def test_heartbeat(self):
+        """ Test an idle stream sends heartbeat comments """
+        client = self.run_app(scope(
+            headers=[(b'authorization', f'Token {self.token}'.encode())]
+        ), lambda client: client.wait_for(': heartbeat'))
+
+        self.assertIn(': heartbeat', client.text())
+
+    def test_listener_closed_with_last_subscriber(self):
+        """ Test the listen connection is closed once nobody listens """
+        listeners = []
+
+        async def until(client):
+            await client.wait_for(': connected')
+            listeners.extend(events.get_listeners().values())
+            self.assertTrue(all(
+                listener.connection is not None for listener in listeners
+            ))
+
+        self.run_app(scope(
+            headers=[(b'authorization', f'Token {self.token}'.encode())]
+        ), until)
+
+        self.assertTrue(all(
+            listener.connection is None for listener in listeners
+        ))
+
+    def test_listen_failure(self):
+        """ Test a database that can not be listened to answers 503 """
+        listeners, threads = [], []
+
+        def listen(params):
+            threads.append(threading.current_thread())
+            raise psycopg2.OperationalError('database unavailable')
+
+        async def until(client):
+            await client.wait_for('unavailable')
+            listeners.extend(events.get_listeners().values())
+
+        request = scope(
+            headers=[(b'authorization', f'Token {self.token}'.encode())]
+        )
+        with mock.patch.object(events.Listener, '_listen',
+                               side_effect=listen):
+            with self.assertLogs('core.events', 'WARNING'):
+                client = self.run_app(request, until)
+
+        self.assertEqual(client.sent[0]['status'], 503)
+        self.assertNotIn(threading.main_thread(), threads)
+        self.assertTrue(all(
+            not listener.subscribers and listener.connection is None
+            for listener in listeners
+        ))
+
+
+class ListenerTest(TransactionTestCase):
+
+    @override_settings(EVENTS_QUEUE_SIZE=2)
+    def test_slow_subscriber_resyncs(self):
+        """ Test a subscriber falling behind is told to resync """
+        listener = events.Listener('default')
+
+        async def main():
+            queue = asyncio.Queue(maxsize=2)
+            listener.subscribers[1] = {queue}
+            for seq in range(3):
+                listener.publish(1, {'user': 1, 'seq': seq})
+            listener.publish(2, {'user': 2, 'seq': 4})
+            return [queue.get_nowait() for _ in range(queue.qsize())]
+
+        self.assertEqual(asyncio.run(main()), [events.RESYNC])
+        self.assertEqual(
+            events.format_event(events.RESYNC),
+            b'event: resync\ndata: {}\n\n',
+        )
@@ -0,0 +1,149 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from core import imagestore
+from core.models import ImageBlob, Recipe
+
+
+def sample_recipe(user, **params):
+    defaults = {'title': 'test', 'time_minutes': 10, 'price': 5.00}
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class ImageStoreTests(TestCase):
+
+    def setUp(self) -> None:
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = get_user_model().objects.create_user(
+            email='test@gmail.com',
+            password='test_password',
+        )
+
+    def set_image(self, recipe, content, filename='photo.jpg'):
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.image.save(filename, ContentFile(content))
+
+    def ref_count(self, name):
+        return ImageBlob.objects.get(name=name).ref_count
+
+    def test_identical_images_share_a_file(self):
+        """ Test uploads with the same bytes are stored once """
+        recipe1 = sample_recipe(user=self.user)
+        recipe2 = sample_recipe(user=self.user)
+
+        self.set_image(recipe1, b'same bytes')
+        self.set_image(recipe2, b'same bytes', filename='other.JPG')
+
+        digest = hashlib.sha256(b'same bytes').hexdigest()
+        self.assertEqual(
+            recipe1.image.name,
+            f'uploads/recipe/{digest[:2]}/{digest}.jpg',
+        )
+        self.assertEqual(recipe1.image.name, recipe2.image.name)
+        self.assertEqual(
+            os.listdir(os.path.dirname(recipe1.image.path)),
+            [f'{digest}.jpg'],
+        )
+        self.assertEqual(self.ref_count(recipe1.image.name), 2)
+
+    def test_replaced_and_deleted_images_released(self):
+        """ Test replacing or deleting a recipe drops its references """
+        recipe1 = sample_recipe(user=self.user)
+        recipe2 = sample_recipe(user=self.user)
+        self.set_image(recipe1, b'first')
+        self.set_image(recipe2, b'first')
+        first = recipe1.image.name
+
+        self.set_image(recipe1, b'second')
+        self.assertEqual(self.ref_count(first), 1)
+        self.assertEqual(self.ref_count(recipe1.image.name), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe2.delete()
+        self.assertEqual(self.ref_count(first), 0)
+
+    def test_gc_deletes_only_orphans(self):
+        """ Test garbage collection keeps referenced files """
+        recipe1 = sample_recipe(user=self.user)
+        recipe2 = sample_recipe(user=self.user)
+        self.set_image(recipe1, b'kept')
+        self.set_image(recipe2, b'orphaned')
+        orphan = recipe2.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe2.delete()
+
+        self.assertEqual(imagestore.collect_garbage(), [])
+        deleted = imagestore.collect_garbage(grace=timedelta(0))
+
+        self.assertEqual(deleted, [orphan])
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertTrue(default_storage.exists(recipe1.image.name))
+        self.assertFalse(ImageBlob.objects.filter(name=orphan).exists())
+
+    def test_reused_orphan_kept_by_gc(self):
+        """ Test an orphan reused by a new upload survives collection """
+        recipe1 = sample_recipe(user=self.user)
+        recipe2 = sample_recipe(user=self.user)
+        self.set_image(recipe1, b'reused')
+        name = recipe1.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe1.delete()
+        ImageBlob.objects.filter(name=name).update(
+            updated_at=ImageBlob.objects.get(name=name).updated_at
+            - timedelta(days=1)
+        )
+
+        # collected before the new reference is counted on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe2.image.save('photo.jpg', ContentFile(b'reused'))
+            self.assertEqual(imagestore.collect_garbage(), [])
+
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(self.ref_count(name), 1)
+
+    def test_collected_file_written_again(self):
+        """ Test an upload matching a collected file stores it again """
+        recipe = sample_recipe(user=self.user)
+        self.set_image(recipe, b'collected')
+        name = recipe.image.name
+        default_storage.delete(name)
+
+        self.set_image(recipe, b'collected')
+
+        self.assertTrue(default_storage.exists(name))
+
+    @override_settings(RECIPE_IMAGE_CONTENT_ADDRESSED=False)
+    def test_dedupe_command(self):
+        """ Test existing random names are merged by content """
+        recipes = [sample_recipe(user=self.user) for _ in range(3)]
+        for recipe in recipes:
+            self.set_image(recipe, b'legacy')
+        self.assertEqual(len({recipe.image.name for recipe in recipes}), 3)
+
+        call_command('dedupe_media', stdout=StringIO())
+        call_command('gc_media', grace=-1, stdout=StringIO())
+
+        names = set(Recipe.objects.values_list('image', flat=True))
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertTrue(imagestore.is_content_addressed(name))
+        self.assertEqual(self.ref_count(name), 3)
+        self.assertEqual(
+            list(imagestore._stored_names(default_storage)), [name]
+        )
@@ -0,0 +1,189 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+from urllib.parse import urlsplit
+
+from django.contrib.auth import get_user_model
+from django.test import Client, TestCase, override_settings
+from rest_framework.authtoken.models import Token
+
+from core.media import signed_media_url
+from core.models import Recipe
+
+CONTENT = bytes(range(256)) * 4
+DIGEST = hashlib.sha256(CONTENT).hexdigest()
+CONTENT_NAME = f'uploads/recipe/{DIGEST[:2]}/{DIGEST}.jpg'
+LEGACY_NAME = 'uploads/recipe/legacy.png'
+
+
+class MediaServingTests(TestCase):
+
+    def setUp(self) -> None:
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        for name in (CONTENT_NAME, LEGACY_NAME, 'private.txt'):
+            path = os.path.join(self.media_root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(CONTENT)
+
+        self.user = get_user_model().objects.create_user(
+            email='test@gmail.com',
+            password='test_password',
+        )
+        for name in (CONTENT_NAME, LEGACY_NAME):
+            Recipe.objects.create(user=self.user, title='test',
+                                  time_minutes=10, price=5.00, image=name)
+        self.token = Token.objects.create(user=self.user)
+        self.client = Client(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_serve_content_addressed_image(self):
+        """ Test content-addressed images are cached as immutable """
+        response = self.client.get(f'/media/{CONTENT_NAME}')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), CONTENT)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Content-Length'], str(len(CONTENT)))
+        self.assertEqual(response['ETag'], f'"{DIGEST}"')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_legacy_image_not_immutable(self):
+        """ Test randomly named images get a bounded max-age """
+        response = self.client.get(f'/media/{LEGACY_NAME}')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+    def test_not_modified(self):
+        """ Test a matching If-None-Match returns 304 """
+        response = self.client.get(
+            f'/media/{CONTENT_NAME}', HTTP_IF_NONE_MATCH=f'"{DIGEST}"'
+        )
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_range_requests(self):
+        """ Test byte ranges return partial content """
+        cases = [
+            ('bytes=10-19', 10, 19),
+            ('bytes=1000-', 1000, 1023),
+            ('bytes=-24', 1000, 1023),
+            ('bytes=1020-5000', 1020, 1023),
+        ]
+        for header, start, end in cases:
+            response = self.client.get(
+                f'/media/{CONTENT_NAME}', HTTP_RANGE=header
+            )
+
+            self.assertEqual(response.status_code, 206, header)
+            self.assertEqual(
+                b''.join(response.streaming_content),
+                CONTENT[start:end + 1],
+            )
+            self.assertEqual(
+                response['Content-Range'], f'bytes {start}-{end}/1024'
+            )
+            self.assertEqual(response['Content-Length'], str(end - start + 1))
+
+    def test_unsatisfiable_range(self):
+        """ Test a range past the end of the file returns 416 """
+        response = self.client.get(
+            f'/media/{CONTENT_NAME}', HTTP_RANGE='bytes=2000-'
+        )
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+    def test_outside_upload_directory_not_served(self):
+        """ Test only upload directories are served """
+        for path in ('private.txt', 'uploads/../private.txt',
+                     'uploads/recipe/missing.jpg'):
+            response = self.client.get(f'/media/{path}')
+
+            self.assertEqual(response.status_code, 404, path)
+
+    @override_settings(MEDIA_SERVE_MODE='x-accel-redirect')
+    def test_accel_redirect(self):
+        """ Test nginx delivers the file from an internal location """
+        response = self.client.get(f'/media/{CONTENT_NAME}')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(
+            response['X-Accel-Redirect'], f'/protected-media/{CONTENT_NAME}'
+        )
+        self.assertIn('immutable', response['Cache-Control'])
+
+    @override_settings(MEDIA_SERVE_MODE='x-sendfile')
+    def test_x_sendfile(self):
+        """ Test the front server gets the absolute file path """
+        response = self.client.get(f'/media/{CONTENT_NAME}')
+
+        self.assertEqual(
+            response['X-Sendfile'],
+            os.path.join(self.media_root, CONTENT_NAME),
+        )
+
+    def test_authentication_required(self):
+        """ Test media is not served without a valid token """
+        for client in (Client(), Client(HTTP_AUTHORIZATION='Token wrong')):
+            response = client.get(f'/media/{CONTENT_NAME}')
+
+            self.assertEqual(response.status_code, 401)
+
+    def test_token_query_parameter_refused(self):
+        """ Test the auth token is not accepted in the query string """
+        response = Client().get(
+            f'/media/{CONTENT_NAME}', {'token': self.token.key}
+        )
+
+        self.assertEqual(response.status_code, 401)
+
+    def test_signed_url(self):
+        """ Test a signed URL serves its file for a limited time """
+        url = signed_media_url(self.user, CONTENT_NAME)
+        other_file = url.replace(CONTENT_NAME, LEGACY_NAME)
+
+        self.assertEqual(Client().get(url).status_code, 200)
+        self.assertEqual(Client().get(other_file).status_code, 401)
+        self.assertEqual(Client().get(url + 'x').status_code, 401)
+        with mock.patch('django.core.signing.time.time',
+                        return_value=time.time() + 301):
+            self.assertEqual(Client().get(url).status_code, 401)
+
+    def test_image_url_endpoint(self):
+        """ Test the API hands out signed URLs of recipe images """
+        recipe = Recipe.objects.filter(image=CONTENT_NAME).get()
+
+        response = self.client.get(
+            f'/api/recipe/recipes/{recipe.id}/image-url/'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        url = urlsplit(response.json()['url'])
+        self.assertEqual(url.path, f'/media/{CONTENT_NAME}')
+        served = Client().get(f'{url.path}?{url.query}')
+        self.assertEqual(served.status_code, 200)
+
+    def test_other_users_media_not_served(self):
+        """ Test media of another user's recipes is not found """
+        other = get_user_model().objects.create_user(
+            email='other@gmail.com',
+            password='test_password',
+        )
+        client = Client(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=other).key}'
+        )
+
+        response = client.get(f'/media/{CONTENT_NAME}')
+
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,105 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from rest_framework.authtoken.models import Token
+
+from core import purge
+from core.models import (
+    ImageBlob,
+    Tag,
+    Ingredient,
+    Recipe,
+    RecipeSummary,
+    Tombstone,
+    UserPurge,
+)
+
+
+def sample_recipe(user, **params):
+    defaults = {'title': 'test', 'time_minutes': 10, 'price': 5.00}
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class UserPurgeTests(TestCase):
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user(
+            email='test@gmail.com',
+            password='test_password',
+        )
+        self.other = get_user_model().objects.create_user(
+            email='other@gmail.com',
+            password='test_password',
+        )
+        for user in (self.user, self.other):
+            tag = Tag.objects.create(user=user, name='vegan')
+            ingredient = Ingredient.objects.create(user=user, name='salt')
+            for _ in range(5):
+                recipe = sample_recipe(user=user)
+                recipe.tags.add(tag)
+                recipe.ingredients.add(ingredient)
+        Recipe.objects.filter(user=self.user).update(image='shared.jpg')
+        ImageBlob.objects.create(name='shared.jpg', ref_count=5)
+
+    def test_request_purge_deactivates_user(self):
+        """ Test requesting a purge disables the account immediately """
+        Token.objects.create(user=self.user)
+
+        record = purge.request_purge(self.user)
+
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertFalse(self.user.has_usable_password())
+        self.assertEqual(record.email, 'test@gmail.com')
+        self.assertFalse(Token.objects.filter(user=self.user).exists())
+        self.assertTrue(
+            get_user_model().objects.create_user(
+                email='test@gmail.com', password='test_password'
+            )
+        )
+
+    def test_purge_in_batches(self):
+        """ Test the purge deletes only the user's rows in batches """
+        record = purge.request_purge(self.user)
+        reports = []
+
+        done = purge.purge_user(
+            record,
+            batch_size=2,
+            progress=lambda item: reports.append(item.recipes_deleted),
+        )
+
+        self.assertTrue(done)
+        self.assertEqual(reports[:3], [2, 4, 5])
+        record.refresh_from_db()
+        self.assertIsNotNone(record.finished_at)
+        self.assertEqual(
+            (record.recipes_deleted, record.tags_deleted,
+             record.ingredients_deleted),
+            (5, 1, 1),
+        )
+        self.assertFalse(
+            get_user_model().objects.filter(pk=self.user.pk).exists()
+        )
+        self.assertEqual(Recipe.objects.count(), 5)
+        self.assertEqual(RecipeSummary.objects.count(), 5)
+        self.assertEqual(Recipe.tags.through.objects.count(), 5)
+        self.assertEqual(Tag.objects.get().user, self.other)
+        self.assertEqual(ImageBlob.objects.get().ref_count, 0)
+        self.assertFalse(Tombstone.objects.exists())
+
+    def test_purge_command_resumes_pending(self):
+        """ Test the command finishes purges left unfinished """
+        purge.request_purge(self.user)
+        out = StringIO()
+
+        call_command('purge_users', stdout=out)
+
+        self.assertIn('1 users purged', out.getvalue())
+        self.assertFalse(purge.pending_purges().exists())
+        self.assertTrue(UserPurge.objects.filter(
+            user_id=self.user.pk, recipes_deleted=5
+        ).exists())
@@ -0,0 +1,212 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connections
+from django.test import TestCase, override_settings
+
+from core import sharding, stats
+from core.models import (
+    Ingredient,
+    Recipe,
+    RecipeStats,
+    RecipeSummary,
+    Tag,
+)
+from core.routers import UserShardRouter
+
+
+def sample_user(email='test@gmail.com', password='test_password'):
+    return get_user_model().objects.create_user(email, password)
+
+
+class HashRingTests(TestCase):
+
+    def test_ring_is_deterministic(self):
+        """ Test the same key always lands on the same node """
+        ring = sharding.HashRing(['a', 'b', 'c'])
+        other = sharding.HashRing(['c', 'b', 'a'])
+
+        for key in range(100):
+            self.assertEqual(ring.get_node(key), other.get_node(key))
+
+    def test_adding_node_moves_few_keys(self):
+        """ Test adding a node only remaps roughly its share of keys """
+        before = sharding.HashRing(['a', 'b', 'c'])
+        after = sharding.HashRing(['a', 'b', 'c', 'd'])
+
+        keys = range(2000)
+        moved = [k for k in keys if before.get_node(k) != after.get_node(k)]
+
+        self.assertTrue(all(after.get_node(k) == 'd' for k in moved))
+        self.assertLess(len(moved), len(keys) / 2)
+
+    def test_empty_ring_raises(self):
+        """ Test looking up a key without nodes fails """
+        with self.assertRaises(ValueError):
+            sharding.HashRing([]).get_node(1)
+
+
+class ShardRoutingTests(TestCase):
+
+    def setUp(self) -> None:
+        self.router = UserShardRouter()
+
+    def test_unsharded_uses_default(self):
+        """ Test everything lives in default without shards configured """
+        user = sample_user()
+
+        self.assertEqual(sharding.shard_for_user(user), 'default')
+        self.assertIsNone(self.router.db_for_read(Recipe))
+
+    @override_settings(DATABASE_SHARDS=['default'])
+    def test_new_user_gets_placement(self):
+        """ Test a new user is assigned a shard from the ring """
+        user = sample_user()
+        user.refresh_from_db()
+
+        self.assertEqual(user.shard, 'default')
+        self.assertEqual(sharding.shard_for_user_id(user.pk), 'default')
+
+    @override_settings(DATABASE_SHARDS=['default', 'shard1'])
+    def test_router_uses_user_shard(self):
+        """ Test per-user rows are routed to the shard of their user """
+        user = get_user_model()(pk=1, email='a@gmail.com', shard='shard1')
+        tag = Tag(user=user, name='vegan')
+
+        self.assertEqual(
+            self.router.db_for_write(Tag, instance=tag), 'shard1'
+        )
+        self.assertEqual(
+            self.router.db_for_read(Recipe.tags.through, instance=tag),
+            'shard1'
+        )
+        self.assertEqual(
+            self.router.db_for_read(get_user_model(), instance=tag),
+            'default'
+        )
+
+    def test_rebalance_requires_shards(self):
+        """ Test the rebalance command refuses to run unsharded """
+        with self.assertRaises(CommandError):
+            call_command('rebalance_shards')
+
+    @override_settings(DATABASE_SHARDS=['default'])
+    def test_rebalance_unknown_shard(self):
+        """ Test the rebalance command rejects unknown target shards """
+        with self.assertRaises(CommandError):
+            call_command('rebalance_shards', target='missing')
+
+
+SHARD = 'shard_test'
+
+
+def create_test_database(alias):
+    """ Add a migrated test database next to the default one """
+    connections.databases[alias] = {
+        **connections.databases['default'], 'NAME': alias, 'TEST': {},
+    }
+    connections.ensure_defaults(alias)
+    connections.prepare_test_settings(alias)
+    connections[alias].creation.create_test_db(
+        verbosity=0, autoclobber=True, serialize=False
+    )
+
+
+def destroy_test_database(alias):
+    connections[alias].creation.destroy_test_db(alias, verbosity=0)
+    del connections[alias]
+    del connections.databases[alias]
+
+
+@override_settings(DATABASE_SHARDS=['default', SHARD])
+class MoveUserTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # created here rather than by the test runner, so the other tests
+        # do not pay for a second database
+        create_test_database(SHARD)
+        cls.databases = {'default', SHARD}
+        try:
+            super().setUpClass()
+        except BaseException:
+            destroy_test_database(SHARD)
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        try:
+            super().tearDownClass()
+        finally:
+            destroy_test_database(SHARD)
+
+    def setUp(self) -> None:
+        self.user = sample_user()
+        get_user_model().objects.filter(pk=self.user.pk).update(
+            shard='default'
+        )
+        self.user.refresh_from_db()
+        self.tag = Tag.objects.create(user=self.user, name='vegan')
+        self.ingredient = Ingredient.objects.create(
+            user=self.user, name='salt'
+        )
+        self.recipe = Recipe.objects.create(
+            user=self.user, title='soup', time_minutes=10, price=5.00
+        )
+        self.recipe.tags.add(self.tag)
+        self.recipe.ingredients.add(self.ingredient)
+        stats.rebuild_stats(self.user)
+        self.tag.delete()
+
+    def rows(self, using):
+        return {
+            model._meta.label: model.objects.using(using).filter(
+                **{lookup: self.user.pk}
+            ).count()
+            for model, lookup in sharding.sharded_models()
+        }
+
+    def test_move_user(self):
+        """ Test every per-user row is copied and removed from the source """
+        before = self.rows('default')
+        last_seq = Recipe.objects.get(pk=self.recipe.pk).change_seq
+
+        copied = sharding.move_user(self.user, SHARD)
+
+        self.assertEqual(copied, sum(before.values()))
+        self.assertEqual(self.rows(SHARD), before)
+        self.assertFalse(any(self.rows('default').values()))
+        moved = get_user_model().objects.using('default').get(
+            pk=self.user.pk
+        )
+        self.assertEqual(moved.shard, SHARD)
+        self.assertFalse(moved.shard_moving)
+        self.assertEqual(sharding.shard_for_user(moved), SHARD)
+
+        summary = RecipeSummary.objects.using(SHARD).get(recipe=self.recipe)
+        self.assertEqual(summary.ingredient_ids, [self.ingredient.pk])
+        copied_stats = RecipeStats.objects.using(SHARD).get(user=self.user)
+        self.assertEqual(copied_stats.recipe_count, 1)
+
+        # changes made after the move are numbered after the copied ones
+        recipe = Recipe.objects.using(SHARD).get(pk=self.recipe.pk)
+        recipe.title = 'stew'
+        recipe.save()
+        recipe.refresh_from_db()
+        self.assertGreater(recipe.change_seq, last_seq)
+
+    def test_rebalance_command(self):
+        """ Test the rebalance command moves users to the target shard """
+        out = StringIO()
+
+        call_command('rebalance_shards', target=SHARD, stdout=out)
+
+        self.assertIn(f'test@gmail.com: default -> {SHARD}', out.getvalue())
+        self.assertEqual(
+            Recipe.objects.using(SHARD).filter(user=self.user).count(), 1
+        )
+        self.assertFalse(
+            Recipe.objects.using('default').filter(user=self.user).exists()
+        )
@@ -0,0 +1,166 @@
+import multiprocessing
+import tempfile
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from core.shmcache import SLOT, SharedMemoryCache
+
+
+def _increment(location, options, times):
+    cache = SharedMemoryCache(location, {'OPTIONS': options})
+    for _ in range(times):
+        cache.incr('counter')
+
+
+def used_slots(cache):
+    region = cache._region
+    return sum(
+        SLOT.unpack_from(region.map, offset)[4]
+        for index in range(region.sets) for offset in region._slots(index)
+    )
+
+
+class SharedMemoryCacheTests(SimpleTestCase):
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.location = f'{directory.name}/cache.shm'
+        self.cache = self.make_cache()
+
+    def make_cache(self, **options):
+        self.options = {'SIZE': 64 * 1024, 'SLOT_SIZE': 512, **options}
+        return SharedMemoryCache(self.location, {'OPTIONS': self.options})
+
+    def test_set_get_delete(self):
+        """ Test values are stored, replaced and deleted """
+        self.cache.set('tags', ['vegan', 'dessert'])
+        self.cache.set('tags', ['vegan'])
+
+        self.assertEqual(self.cache.get('tags'), ['vegan'])
+        self.assertTrue(self.cache.delete('tags'))
+        self.assertIsNone(self.cache.get('tags'))
+        self.assertFalse(self.cache.delete('tags'))
+
+    def test_add_only_new_keys(self):
+        """ Test add keeps an existing value """
+        self.assertTrue(self.cache.add('key', 1))
+        self.assertFalse(self.cache.add('key', 2))
+        self.assertEqual(self.cache.get('key'), 1)
+
+    def test_timeout(self):
+        """ Test expired entries are not returned """
+        self.cache.set('expired', 1, timeout=-1)
+        self.cache.set('forever', 1, timeout=None)
+        self.cache.set('soon', 1)
+        self.cache.touch('soon', timeout=-1)
+
+        self.assertIsNone(self.cache.get('expired'))
+        self.assertEqual(self.cache.get('forever'), 1)
+        self.assertIsNone(self.cache.get('soon'))
+        self.assertTrue(self.cache.add('soon', 2))
+
+    def test_large_value_split_over_slots(self):
+        """ Test values larger than a slot are stored in chunks """
+        value = list(range(1000))
+        self.cache.set('key', 'small')
+        self.cache.set('key', value)
+
+        self.assertEqual(self.cache.get('key'), value)
+        self.assertEqual(self.make_cache().get('key'), value)
+        self.assertGreater(used_slots(self.cache), 2)
+
+        self.cache.set('key', 'small')
+        self.assertEqual(used_slots(self.cache), 1)
+        self.cache.set('key', value)
+        self.assertTrue(self.cache.delete('key'))
+        self.assertEqual(used_slots(self.cache), 0)
+
+    def test_large_value_evicted_chunk(self):
+        """ Test a value is missing once one of its chunks is evicted """
+        self.cache.set('key', 'x' * 2048)
+        region, index, digest, key = self.cache._locate('key', None)
+        manifest, _ = region.read(region.find(index, digest, key, 0))
+        chunk_key = self.cache._chunk_keys(key, manifest)[-1]
+        _, index, digest, _ = self.cache._locate_raw(chunk_key)
+        region.free(region.find(index, digest, chunk_key, 0))
+
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_large_value_touch(self):
+        """ Test touch gives the chunks of a value the new expiry """
+        self.cache.set('key', 'x' * 2048, timeout=60)
+        self.cache.touch('key', timeout=None)
+
+        with mock.patch('core.shmcache.time.time',
+                        return_value=time.time() + 3600):
+            self.assertEqual(self.cache.get('key'), 'x' * 2048)
+
+    def test_oversized_value_not_cached(self):
+        """ Test values above MAX_VALUE_SIZE replace no older value """
+        cache = self.make_cache(MAX_VALUE_SIZE=1024)
+        cache.set('key', 'small')
+
+        with self.assertLogs('core.shmcache', 'WARNING'):
+            cache.set('key', 'x' * 2048)
+
+        self.assertIsNone(cache.get('key'))
+
+    def test_shared_between_instances(self):
+        """ Test entries are visible through another mapping of the file """
+        self.cache.set('key', 'value')
+
+        self.assertEqual(self.make_cache().get('key'), 'value')
+
+    def test_other_layout_replaces_file(self):
+        """ Test opening the file with another size starts empty """
+        self.cache.set('key', 'value')
+        cache = self.make_cache(SIZE=128 * 1024)
+
+        self.assertIsNone(cache.get('key'))
+        cache.set('key', 'new')
+        self.assertEqual(cache.get('key'), 'new')
+
+    def test_clock_eviction_keeps_recently_used(self):
+        """ Test a full set evicts entries that were not read again """
+        cache = self.make_cache(SIZE=4 * 512, WAYS=4)
+        for index in range(4):
+            cache.set(index, index)
+        cache.get(0)
+
+        cache.set('new', 'value')
+
+        self.assertEqual(cache.get(0), 0)
+        self.assertEqual(cache.get('new'), 'value')
+        self.assertEqual(
+            sum(cache.get(index) is not None for index in range(1, 4)), 2
+        )
+
+    def test_incr_atomic_across_processes(self):
+        """ Test increments of concurrent processes are not lost """
+        self.cache.set('counter', 0)
+        context = multiprocessing.get_context('fork')
+        workers = [
+            context.Process(
+                target=_increment, args=(self.location, self.options, 200)
+            )
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(self.cache.get('counter'), 800)
+        self.assertEqual(self.cache.incr('counter', 5), 805)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_clear(self):
+        """ Test clear removes every entry """
+        self.cache.set_many({'a': 1, 'b': 2})
+        self.cache.clear()
+
+        self.assertEqual(self.cache.get_many(['a', 'b']), {})
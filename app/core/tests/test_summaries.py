@@ -0,0 +1,91 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from core import summaries
+from core.models import Tag, Ingredient, Recipe, RecipeSummary
+
+
+def sample_recipe(user, **params):
+    defaults = {'title': 'test', 'time_minutes': 10, 'price': 5.00}
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class RecipeSummaryTests(TestCase):
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user(
+            email='test@gmail.com',
+            password='test_password',
+        )
+        self.recipe = sample_recipe(user=self.user)
+        self.tag = Tag.objects.create(user=self.user, name='vegan')
+        self.ingredient = Ingredient.objects.create(
+            user=self.user, name='salt'
+        )
+
+    def summary(self):
+        return RecipeSummary.objects.get(recipe=self.recipe)
+
+    def test_summary_created_with_recipe(self):
+        """ Test a new recipe gets an empty summary row """
+        summary = self.summary()
+
+        self.assertEqual(summary.user, self.user)
+        self.assertEqual(summary.tag_ids, [])
+        self.assertEqual(summary.ingredient_ids, [])
+
+    def test_summary_follows_m2m_changes(self):
+        """ Test adding and removing relations updates the summary """
+        self.recipe.tags.add(self.tag)
+        self.recipe.ingredients.add(self.ingredient)
+        summary = self.summary()
+        self.assertEqual(summary.tag_ids, [self.tag.id])
+        self.assertEqual(summary.tag_names, ['vegan'])
+        self.assertEqual(summary.ingredient_ids, [self.ingredient.id])
+
+        self.recipe.tags.remove(self.tag)
+        self.assertEqual(self.summary().tag_ids, [])
+
+    def test_summary_follows_reverse_clear(self):
+        """ Test clearing recipes from the tag side updates summaries """
+        self.recipe.tags.add(self.tag)
+        self.tag.recipe_set.clear()
+
+        self.assertEqual(self.summary().tag_ids, [])
+
+    def test_summary_follows_rename_and_delete(self):
+        """ Test renamed and deleted ingredients are reflected """
+        self.recipe.ingredients.add(self.ingredient)
+        self.ingredient.name = 'sea salt'
+        self.ingredient.save()
+        self.assertEqual(self.summary().ingredient_names, ['sea salt'])
+
+        self.ingredient.delete()
+        self.assertEqual(self.summary().ingredient_ids, [])
+
+    def test_user_delete_cascades(self):
+        """ Test deleting a user with tagged recipes succeeds """
+        self.recipe.tags.add(self.tag)
+        self.user.delete()
+
+        self.assertFalse(RecipeSummary.objects.exists())
+
+    def test_check_and_rebuild_commands(self):
+        """ Test the checker reports stale rows and the rebuild fixes them """
+        self.recipe.tags.add(self.tag)
+        RecipeSummary.objects.filter(recipe=self.recipe).update(tag_ids=[])
+        self.assertEqual(
+            summaries.inconsistent_summaries(), [self.recipe.id]
+        )
+
+        with self.assertRaises(CommandError):
+            call_command('check_recipe_summaries', stdout=StringIO())
+
+        call_command('rebuild_recipe_summaries', stdout=StringIO())
+        self.assertEqual(summaries.inconsistent_summaries(), [])
+        self.assertEqual(self.summary().tag_ids, [self.tag.id])
@@ -0,0 +1,143 @@
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core.models import Task
+from core.taskqueue import Worker, get_task, task
+
+calls = []
+
+
+@task()
+def record(value):
+    calls.append(value)
+
+
+@task(queue='media', max_attempts=2)
+def fail():
+    raise ValueError('broken')
+
+
+class TaskQueueTests(TestCase):
+
+    def setUp(self) -> None:
+        calls.clear()
+        self.worker = Worker({'default': 2, 'media': 1}, name='test')
+
+    def test_enqueue_registers_job(self):
+        """ Test enqueueing stores a job resolvable by name """
+        job = record.delay('a')
+
+        self.assertEqual(job.args, ['a'])
+        self.assertEqual(job.status, Task.QUEUED)
+        self.assertIs(get_task(job.name), record)
+
+    def test_claim_by_priority_skipping_claimed(self):
+        """ Test jobs are claimed by priority and only once """
+        low = record.enqueue(['low'], priority=-5)
+        high = record.enqueue(['high'], priority=5)
+        normal = record.delay('normal')
+        record.enqueue(['later'], delay=timedelta(hours=1))
+
+        first = self.worker.claim('default', 2)
+        second = self.worker.claim('default', 2)
+
+        self.assertEqual([job.pk for job in first], [high.pk, normal.pk])
+        self.assertEqual([job.pk for job in second], [low.pk])
+        self.assertEqual(self.worker.claim('default', 2), [])
+        self.assertTrue(all(
+            job.status == Task.RUNNING and job.locked_by == 'test'
+            for job in first + second
+        ))
+
+    def test_successful_job_deleted(self):
+        """ Test finished jobs are removed from the queue """
+        record.delay('done')
+
+        self.assertEqual(self.worker.run_burst(), 1)
+
+        self.assertEqual(calls, ['done'])
+        self.assertFalse(Task.objects.exists())
+
+    def test_failed_job_retried_with_backoff(self):
+        """ Test failures are retried later, then marked failed """
+        job = fail.delay()
+
+        self.worker.run_burst()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Task.QUEUED)
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('ValueError', job.last_error)
+
+        Task.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        self.worker.run_burst()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Task.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    @override_settings(TASK_LOCK_TIMEOUT=60)
+    def test_stale_jobs_requeued(self):
+        """ Test jobs of dead workers are queued again """
+        job = record.delay('lost')
+        self.worker.claim('default', 1)
+        Task.objects.filter(pk=job.pk).update(
+            locked_at=timezone.now() - timedelta(minutes=5)
+        )
+
+        self.assertEqual(self.worker.requeue_stale(), 1)
+        self.assertEqual(Task.objects.get().status, Task.QUEUED)
+
+    @override_settings(TASK_LOCK_TIMEOUT=60)
+    def test_stale_jobs_fail_after_max_attempts(self):
+        """ Test lost jobs are not retried past their max attempts """
+        job = fail.delay()
+        Task.objects.filter(pk=job.pk).update(
+            status=Task.RUNNING,
+            attempts=2,
+            locked_at=timezone.now() - timedelta(minutes=5),
+        )
+
+        self.assertEqual(self.worker.requeue_stale(), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Task.FAILED)
+
+    @override_settings(TASK_LOCK_TIMEOUT=60)
+    def test_heartbeat_keeps_running_jobs(self):
+        """ Test jobs whose worker sends heartbeats are not requeued """
+        job = record.delay('slow')
+        self.worker.claim('default', 1)
+        Task.objects.filter(pk=job.pk).update(
+            locked_at=timezone.now() - timedelta(minutes=5)
+        )
+        other = Worker({'default': 1}, name='other')
+
+        self.assertEqual(self.worker.heartbeat(), 1)
+        self.assertEqual(other.heartbeat(), 0)
+        self.assertEqual(other.requeue_stale(), 0)
+        self.assertEqual(Task.objects.get().status, Task.RUNNING)
+
+    @override_settings(TASK_HEARTBEAT_INTERVAL=0.01)
+    def test_heartbeats_sent_while_running(self):
+        """ Test locks are refreshed from a thread while jobs run """
+        with mock.patch.object(Worker, 'heartbeat') as heartbeat:
+            with self.worker._heartbeats():
+                time.sleep(0.1)
+
+        self.assertTrue(heartbeat.called)
+
+    def test_worker_command_burst(self):
+        """ Test the worker command runs due jobs of selected queues """
+        record.delay('command')
+        fail.delay()
+        out = StringIO()
+
+        call_command('run_worker', queue=['default'], burst=True, stdout=out)
+
+        self.assertIn('1 jobs run', out.getvalue())
+        self.assertEqual(Task.objects.get().name, fail.name)
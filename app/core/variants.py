@@ -0,0 +1,318 @@
+import fcntl
+import hashlib
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as RenderTimeout
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from PIL import Image, ImageOps
+from django.conf import settings
+
+from .imagestore import content_digest
+
+try:
+    # registers AVIF support on Pillow releases without the native plugin
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+# load every format plugin so Image.SAVE lists the available encoders
+Image.init()
+
+# (Accept media type, Pillow format, extension), best first
+NEGOTIATED_FORMATS = [
+    ('image/avif', 'AVIF', 'avif'),
+    ('image/webp', 'WEBP', 'webp'),
+]
+
+# evict at least every this many writes, writes of other workers are not
+# seen by the local size estimate
+EVICT_EVERY = 64
+
+# errors of Pillow and the file system reading a corrupt or missing source
+SOURCE_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+
+_pool = None
+_pool_lock = threading.Lock()
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+class SourceUnreadable(Exception):
+    """ The source image is missing or can not be decoded """
+
+
+class VariantUnavailable(Exception):
+    """ The variant could not be rendered in time, retrying may work """
+
+
+def _accepted_types(accept):
+    """ Return media types of an Accept header with a non-zero quality """
+    accepted = set()
+    for part in (accept or '').split(','):
+        media_type, *params = [item.strip() for item in part.split(';')]
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        if quality > 0:
+            accepted.add(media_type.lower())
+    return accepted
+
+
+def negotiate_format(accept, source_name):
+    """
+    Return (Pillow format, extension) of the best format the client
+    accepts, falling back to JPEG or PNG depending on the source.
+    """
+    accepted = _accepted_types(accept)
+    for media_type, image_format, ext in NEGOTIATED_FORMATS:
+        if media_type in accepted and image_format in Image.SAVE:
+            return image_format, ext
+    if source_name.lower().endswith(('.png', '.gif')):
+        return 'PNG', 'png'
+    return 'JPEG', 'jpg'
+
+
+def variant_width(width):
+    """ Round a requested width up to the nearest configured width """
+    widths = sorted(settings.RECIPE_IMAGE_WIDTHS)
+    for allowed in widths:
+        if width <= allowed:
+            return allowed
+    return widths[-1]
+
+
+def render_variant(source, target, width, image_format, quality):
+    """
+    Write a resized copy of an image to target and return its size.
+
+    Runs in pool processes, the file appears under the target name only
+    once it is complete.
+    """
+    with Image.open(source) as image:
+        # let the JPEG decoder downscale while decoding
+        image.draft('RGB', (width, width * image.height // image.width))
+        image = ImageOps.exif_transpose(image)
+        if image.width > width:
+            image.thumbnail(
+                (width, width * image.height // image.width + 1),
+                Image.LANCZOS,
+            )
+        has_alpha = image.mode in ('RGBA', 'LA') or (
+            image.mode == 'P' and 'transparency' in image.info
+        )
+        if image_format == 'JPEG' or not has_alpha:
+            image = image.convert('RGB')
+        else:
+            image = image.convert('RGBA')
+
+        buffer = BytesIO()
+        image.save(buffer, image_format, quality=quality, optimize=True)
+
+    partial = f'{target}.{uuid.uuid4().hex}.part'
+    with open(partial, 'wb') as file:
+        file.write(buffer.getbuffer())
+    os.replace(partial, target)
+    return buffer.tell()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_VARIANT_WORKERS
+            )
+        return _pool
+
+
+def _reset_pool(pool):
+    """ Drop a pool whose worker process died, the next render starts one """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+class VariantCache:
+    """
+    Size-bounded disk cache of image variants.
+
+    Entries are files written atomically with a rename, so the cache
+    survives restarts and is shared by every worker. Hits refresh the
+    file mtime and eviction removes the least recently used files under
+    an exclusive lock once the cache grows past its size.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.size = None
+        self.writes = 0
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """ Return the path of a cached variant, or None """
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def added(self, size):
+        """ Account for a new entry and evict when over the size """
+        with self.lock:
+            if self.size is None:
+                self.size = self._scan_size()
+            self.size += size
+            self.writes += 1
+            if self.size <= self.max_size and self.writes < EVICT_EVERY:
+                return
+            self.writes = 0
+        self.evict()
+
+    def _entries(self):
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.is_file():
+                    yield entry
+
+    def _scan_size(self):
+        os.makedirs(self.directory, exist_ok=True)
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def evict(self, target_ratio=0.9):
+        """ Delete least recently used entries down to target_ratio """
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = []
+            for entry in self._entries():
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+            size = sum(entry_size for _, entry_size, _ in entries)
+
+            limit = self.max_size * target_ratio
+            if size > self.max_size:
+                for _, entry_size, path in sorted(entries):
+                    if size <= limit:
+                        break
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    size -= entry_size
+
+        with self.lock:
+            self.size = size
+        return size
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None or _cache.directory != settings.IMAGE_VARIANT_CACHE_DIR:
+        _cache = VariantCache(
+            settings.IMAGE_VARIANT_CACHE_DIR,
+            settings.IMAGE_VARIANT_CACHE_SIZE,
+        )
+    return _cache
+
+
+def variant_key(name, source_path, width, ext):
+    """ Return the cache key of a variant of a stored image """
+    digest = content_digest(name)
+    if digest is None:
+        try:
+            stat = os.stat(source_path)
+        except FileNotFoundError as error:
+            raise SourceUnreadable(name) from error
+        digest = hashlib.sha256(
+            f'{name}:{stat.st_mtime_ns}:{stat.st_size}'.encode()
+        ).hexdigest()
+    return f'{digest}-{width}.{ext}'
+
+
+def _render(cache, key, path, args):
+    """ Render a variant to path, once for concurrent requests """
+    if not settings.IMAGE_VARIANT_WORKERS:
+        try:
+            cache.added(render_variant(*args))
+        except SOURCE_ERRORS as error:
+            raise SourceUnreadable(args[0]) from error
+        return
+
+    # concurrent requests for the same variant wait on a single render
+    pool = _get_pool()
+    with _pending_lock:
+        future = _pending.get(key)
+        owner = future is None
+        if owner:
+            future = _pending[key] = pool.submit(render_variant, *args)
+    try:
+        size = future.result(timeout=settings.IMAGE_VARIANT_TIMEOUT)
+    except RenderTimeout as error:
+        raise VariantUnavailable(key) from error
+    except BrokenProcessPool as error:
+        _reset_pool(pool)
+        raise VariantUnavailable(key) from error
+    except SOURCE_ERRORS as error:
+        raise SourceUnreadable(args[0]) from error
+    finally:
+        if owner:
+            with _pending_lock:
+                if _pending.get(key) is future:
+                    del _pending[key]
+    if owner:
+        cache.added(size)
+
+
+def get_variant(key, source_path, width, image_format):
+    """
+    Return an open file of a cached variant, rendering it in the process
+    pool on the first request.
+
+    Raises SourceUnreadable when the source can not be decoded and
+    VariantUnavailable when rendering timed out or its process died.
+    """
+    cache = get_cache()
+    path = cache.get(key)
+    if path is not None:
+        try:
+            return open(path, 'rb')
+        except FileNotFoundError:
+            pass
+
+    path = cache.path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    args = (source_path, path, width, image_format,
+            settings.IMAGE_VARIANT_QUALITY[image_format])
+    # a variant evicted by another worker before it is opened is rendered
+    # once more
+    for _ in range(2):
+        _render(cache, key, path, args)
+        try:
+            return open(path, 'rb')
+        except FileNotFoundError:
+            pass
+    raise VariantUnavailable(key)
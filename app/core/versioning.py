@@ -0,0 +1,26 @@
+import time
+
+from django.core.cache import cache
+
+
+def _key(name):
+    return f'version:{name}'
+
+
+def get_version(name):
+    """ Return the current version of a named cache namespace """
+    version = cache.get(_key(name))
+    if version is None:
+        # start from the clock so a lost counter never reuses an old value
+        cache.add(_key(name), time.time_ns(), timeout=None)
+        version = cache.get(_key(name))
+    return version
+
+
+def bump_version(name):
+    """ Invalidate everything cached under the namespace's current version """
+    try:
+        return cache.incr(_key(name))
+    except ValueError:
+        cache.add(_key(name), time.time_ns(), timeout=None)
+        return get_version(name)
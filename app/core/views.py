@@ -1,3 +1,22 @@
-# from django.shortcuts import render
+from rest_framework import permissions, views
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.response import Response
 
-# Create your views here.
+from . import batch
+from .serializers import BatchSerializer
+
+
+class BatchAPIView(views.APIView):
+    """ Run several API requests with one round trip and authentication """
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        responses = batch.run_batch(
+            request,
+            serializer.validated_data['requests'],
+            parallel=serializer.validated_data['parallel'],
+        )
+        return Response({'responses': responses})
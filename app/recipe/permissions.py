@@ -0,0 +1,19 @@
+from rest_framework import permissions, status
+from rest_framework.exceptions import APIException
+
+
+class ShardMoving(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Your data is being moved, please retry shortly.'
+    default_code = 'shard_moving'
+
+
+class IsShardWritable(permissions.BasePermission):
+    """ Reject writes while the user's data is moved between shards """
+
+    def has_permission(self, request, view):
+        if request.method in permissions.SAFE_METHODS:
+            return True
+        if getattr(request.user, 'shard_moving', False):
+            raise ShardMoving()
+        return True
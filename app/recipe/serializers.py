@@ -1,5 +1,23 @@
+from django.conf import settings
+from django.db.models.functions import Lower
 from rest_framework import serializers
+from core.bulk import BULK_FIELDS
 from core.models import Tag, Ingredient, Recipe
+from core.sharding import shard_for_user
+
+
+class UserPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """ Primary key field limited to objects of the requesting user """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        request = self.context.get('request')
+        if request is None:
+            return queryset
+
+        return queryset.using(
+            shard_for_user(request.user)
+        ).filter(user=request.user)
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -17,11 +35,11 @@ class IngredientSerializer(serializers.ModelSerializer):
 
 
 class RecipeSerializer(serializers.ModelSerializer):
-    ingredients = serializers.PrimaryKeyRelatedField(
+    ingredients = UserPrimaryKeyRelatedField(
         many=True,
         queryset=Ingredient.objects.all()
     )
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = UserPrimaryKeyRelatedField(
         many=True,
         queryset=Tag.objects.all()
     )
@@ -33,13 +51,128 @@ class RecipeSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+class RecipeListSerializer(RecipeSerializer):
+    """
+    Serializer reading recipe relations from the summary table, or
+    nesting the relations named in expand from their prefetched objects
+    """
+    ingredients = serializers.ListField(
+        source='summary.ingredient_ids',
+        child=serializers.IntegerField(),
+        read_only=True,
+    )
+    tags = serializers.ListField(
+        source='summary.tag_ids',
+        child=serializers.IntegerField(),
+        read_only=True,
+    )
+
+    def __init__(self, *args, expand=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        for name in expand:
+            self.fields[name] = EXPANDABLE_RELATIONS[name](
+                many=True, read_only=True
+            )
+
+
+# relations the recipe list can nest, with the serializer of their objects
+EXPANDABLE_RELATIONS = {
+    'tags': TagSerializer,
+    'ingredients': IngredientSerializer,
+}
+
+
+# sort orders of the recipe list, each served by an index of the recipe
+RECIPE_ORDERINGS = {
+    'price': ('price', 'id'),
+    '-price': ('-price', '-id'),
+    'time': ('time_minutes', 'id'),
+    '-time': ('-time_minutes', '-id'),
+    'title': (Lower('title'), 'id'),
+    '-title': (Lower('title').desc(), '-id'),
+}
+
+
+class RecipeFilterSerializer(serializers.Serializer):
+    """ Serializer of the range filters and ordering of the recipe list """
+    price_min = serializers.DecimalField(
+        max_digits=5, decimal_places=2, required=False
+    )
+    price_max = serializers.DecimalField(
+        max_digits=5, decimal_places=2, required=False
+    )
+    time_min = serializers.IntegerField(required=False)
+    time_max = serializers.IntegerField(required=False)
+    ordering = serializers.ChoiceField(
+        choices=sorted(RECIPE_ORDERINGS), required=False
+    )
+
+    # lookup of each range filter
+    LOOKUPS = {
+        'price_min': 'price__gte',
+        'price_max': 'price__lte',
+        'time_min': 'time_minutes__gte',
+        'time_max': 'time_minutes__lte',
+    }
+
+    def filter(self, queryset):
+        """ Apply the validated filters and ordering to a queryset """
+        data = self.validated_data
+        queryset = queryset.filter(**{
+            lookup: data[name] for name, lookup in self.LOOKUPS.items()
+            if name in data
+        })
+        if 'ordering' in data:
+            return queryset.order_by(*RECIPE_ORDERINGS[data['ordering']])
+        return queryset.order_by('-id')
+
+
+class ShoppingListSerializer(serializers.Serializer):
+    """ Serializer of the recipes to build a shopping list for """
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.SHOPPING_LIST_MAX_RECIPES,
+    )
+
+    def validate_ids(self, value):
+        return sorted(set(value))
+
+
+class RecipeBulkSerializer(serializers.ModelSerializer):
+    """ Serializer of a bulk update or delete of recipes """
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        required=False,
+        allow_empty=False,
+        max_length=10000,
+    )
+
+    class Meta:
+        model = Recipe
+        fields = ('ids',) + BULK_FIELDS
+
+
 class RecipeDetailSerializer(RecipeSerializer):
     ingredients = IngredientSerializer(many=True, read_only=True)
     tags = TagSerializer(many=True, read_only=True)
 
 
+class StreamedImageField(serializers.ImageField):
+    """
+    Image field trusting files already validated from their header by
+    StreamingImageUploadHandler instead of decoding them again
+    """
+
+    def to_internal_value(self, data):
+        if getattr(data, 'image_format', None):
+            return serializers.FileField.to_internal_value(self, data)
+        return super().to_internal_value(data)
+
+
 class RecipeImageSerializer(serializers.ModelSerializer):
     """ Serializer for uploading images to recipe """
+    image = StreamedImageField()
 
     class Meta:
         model = Recipe
@@ -0,0 +1,175 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Ingredient, Recipe, Tag
+
+TAGS_AUTOCOMPLETE_URL = reverse('recipe:tags-autocomplete')
+INGREDIENTS_AUTOCOMPLETE_URL = reverse('recipe:ingredients-autocomplete')
+
+
+def sample_recipe(user, **params):
+    defaults = {'title': 'test', 'time_minutes': 10, 'price': 5.00}
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class PublicAutocompleteAPITest(TestCase):
+
+    def test_auth_required(self):
+        """ Test authentication is required to autocomplete """
+        response = APIClient().get(TAGS_AUTOCOMPLETE_URL, {'prefix': 'a'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateAutocompleteAPITest(TestCase):
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user(
+            email='test@gmail.com',
+            password='test_password',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def names(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [match['name'] for match in response.data]
+
+    def test_case_and_accent_insensitive(self):
+        """ Test names match regardless of case and accents """
+        for name in ('Crème fraîche', 'crepe', 'Ćrab', 'Carrot'):
+            Ingredient.objects.create(user=self.user, name=name)
+
+        self.assertEqual(
+            sorted(self.names(INGREDIENTS_AUTOCOMPLETE_URL, prefix='CRE')),
+            ['Crème fraîche', 'crepe'],
+        )
+        self.assertEqual(
+            self.names(INGREDIENTS_AUTOCOMPLETE_URL, prefix='crèm'),
+            ['Crème fraîche'],
+        )
+        self.assertEqual(
+            self.names(INGREDIENTS_AUTOCOMPLETE_URL, prefix='cra'), ['Ćrab']
+        )
+
+    def test_pattern_characters_match_literally(self):
+        """ Test % and _ in the prefix are not wildcards """
+        Tag.objects.create(user=self.user, name='100% vegan')
+        Tag.objects.create(user=self.user, name='100 vegan')
+
+        self.assertEqual(
+            self.names(TAGS_AUTOCOMPLETE_URL, prefix='100%'), ['100% vegan']
+        )
+        self.assertEqual(self.names(TAGS_AUTOCOMPLETE_URL, prefix='10_'), [])
+
+    def test_ranked_by_usage(self):
+        """ Test the names used by most recipes come first """
+        rarely = Tag.objects.create(user=self.user, name='salty')
+        often = Tag.objects.create(user=self.user, name='sweet')
+        Tag.objects.create(user=self.user, name='sour')
+        for number in range(3):
+            recipe = sample_recipe(user=self.user)
+            recipe.tags.add(often)
+            if number == 0:
+                recipe.tags.add(rarely)
+
+        response = self.client.get(TAGS_AUTOCOMPLETE_URL, {'prefix': 's'})
+
+        self.assertEqual(
+            [(match['name'], match['uses']) for match in response.data],
+            [('sweet', 3), ('salty', 1), ('sour', 0)],
+        )
+
+    def test_limited_to_user(self):
+        """ Test only the user's names are suggested """
+        other = get_user_model().objects.create_user(
+            email='other@gmail.com',
+            password='test_password',
+        )
+        Tag.objects.create(user=other, name='spicy')
+        Tag.objects.create(user=self.user, name='spring')
+
+        self.assertEqual(
+            self.names(TAGS_AUTOCOMPLETE_URL, prefix='sp'), ['spring']
+        )
+
+    def test_limit(self):
+        """ Test the number of suggestions is limited """
+        for number in range(15):
+            Ingredient.objects.create(user=self.user, name=f'salt {number}')
+
+        self.assertEqual(
+            len(self.names(INGREDIENTS_AUTOCOMPLETE_URL, prefix='salt')), 10
+        )
+        self.assertEqual(
+            len(self.names(INGREDIENTS_AUTOCOMPLETE_URL, prefix='salt',
+                           limit=3)),
+            3,
+        )
+
+    def test_invalid_parameters(self):
+        """ Test a prefix and a limit in range are required """
+        for params in ({}, {'prefix': ''}, {'prefix': 'a', 'limit': 0},
+                       {'prefix': 'a', 'limit': 1000},
+                       {'prefix': 'a', 'limit': 'ten'}):
+            with self.subTest(params=params):
+                response = self.client.get(TAGS_AUTOCOMPLETE_URL, params)
+                self.assertEqual(
+                    response.status_code, status.HTTP_400_BAD_REQUEST
+                )
+
+    def test_short_prefix_counts_nothing_per_candidate(self):
+        """ Test a prefix matching many names ranks them with one join """
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(user=self.user, name=f's{number:03}')
+            for number in range(500)
+        )
+        recipe = sample_recipe(user=self.user)
+        recipe.ingredients.add(ingredients[250], ingredients[499])
+        sample_recipe(user=self.user).ingredients.add(ingredients[499])
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                INGREDIENTS_AUTOCOMPLETE_URL, {'prefix': 's', 'limit': 3}
+            )
+
+        self.assertEqual(
+            [(match['name'], match['uses']) for match in response.data],
+            [('s499', 2), ('s250', 1), ('s000', 0)],
+        )
+        sql = next(
+            query['sql'] for query in context.captured_queries
+            if 'core_unaccent' in query['sql']
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN {sql}')
+            plan = '\n'.join(row for row, in cursor.fetchall())
+        self.assertNotIn('SubPlan', plan)
+        self.assertNotIn('recipe_ingredients', plan)
+
+    def test_uses_prefix_index(self):
+        """ Test names are looked up as a range of the prefix index """
+        Ingredient.objects.bulk_create(
+            Ingredient(user=self.user, name=f'{letter}{number}')
+            for letter in 'abcdefghijklmnopqrstuvwxyz' for number in range(40)
+        )
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(INGREDIENTS_AUTOCOMPLETE_URL, {'prefix': 'sa'})
+        sql = next(
+            query['sql'] for query in context.captured_queries
+            if 'core_unaccent' in query['sql']
+        )
+
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN {sql}')
+            plan = '\n'.join(row for row, in cursor.fetchall())
+
+        self.assertIn('ingredient_name_prefix_idx', plan)
+        self.assertNotIn('~~', plan)
@@ -0,0 +1,128 @@
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import cookable, stats
+from core.models import (
+    Tag,
+    Ingredient,
+    Recipe,
+    RecipeStats,
+    RecipeSummary,
+)
+
+BULK_URL = reverse('recipe:recipes-bulk')
+STATS_URL = reverse('recipe:stats')
+
+
+def sample_recipe(user, **params):
+    defaults = {'title': 'test', 'time_minutes': 10, 'price': 5.00}
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class RecipeBulkAPITest(TestCase):
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user(
+            email='test@gmail.com',
+            password='test_password',
+        )
+        self.other = get_user_model().objects.create_user(
+            email='other@gmail.com',
+            password='test_password',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.client.get(STATS_URL)
+
+        self.seasonal = Tag.objects.create(user=self.user, name='seasonal')
+        self.salt = Ingredient.objects.create(user=self.user, name='salt')
+        self.recipes = [sample_recipe(user=self.user, price=p)
+                        for p in (1, 2, 3)]
+        for recipe in self.recipes[:2]:
+            recipe.tags.add(self.seasonal)
+            recipe.ingredients.add(self.salt)
+        self.foreign = sample_recipe(user=self.other, title='foreign')
+
+    def assertStatsConsistent(self):
+        incremental = RecipeStats.objects.get(user=self.user)
+        rebuilt = stats.rebuild_stats(self.user)
+        for field in ('recipe_count', 'price_total', 'time_total',
+                      'price_counts', 'time_counts', 'tag_counts',
+                      'ingredient_counts'):
+            self.assertEqual(
+                getattr(incremental, field), getattr(rebuilt, field), field
+            )
+
+    def test_bulk_update_by_tag_filter(self):
+        """ Test patching every recipe with a tag """
+        response = self.client.patch(
+            f'{BULK_URL}?tags={self.seasonal.id}',
+            {'price': '9.99', 'time_minutes': 45},
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'updated': 2})
+        prices = dict(Recipe.objects.values_list('id', 'price'))
+        self.assertEqual(prices[self.recipes[0].id], Decimal('9.99'))
+        self.assertEqual(prices[self.recipes[1].id], Decimal('9.99'))
+        self.assertEqual(prices[self.recipes[2].id], Decimal('3.00'))
+        self.assertStatsConsistent()
+
+    def test_bulk_update_scoped_to_user(self):
+        """ Test ids of other users' recipes are ignored """
+        ids = [self.recipes[2].id, self.foreign.id]
+
+        with self.assertNumQueries(3):
+            response = self.client.patch(
+                BULK_URL, {'ids': ids, 'title': 'renamed'}, format='json'
+            )
+
+        self.assertEqual(response.data, {'updated': 1})
+        self.foreign.refresh_from_db()
+        self.assertEqual(self.foreign.title, 'foreign')
+
+    def test_bulk_update_requires_selection(self):
+        """ Test a bulk request must select recipes """
+        response = self.client.patch(BULK_URL, {'price': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.patch(
+            BULK_URL, {'ids': [self.recipes[0].id]}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_delete(self):
+        """ Test deleting recipes with set-based statements """
+        index = cookable.get_index(self.user.pk)
+        ids = [recipe.id for recipe in self.recipes[:2]] + [self.foreign.id]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(
+                BULK_URL, {'ids': ids}, format='json'
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'deleted': 2})
+        self.assertEqual(
+            set(Recipe.objects.values_list('id', flat=True)),
+            {self.recipes[2].id, self.foreign.id},
+        )
+        self.assertFalse(RecipeSummary.objects.filter(
+            recipe_id__in=ids[:2]
+        ).exists())
+        self.assertFalse(Recipe.tags.through.objects.exists())
+        self.assertStatsConsistent()
+        # the cached index was changed, not rebuilt
+        with patch('core.cookable.build_index') as build_index:
+            updated = cookable.get_index(self.user.pk)
+        build_index.assert_not_called()
+        self.assertIsNot(updated, index)
+        self.assertEqual(updated.search({self.salt.id}), [])
@@ -0,0 +1,152 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import cookable
+from core.models import Ingredient, Recipe
+
+COOKABLE_URL = reverse('recipe:recipes-cookable')
+
+
+def sample_recipe(user, **params):
+    defaults = {'title': 'test', 'time_minutes': 10, 'price': 5.00}
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class CookableIndexTests(TestCase):
+
+    def setUp(self) -> None:
+        self.index = cookable.CookableIndex([
+            (1, [1, 2]),
+            (2, [1, 2, 3]),
+            (3, [1, 2, 3, 4]),
+            (4, [1, 2, 3, 4, 5]),
+            (5, [6]),
+            (6, []),
+        ])
+
+    def test_search_by_missing_count(self):
+        """ Test recipes are found with up to two missing ingredients """
+        self.assertEqual(self.index.search([1, 2]), [
+            (1, 0, 1.0),
+            (2, 1, 0.6667),
+            (3, 2, 0.5),
+        ])
+        self.assertEqual(self.index.search([1, 2], max_missing=0), [
+            (1, 0, 1.0),
+        ])
+
+    def test_search_ranked_by_coverage(self):
+        """ Test larger recipes missing one ingredient rank higher """
+        self.assertEqual(self.index.search([1, 2, 3, 4]), [
+            (3, 0, 1.0),
+            (2, 0, 1.0),
+            (1, 0, 1.0),
+            (4, 1, 0.8),
+        ])
+
+    def test_incremental_changes(self):
+        """ Test adding, removing and discarding recipes """
+        self.index.add(6, [1])
+        self.index.remove(2, [3])
+        self.index.discard_recipe(1)
+
+        self.assertEqual(self.index.search([1, 2], max_missing=0), [
+            (6, 0, 1.0),
+            (2, 0, 1.0),
+        ])
+
+    def test_apply_change_copies(self):
+        """ Test a published index is replaced rather than changed """
+        cookable._indexes.set(7, self.index)
+        self.addCleanup(cookable._indexes.pop, 7)
+        self.index.version = cookable.get_version('cookable:7')
+
+        cookable.apply_change(7, lambda index: index.add(6, [1]))
+
+        self.assertEqual(self.index.search([1], max_missing=0), [])
+        changed = cookable._indexes.get(7)
+        self.assertIsNot(changed, self.index)
+        self.assertEqual(changed.search([1], max_missing=0), [(6, 0, 1.0)])
+        self.assertEqual(changed.version, cookable.get_version('cookable:7'))
+
+
+class PrivateCookableAPITest(TestCase):
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user(
+            email='test@gmail.com',
+            password='test_password',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.salt = Ingredient.objects.create(user=self.user, name='salt')
+        self.egg = Ingredient.objects.create(user=self.user, name='egg')
+        self.milk = Ingredient.objects.create(user=self.user, name='milk')
+
+    def test_cookable_recipes(self):
+        """ Test covered and nearly covered recipes are returned """
+        omelette = sample_recipe(user=self.user, title='omelette')
+        omelette.ingredients.add(self.salt, self.egg)
+        pancake = sample_recipe(user=self.user, title='pancake')
+        pancake.ingredients.add(self.egg, self.milk)
+
+        response = self.client.get(
+            COOKABLE_URL, {'ingredients': f'{self.salt.id},{self.egg.id}'}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(r['id'], r['missing'], r['coverage']) for r in response.data],
+            [(omelette.id, [], 1.0), (pancake.id, [self.milk.id], 0.5)]
+        )
+
+    def test_cookable_follows_changes(self):
+        """ Test ingredient changes update the in-memory index """
+        recipe = sample_recipe(user=self.user)
+        recipe.ingredients.add(self.egg)
+        params = {'ingredients': f'{self.egg.id}', 'missing': 0}
+        self.assertEqual(len(self.client.get(COOKABLE_URL, params).data), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.ingredients.add(self.milk)
+        self.assertEqual(self.client.get(COOKABLE_URL, params).data, [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        params['missing'] = 1
+        self.assertEqual(self.client.get(COOKABLE_URL, params).data, [])
+
+    def test_cookable_limited_to_user(self):
+        """ Test recipes of other users are not returned """
+        user2 = get_user_model().objects.create_user(
+            email='test2@gmail.com',
+            password='test_password',
+        )
+        recipe = sample_recipe(user=user2)
+        recipe.ingredients.add(self.salt)
+
+        response = self.client.get(
+            COOKABLE_URL, {'ingredients': f'{self.salt.id}'}
+        )
+
+        self.assertEqual(response.data, [])
+
+    def test_ingredients_required(self):
+        """ Test the ingredients on hand must be given """
+        response = self.client.get(COOKABLE_URL)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_parameters(self):
+        """ Test non-numeric ingredients, missing and limit are rejected """
+        for params in ({'ingredients': 'salt'},
+                       {'ingredients': f'{self.salt.id}', 'missing': 'one'},
+                       {'ingredients': f'{self.salt.id}', 'limit': 'all'}):
+            with self.subTest(params=params):
+                response = self.client.get(COOKABLE_URL, params)
+                self.assertEqual(
+                    response.status_code, status.HTTP_400_BAD_REQUEST
+                )
@@ -0,0 +1,196 @@
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import Future
+from io import BytesIO
+from unittest import mock
+
+from PIL import Image
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import variants
+from core.models import Recipe
+
+
+def image_url(recipe_id):
+    return reverse('recipe:recipes-image', args=[recipe_id])
+
+
+def sample_image(size=(1200, 800), image_format='JPEG'):
+    buffer = BytesIO()
+    Image.new('RGB', size, (200, 100, 50)).save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def decode(response):
+    return Image.open(BytesIO(b''.join(response.streaming_content)))
+
+
+class RecipeImageVariantTests(TestCase):
+
+    def setUp(self) -> None:
+        self.media_root = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            IMAGE_VARIANT_CACHE_DIR=self.cache_dir,
+            IMAGE_VARIANT_WORKERS=0,
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = get_user_model().objects.create_user(
+            email='test@gmail.com',
+            password='test_password',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user, title='test', time_minutes=10, price=5.00
+        )
+        self.recipe.image.save('photo.jpg', ContentFile(sample_image()))
+
+    def cached_files(self):
+        return [
+            name for _, _, names in os.walk(self.cache_dir)
+            for name in names if not name.startswith('.')
+        ]
+
+    def test_webp_negotiated(self):
+        """ Test WebP is returned to clients accepting it """
+        response = self.client.get(
+            image_url(self.recipe.id), {'width': 300},
+            HTTP_ACCEPT='image/webp,image/*;q=0.8',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(response['Vary'], 'Accept, Authorization')
+        image = decode(response)
+        self.assertEqual(image.format, 'WEBP')
+        self.assertEqual(image.width, 320)
+
+    def test_fallback_to_source_format(self):
+        """ Test clients without modern formats get a resized JPEG """
+        response = self.client.get(
+            image_url(self.recipe.id), {'width': 100},
+            HTTP_ACCEPT='image/webp;q=0, */*',
+        )
+
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        image = decode(response)
+        self.assertEqual((image.width, image.height), (160, 107))
+
+    def test_variant_cached_and_revalidated(self):
+        """ Test variants are rendered once and revalidated by ETag """
+        url = image_url(self.recipe.id)
+        first = self.client.get(url, {'width': 640}, HTTP_ACCEPT='image/webp')
+        b''.join(first.streaming_content)
+        second = self.client.get(url, {'width': 600}, HTTP_ACCEPT='image/webp')
+        b''.join(second.streaming_content)
+        not_modified = self.client.get(
+            url, {'width': 640}, HTTP_ACCEPT='image/webp',
+            HTTP_IF_NONE_MATCH=first['ETag'],
+        )
+
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertEqual(len(self.cached_files()), 1)
+        self.assertEqual(
+            not_modified.status_code, status.HTTP_304_NOT_MODIFIED
+        )
+
+    def test_invalid_width(self):
+        """ Test a non-positive width is rejected """
+        response = self.client.get(
+            image_url(self.recipe.id), {'width': 'wide'},
+            HTTP_ACCEPT='image/webp',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_recipe_without_image(self):
+        """ Test a recipe without an image returns 404 """
+        recipe = Recipe.objects.create(
+            user=self.user, title='plain', time_minutes=5, price=1.00
+        )
+
+        response = self.client.get(image_url(recipe.id))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(IMAGE_VARIANT_WORKERS=1)
+    def test_render_in_process_pool(self):
+        """ Test variants can be rendered by pool processes """
+        response = self.client.get(
+            image_url(self.recipe.id), {'width': 160},
+            HTTP_ACCEPT='image/png',
+        )
+
+        self.assertEqual(decode(response).width, 160)
+
+    def test_cache_evicts_least_recently_used(self):
+        """ Test the disk cache is kept under its size """
+        cache = variants.VariantCache(self.cache_dir, max_size=250)
+        for index, key in enumerate(['aa-1', 'bb-1', 'cc-1']):
+            path = cache.path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(b'x' * 100)
+            os.utime(path, (time.time() - 100 + index,) * 2)
+        cache.get('aa-1')
+
+        cache.evict()
+
+        self.assertIsNotNone(cache.get('aa-1'))
+        self.assertIsNone(cache.get('bb-1'))
+        self.assertIsNotNone(cache.get('cc-1'))
+
+    def test_corrupt_source(self):
+        """ Test a source that can not be decoded returns 404 """
+        with open(self.recipe.image.path, 'wb') as file:
+            file.write(b'not an image')
+
+        response = self.client.get(image_url(self.recipe.id))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(IMAGE_VARIANT_WORKERS=1, IMAGE_VARIANT_TIMEOUT=0.01)
+    def test_render_timeout(self):
+        """ Test a render taking too long returns 503 """
+        pool = mock.Mock()
+        pool.submit.return_value = Future()
+
+        with mock.patch.object(variants, '_get_pool', return_value=pool):
+            response = self.client.get(image_url(self.recipe.id))
+
+        self.assertEqual(
+            response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(variants._pending, {})
+
+    def test_evicted_variant_rendered_again(self):
+        """ Test a variant removed before it is opened is rendered again """
+        render = variants.render_variant
+        calls = []
+
+        def render_then_evict(source, target, *args):
+            size = render(source, target, *args)
+            if not calls:
+                os.remove(target)
+            calls.append(target)
+            return size
+
+        with mock.patch.object(variants, 'render_variant', render_then_evict):
+            response = self.client.get(image_url(self.recipe.id))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(calls), 2)
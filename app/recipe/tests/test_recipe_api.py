@@ -1,14 +1,18 @@
+import hashlib
 import tempfile
 import os
 
 from PIL import Image
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from rest_framework import status
 from rest_framework.test import APIClient
 from core.models import Recipe, Tag, Ingredient
 from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
+from recipe.uploadhandlers import StreamingImageUploadHandler
 
 RECIPE_URL = reverse('recipe:recipes-list')
 
@@ -189,6 +193,131 @@ class PrivateRecipeAPITest(TestCase):
         self.assertEqual(recipe.price, payload.get('price'))
         self.assertEqual(len(tags), 0)
 
+    def test_create_recipe_with_foreign_tag(self):
+        """ Test tags of another user cannot be assigned """
+        user2 = get_user_model().objects.create_user(
+            email='test2@gmail.com',
+            password='test_password'
+        )
+        tag = sample_tag(user=user2)
+        payload = {
+            'title': 'test',
+            'tags': [tag.id],
+            'time_minutes': 5,
+            'price': 5.00,
+        }
+        response = self.client.post(RECIPE_URL, payload)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_writes_rejected_while_shard_moving(self):
+        """ Test writes are refused while the user's data is moved """
+        recipe = sample_recipe(user=self.user)
+        self.user.shard_moving = True
+        self.user.save()
+
+        response = self.client.patch(
+            detail_recipe_url(recipe.id), {'title': 'new'}
+        )
+        read_response = self.client.get(detail_recipe_url(recipe.id))
+
+        self.assertEqual(
+            response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+        self.assertEqual(read_response.status_code, status.HTTP_200_OK)
+
+    def test_list_expand_relations(self):
+        """ Test ?expand= nests tags and ingredients in the list """
+        recipe = sample_recipe(user=self.user)
+        recipe.tags.add(sample_tag(user=self.user))
+        recipe.ingredients.add(sample_ingredient(user=self.user))
+
+        response = self.client.get(RECIPE_URL, {'expand': 'tags,ingredients'})
+        serializer = RecipeDetailSerializer(recipe)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [serializer.data])
+
+    def test_list_expand_fixed_queries(self):
+        """ Test expanded lists run one query per relation """
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(RECIPE_URL, {'expand': 'tags'})
+            return len(queries)
+
+        tag = sample_tag(user=self.user)
+        sample_recipe(user=self.user).tags.add(tag)
+        one_recipe = count_queries()
+        for _ in range(5):
+            sample_recipe(user=self.user).tags.add(tag)
+
+        self.assertEqual(count_queries(), one_recipe)
+
+    def test_list_expand_unknown_relation(self):
+        """ Test expanding an unknown relation is rejected """
+        response = self.client.get(RECIPE_URL, {'expand': 'user'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_filter_recipes_by_price_and_time(self):
+        """ Test filtering recipes by price and preparation time ranges """
+        cheap = sample_recipe(user=self.user, price=2.00, time_minutes=5)
+        medium = sample_recipe(user=self.user, price=5.00, time_minutes=30)
+        sample_recipe(user=self.user, price=9.00, time_minutes=60)
+
+        response = self.client.get(
+            RECIPE_URL, {'price_min': '2.00', 'price_max': '5.00'}
+        )
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data], [medium.id, cheap.id]
+        )
+
+        response = self.client.get(
+            RECIPE_URL, {'price_max': '5.00', 'time_min': 10}
+        )
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data], [medium.id]
+        )
+
+    def test_order_recipes(self):
+        """ Test sorting recipes by price, time and title """
+        first = sample_recipe(user=self.user, title='banana', price=5.00,
+                              time_minutes=10)
+        second = sample_recipe(user=self.user, title='Apple', price=5.00,
+                               time_minutes=5)
+        third = sample_recipe(user=self.user, title='cherry', price=1.00,
+                              time_minutes=20)
+
+        expected = {
+            'price': [third, first, second],
+            '-price': [second, first, third],
+            'time': [second, first, third],
+            '-time': [third, first, second],
+            'title': [second, first, third],
+            '-title': [third, first, second],
+        }
+        for ordering, recipes in expected.items():
+            with self.subTest(ordering=ordering):
+                response = self.client.get(RECIPE_URL, {'ordering': ordering})
+                self.assertEqual(
+                    [recipe['id'] for recipe in response.data],
+                    [recipe.id for recipe in recipes],
+                )
+
+    def test_invalid_range_filter_or_ordering(self):
+        """ Test malformed filters and unknown orderings are rejected """
+        for params in (
+            {'price_min': 'cheap'},
+            {'time_max': 'long'},
+            {'ordering': 'link'},
+        ):
+            with self.subTest(params=params):
+                response = self.client.get(RECIPE_URL, params)
+                self.assertEqual(
+                    response.status_code, status.HTTP_400_BAD_REQUEST
+                )
+                self.assertIn(next(iter(params)), response.data)
+
 
 class RecipeImageUploadTests(TestCase):
 
@@ -226,6 +355,70 @@ class RecipeImageUploadTests(TestCase):
 
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_upload_non_image_file(self):
+        """ Test files without an image header are rejected """
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            ntf.write(b'not an image' * 100)
+            ntf.seek(0)
+            response = self.client.post(
+                url, {'image': ntf}, format='multipart'
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('image', response.data)
+
+    @override_settings(RECIPE_IMAGE_MAX_DIMENSION=10)
+    def test_upload_image_too_wide(self):
+        """ Test images are rejected from the dimensions in their header """
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.png') as ntf:
+            Image.new('RGB', (20, 5)).save(ntf, format='PNG')
+            ntf.seek(0)
+            response = self.client.post(
+                url, {'image': ntf}, format='multipart'
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(RECIPE_IMAGE_MAX_UPLOAD_SIZE=1024)
+    def test_upload_image_too_large(self):
+        """ Test uploads over the size limit are refused """
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.png') as ntf:
+            ntf.write(b'\0' * 200 * 1024)
+            ntf.seek(0)
+            response = self.client.post(
+                url, {'image': ntf}, format='multipart'
+            )
+
+        self.assertEqual(
+            response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+
+    def test_upload_computes_content_hash(self):
+        """ Test the streamed upload carries its hash and dimensions """
+        with tempfile.NamedTemporaryFile(suffix='.png') as ntf:
+            Image.new('RGB', (300, 200)).save(ntf, format='PNG')
+            ntf.seek(0)
+            content = ntf.read()
+
+        handler = StreamingImageUploadHandler()
+        handler.new_file('image', 'test.png', 'image/png', len(content))
+        for start in range(0, len(content), 100):
+            handler.receive_data_chunk(content[start:start + 100], start)
+        uploaded = handler.file_complete(len(content))
+
+        self.assertEqual(
+            uploaded.content_hash, hashlib.sha256(content).hexdigest()
+        )
+        self.assertEqual(
+            (uploaded.image_format, uploaded.image_width,
+             uploaded.image_height),
+            ('PNG', 300, 200)
+        )
+        uploaded.close()
+
     def test_filter_recipes_by_tags(self):
         """ Test filtering recipes by tags """
         recipe1 = sample_recipe(user=self.user, title='recipe1')
@@ -274,3 +467,20 @@ class RecipeImageUploadTests(TestCase):
         self.assertIn(serializer2.data, response.data)
         self.assertNotIn(serializer3.data, response.data)
 
+    def test_filter_recipes_matching_several_tags_once(self):
+        """ Test a recipe matching several filter tags is listed once """
+        recipe = sample_recipe(user=self.user)
+        tag1 = sample_tag(user=self.user, name='tag1')
+        tag2 = sample_tag(user=self.user, name='tag2')
+        recipe.tags.add(tag1, tag2)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                RECIPE_URL,
+                {'tags': f'{tag1.id},{tag2.id}'}
+            )
+
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(
+            sorted(response.data[0]['tags']), sorted([tag1.id, tag2.id])
+        )
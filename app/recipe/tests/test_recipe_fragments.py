@@ -0,0 +1,158 @@
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.test import APIClient
+
+from core import bulk, fragments
+from core.models import Recipe, Tag
+from recipe.views import RecipeAPIViewSet
+
+RECIPE_URL = reverse('recipe:recipes-list')
+
+
+def detail_recipe_url(recipe_id):
+    return reverse('recipe:recipes-detail', args=[recipe_id])
+
+
+def sample_recipe(user, **params):
+    defaults = {'title': 'test', 'time_minutes': 10, 'price': 5.00}
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class RecipeFragmentCacheTest(TestCase):
+    """ Test recipe responses assembled from cached fragments """
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            email='test@gmail.com',
+            password='test_password',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.recipe = sample_recipe(user=self.user, title='soup')
+        self.tag = Tag.objects.create(user=self.user, name='vegan')
+        self.recipe.tags.add(self.tag)
+        sample_recipe(user=self.user, title='salad')
+
+    def test_unchanged_recipes_served_from_cache(self):
+        """ Test a repeated list serializes nothing """
+        first = self.client.get(RECIPE_URL).data
+        self.assertEqual(fragments.stats()['misses'], 2)
+
+        second = self.client.get(RECIPE_URL).data
+
+        self.assertEqual(second, first)
+        self.assertEqual(fragments.stats(), {
+            'hits': 2, 'misses': 2, 'hit_rate': 0.5,
+        })
+
+    def test_only_changed_recipes_serialized(self):
+        """ Test saving a recipe replaces only its fragment """
+        self.client.get(RECIPE_URL)
+        self.client.patch(detail_recipe_url(self.recipe.id), {'title': 'new'})
+
+        response = self.client.get(RECIPE_URL)
+
+        titles = {recipe['id']: recipe['title'] for recipe in response.data}
+        self.assertEqual(titles[self.recipe.id], 'new')
+        self.assertEqual(fragments.stats()['misses'], 3)
+
+    def test_relation_changes_replace_fragment(self):
+        """ Test adding and removing tags replaces the fragment """
+        self.client.get(RECIPE_URL)
+        other = Tag.objects.create(user=self.user, name='quick')
+        self.recipe.tags.add(other)
+
+        response = self.client.get(RECIPE_URL)
+        tags = {recipe['id']: recipe['tags'] for recipe in response.data}
+        self.assertEqual(tags[self.recipe.id], [self.tag.id, other.id])
+
+        self.recipe.tags.remove(self.tag)
+        response = self.client.get(detail_recipe_url(self.recipe.id))
+        self.assertEqual(response.data['tags'], [
+            {'id': other.id, 'name': 'quick'},
+        ])
+
+    def test_rename_replaces_fragments(self):
+        """ Test renaming a tag replaces the fragments showing its name """
+        self.client.get(detail_recipe_url(self.recipe.id))
+        self.client.get(RECIPE_URL, {'expand': 'tags'})
+        self.tag.name = 'vegetarian'
+        self.tag.save()
+
+        detail = self.client.get(detail_recipe_url(self.recipe.id)).data
+        listed = self.client.get(RECIPE_URL, {'expand': 'tags'}).data
+
+        self.assertEqual(detail['tags'][0]['name'], 'vegetarian')
+        tags = {recipe['id']: recipe['tags'] for recipe in listed}
+        self.assertEqual(tags[self.recipe.id][0]['name'], 'vegetarian')
+
+    def test_bulk_update_replaces_fragments(self):
+        """ Test recipes updated in bulk are serialized again """
+        self.client.get(RECIPE_URL)
+        bulk.update_recipes(
+            Recipe.objects.filter(user=self.user), self.user.pk,
+            {'title': 'renamed'},
+        )
+
+        response = self.client.get(RECIPE_URL)
+
+        self.assertEqual(
+            {recipe['title'] for recipe in response.data}, {'renamed'}
+        )
+
+    def test_variants_cached_apart(self):
+        """ Test expanded, plain and detail representations do not mix """
+        plain = self.client.get(RECIPE_URL).data
+        expanded = self.client.get(RECIPE_URL, {'expand': 'tags'}).data
+        detail = self.client.get(detail_recipe_url(self.recipe.id)).data
+
+        self.assertTrue(all(
+            isinstance(pk, int) for recipe in plain for pk in recipe['tags']
+        ))
+        self.assertTrue(all(
+            isinstance(tag, dict)
+            for recipe in expanded for tag in recipe['tags']
+        ))
+        self.assertIn('name', detail['tags'][0])
+        self.assertEqual(fragments.stats()['hits'], 0)
+
+    def test_paginated_list(self):
+        """ Test a view with a paginator renders the page from fragments """
+        plain = self.client.get(RECIPE_URL).data
+
+        with mock.patch.object(
+            RecipeAPIViewSet, 'pagination_class', LimitOffsetPagination
+        ):
+            response = self.client.get(RECIPE_URL, {'limit': 1, 'offset': 1})
+
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(response.data['results'], plain[1:])
+        self.assertEqual(fragments.stats()['hits'], 1)
+
+    @override_settings(FRAGMENT_CACHE_ENABLED=False)
+    def test_disabled(self):
+        """ Test the fragment cache can be turned off """
+        self.client.get(RECIPE_URL)
+        self.client.get(RECIPE_URL)
+
+        self.assertEqual(fragments.stats()['hits'], 0)
+
+    def test_stats_command(self):
+        """ Test the fragment_stats command reports and resets the counts """
+        self.client.get(RECIPE_URL)
+        self.client.get(RECIPE_URL)
+        out = StringIO()
+
+        call_command('fragment_stats', '--reset', stdout=out)
+
+        self.assertIn('hits 2, misses 2, hit rate 50.0%', out.getvalue())
+        self.assertEqual(fragments.stats()['hits'], 0)
@@ -0,0 +1,112 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe
+
+RECIPE_URL = reverse('recipe:recipes-list')
+
+# ordering: index serving it
+ORDERING_INDEXES = {
+    'price': 'recipe_price_idx',
+    '-price': 'recipe_price_idx',
+    'time': 'recipe_time_idx',
+    '-time': 'recipe_time_idx',
+    'title': 'recipe_title_idx',
+    '-title': 'recipe_title_idx',
+}
+
+RANGE_FILTERS = [
+    {},
+    {'price_min': '2.00', 'price_max': '8.00'},
+    {'time_min': '5', 'time_max': '50'},
+    {'price_min': '2.00', 'time_max': '50'},
+]
+
+
+def plan_nodes(plan):
+    """ Yield the nodes of a JSON query plan """
+    yield plan
+    for child in plan.get('Plans', ()):
+        yield from plan_nodes(child)
+
+
+class RecipeQueryPlanTest(TestCase):
+    """
+    Test the filtered and sorted recipe list is read in index order.
+
+    The tables of a test are tiny, so sequential scans and sorts are
+    disabled to find whether an index delivers the rows already sorted.
+    """
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user(
+            email='test@gmail.com',
+            password='test_password',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        for number in range(10):
+            Recipe.objects.create(
+                user=self.user, title=f'recipe {number}',
+                time_minutes=number * 10, price=number,
+            )
+
+    def list_query(self, params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(RECIPE_URL, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        queries = [
+            query['sql'] for query in context.captured_queries
+            if 'FROM "core_recipe"' in query['sql']
+        ]
+        self.assertEqual(len(queries), 1)
+        return queries[0]
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('SET LOCAL enable_sort = off')
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return list(plan_nodes(plan[0]['Plan']))
+
+    def assertIndexOrdered(self, nodes, index, backward):
+        self.assertNotIn('Sort', [node['Node Type'] for node in nodes])
+        scans = [
+            node for node in nodes
+            if node.get('Relation Name') == 'core_recipe'
+        ]
+        self.assertEqual(len(scans), 1)
+        self.assertEqual(scans[0].get('Index Name'), index)
+        self.assertEqual(
+            scans[0].get('Scan Direction'),
+            'Backward' if backward else 'Forward',
+        )
+
+    def test_orderings_use_their_index(self):
+        """ Test every ordering and range filter is an index range scan """
+        for ordering, index in ORDERING_INDEXES.items():
+            for filters in RANGE_FILTERS:
+                with self.subTest(ordering=ordering, filters=filters):
+                    nodes = self.explain(
+                        self.list_query({'ordering': ordering, **filters})
+                    )
+                    self.assertIndexOrdered(
+                        nodes, index, ordering.startswith('-')
+                    )
+
+    def test_default_ordering_uses_primary_key(self):
+        """ Test the newest-first default needs no sort """
+        for filters in RANGE_FILTERS:
+            with self.subTest(filters=filters):
+                nodes = self.explain(self.list_query(filters))
+                self.assertIndexOrdered(nodes, 'core_recipe_pkey', True)
@@ -0,0 +1,165 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Ingredient, Recipe
+
+SHOPPING_LIST_URL = reverse('recipe:recipes-shopping-list')
+
+
+def sample_recipe(user, **params):
+    defaults = {'title': 'test', 'time_minutes': 10, 'price': 5.00}
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+def ids_body(recipes):
+    return {'ids': [recipe.id for recipe in recipes]}
+
+
+class PublicShoppingListAPITest(TestCase):
+
+    def test_auth_required(self):
+        """ Test authentication is required for the shopping list """
+        response = APIClient().post(
+            SHOPPING_LIST_URL, {'ids': [1]}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateShoppingListAPITest(TestCase):
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user(
+            email='test@gmail.com',
+            password='test_password',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.salt = Ingredient.objects.create(user=self.user, name='salt')
+        self.egg = Ingredient.objects.create(user=self.user, name='egg')
+        self.flour = Ingredient.objects.create(user=self.user, name='flour')
+        self.omelette = sample_recipe(user=self.user, title='omelette')
+        self.omelette.ingredients.add(self.salt, self.egg)
+        self.bread = sample_recipe(user=self.user, title='bread')
+        self.bread.ingredients.add(self.salt, self.flour)
+
+    def test_ingredients_merged(self):
+        """ Test each ingredient is listed once with its recipes """
+        response = self.client.post(
+            SHOPPING_LIST_URL, ids_body([self.omelette, self.bread]),
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [
+            {'ids': [self.egg.id], 'name': 'egg',
+             'recipes': [self.omelette.id]},
+            {'ids': [self.flour.id], 'name': 'flour',
+             'recipes': [self.bread.id]},
+            {'ids': [self.salt.id], 'name': 'salt',
+             'recipes': sorted([self.omelette.id, self.bread.id])},
+        ])
+
+    def test_spellings_merged(self):
+        """ Test ingredients with one catalog name are listed once """
+        other_salt = Ingredient.objects.create(user=self.user, name='Salt ')
+        self.bread.ingredients.add(other_salt)
+        with override_settings(INGREDIENT_CATALOG_ENABLED=False):
+            unlinked = Ingredient.objects.create(user=self.user, name='egg')
+        self.bread.ingredients.add(unlinked)
+
+        response = self.client.post(
+            SHOPPING_LIST_URL, ids_body([self.omelette, self.bread]),
+            format='json',
+        )
+
+        self.assertEqual(len(response.data), 4)
+        salt = next(
+            item for item in response.data if self.salt.id in item['ids']
+        )
+        self.assertEqual(salt['ids'], sorted([self.salt.id, other_salt.id]))
+        self.assertEqual(
+            salt['recipes'], sorted([self.omelette.id, self.bread.id])
+        )
+        self.assertCountEqual(
+            [item['ids'] for item in response.data if item['name'] == 'egg'],
+            [[self.egg.id], [unlinked.id]],
+        )
+
+    def test_only_selected_recipes(self):
+        """ Test ingredients of recipes not asked for are left out """
+        response = self.client.post(
+            SHOPPING_LIST_URL, ids_body([self.bread]), format='json'
+        )
+
+        self.assertEqual(
+            [ingredient['name'] for ingredient in response.data],
+            ['flour', 'salt'],
+        )
+
+    def test_limited_to_user(self):
+        """ Test recipes of other users are ignored """
+        other = get_user_model().objects.create_user(
+            email='other@gmail.com',
+            password='test_password',
+        )
+        recipe = sample_recipe(user=other)
+        recipe.ingredients.add(
+            Ingredient.objects.create(user=other, name='sugar')
+        )
+
+        response = self.client.post(
+            SHOPPING_LIST_URL, ids_body([recipe, self.omelette]),
+            format='json',
+        )
+
+        self.assertEqual(
+            [ingredient['name'] for ingredient in response.data],
+            ['egg', 'salt'],
+        )
+
+    def test_many_recipes_one_query(self):
+        """ Test hundreds of recipes are merged with a single query """
+        recipes = [sample_recipe(user=self.user) for _ in range(300)]
+        for recipe in recipes:
+            recipe.ingredients.add(self.egg)
+
+        with self.assertNumQueries(1):
+            response = self.client.post(
+                SHOPPING_LIST_URL, ids_body(recipes), format='json'
+            )
+
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data[0]['recipes']), 300)
+
+    def test_allowed_while_shard_moving(self):
+        """ Test the shopping list only reads and is not refused """
+        self.user.shard_moving = True
+        self.user.save()
+
+        response = self.client.post(
+            SHOPPING_LIST_URL, ids_body([self.bread]), format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_invalid_ids(self):
+        """ Test a list of at most 1000 recipe ids is required """
+        too_many = list(range(1 << 40, (1 << 40) + 1001))
+        for body in ({}, {'ids': []}, {'ids': [1, 'x']}, {'ids': [0]},
+                     {'ids': too_many}):
+            with self.subTest(body=body):
+                response = self.client.post(
+                    SHOPPING_LIST_URL, body, format='json'
+                )
+                self.assertEqual(
+                    response.status_code, status.HTTP_400_BAD_REQUEST
+                )
+
+        response = self.client.post(
+            SHOPPING_LIST_URL, {'ids': too_many[:1000]}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
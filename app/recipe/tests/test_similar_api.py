@@ -0,0 +1,124 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Tag, Ingredient, Recipe
+from core.similarity import IncidenceIndex
+
+
+def similar_url(recipe_id):
+    return reverse('recipe:recipes-similar', args=[recipe_id])
+
+
+def sample_recipe(user, **params):
+    defaults = {'title': 'test', 'time_minutes': 10, 'price': 5.00}
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class IncidenceIndexTests(TestCase):
+
+    def test_scores(self):
+        """ Test jaccard and cosine scores over tags and ingredients """
+        index = IncidenceIndex([
+            (1, [1], [1, 2]),
+            (2, [1], [1, 2]),
+            (3, [], [2, 3]),
+            (4, [2], [4]),
+        ])
+
+        self.assertEqual(index.similar(1), [(2, 1.0), (3, 0.25)])
+        self.assertEqual(
+            index.similar(3, metric='cosine'), [(1, 0.4082), (2, 0.4082)]
+        )
+        self.assertEqual(index.similar(4), [])
+        self.assertEqual(index.similar(99), [])
+
+    def test_canonical_ingredients_match(self):
+        """ Test ingredients sharing a catalog entry count as one feature """
+        index = IncidenceIndex(
+            [(1, [], [1]), (2, [], [2]), (3, [], [3, 4])],
+            canonical={1: 7, 2: 7, 3: 7, 4: 7},
+        )
+
+        self.assertEqual(index.similar(1), [(2, 1.0), (3, 1.0)])
+
+    def test_top_k(self):
+        """ Test only the k best matches are returned """
+        index = IncidenceIndex(
+            [(pk, [], [1, pk]) for pk in range(1, 21)]
+        )
+        self.assertEqual(len(index.similar(1, k=5)), 5)
+
+
+class PrivateSimilarAPITest(TestCase):
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user(
+            email='test@gmail.com',
+            password='test_password',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.salt = Ingredient.objects.create(user=self.user, name='salt')
+        self.egg = Ingredient.objects.create(user=self.user, name='egg')
+        self.recipe = sample_recipe(user=self.user, title='omelette')
+        self.recipe.ingredients.add(self.salt, self.egg)
+
+    def test_similar_recipes(self):
+        """ Test recipes are ranked by shared ingredients and tags """
+        close = sample_recipe(user=self.user, title='scrambled eggs')
+        close.ingredients.add(self.salt, self.egg)
+        far = sample_recipe(user=self.user, title='chips')
+        far.ingredients.add(self.salt)
+        sample_recipe(user=self.user, title='unrelated')
+
+        response = self.client.get(similar_url(self.recipe.id))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(item['id'], item['similarity']) for item in response.data],
+            [(close.id, 1.0), (far.id, 0.5)]
+        )
+
+    def test_similar_follows_changes(self):
+        """ Test the cached matrix is invalidated by relation changes """
+        other = sample_recipe(user=self.user)
+        self.assertEqual(self.client.get(similar_url(self.recipe.id)).data, [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other.tags.add(Tag.objects.create(user=self.user, name='vegan'))
+            other.ingredients.add(self.egg)
+        response = self.client.get(similar_url(self.recipe.id))
+
+        self.assertEqual(response.data[0]['id'], other.id)
+        self.assertEqual(response.data[0]['similarity'], 0.3333)
+
+    def test_similar_limited_to_user(self):
+        """ Test recipes of other users are neither matched nor visible """
+        user2 = get_user_model().objects.create_user(
+            email='test2@gmail.com',
+            password='test_password',
+        )
+        foreign = sample_recipe(user=user2)
+        foreign.ingredients.add(
+            Ingredient.objects.create(user=user2, name='salt')
+        )
+
+        self.assertEqual(self.client.get(similar_url(self.recipe.id)).data, [])
+        response = self.client.get(similar_url(foreign.id))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalid_metric(self):
+        """ Test unknown similarity metrics are rejected """
+        response = self.client.get(
+            similar_url(self.recipe.id), {'metric': 'euclid'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_k(self):
+        """ Test a non-numeric k is rejected """
+        response = self.client.get(similar_url(self.recipe.id), {'k': 'ten'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,144 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import stats
+from core.models import Tag, Ingredient, Recipe, RecipeStats
+
+STATS_URL = reverse('recipe:stats')
+
+
+def sample_recipe(user, **params):
+    defaults = {'title': 'test', 'time_minutes': 10, 'price': 5.00}
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class PublicStatsAPITest(TestCase):
+
+    def test_auth_required(self):
+        """ Test authentication is required for statistics """
+        response = APIClient().get(STATS_URL)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateStatsAPITest(TestCase):
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user(
+            email='test@gmail.com',
+            password='test_password',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def assertStatsConsistent(self):
+        incremental = RecipeStats.objects.get(user=self.user)
+        rebuilt = stats.rebuild_stats(self.user)
+        for field in ('recipe_count', 'price_total', 'time_total',
+                      'price_counts', 'time_counts', 'tag_counts',
+                      'ingredient_counts'):
+            self.assertEqual(
+                getattr(incremental, field), getattr(rebuilt, field), field
+            )
+
+    def test_retrieve_stats(self):
+        """ Test averages, percentiles and top tags are reported """
+        vegan = Tag.objects.create(user=self.user, name='vegan')
+        quick = Tag.objects.create(user=self.user, name='quick')
+        for price, minutes in [(1, 10), (2, 20), (3, 30), (10, 40)]:
+            recipe = sample_recipe(
+                user=self.user, price=price, time_minutes=minutes
+            )
+            recipe.tags.add(vegan)
+        recipe.tags.add(quick)
+
+        response = self.client.get(STATS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['recipe_count'], 4)
+        self.assertEqual(response.data['price']['average'], '4.00')
+        self.assertEqual(response.data['price']['p50'], '2.00')
+        self.assertEqual(response.data['price']['p90'], '10.00')
+        self.assertEqual(response.data['time_minutes']['average'], 25)
+        self.assertEqual(response.data['time_minutes']['p50'], 20)
+        self.assertEqual(response.data['top_tags'], [
+            {'id': vegan.id, 'name': 'vegan', 'count': 4},
+            {'id': quick.id, 'name': 'quick', 'count': 1},
+        ])
+
+    def test_stats_limited_to_user(self):
+        """ Test statistics only include the user's recipes """
+        user2 = get_user_model().objects.create_user(
+            email='test2@gmail.com',
+            password='test_password',
+        )
+        sample_recipe(user=user2)
+
+        response = self.client.get(STATS_URL)
+
+        self.assertEqual(response.data['recipe_count'], 0)
+        self.assertIsNone(response.data['price']['average'])
+
+    def test_stats_maintained_incrementally(self):
+        """ Test writes keep statistics equal to a full rebuild """
+        self.client.get(STATS_URL)
+        tag = Tag.objects.create(user=self.user, name='vegan')
+        salt = Ingredient.objects.create(user=self.user, name='salt')
+        recipe1 = sample_recipe(user=self.user, price=4.99)
+        recipe2 = sample_recipe(user=self.user, time_minutes=30)
+        recipe1.tags.add(tag)
+        recipe2.tags.add(tag)
+        recipe1.ingredients.add(salt)
+        self.assertStatsConsistent()
+
+        recipe2.price = 7.50
+        recipe2.save()
+        recipe1.tags.clear()
+        tag.recipe_set.add(recipe1)
+        self.assertStatsConsistent()
+
+        salt.delete()
+        recipe2.delete()
+        self.assertStatsConsistent()
+
+    def test_removing_unlinked_relations(self):
+        """ Test removing relations a recipe does not have counts nothing """
+        self.client.get(STATS_URL)
+        tag = Tag.objects.create(user=self.user, name='vegan')
+        recipe1 = sample_recipe(user=self.user)
+        recipe2 = sample_recipe(user=self.user)
+        recipe3 = sample_recipe(user=self.user)
+        recipe1.tags.add(tag)
+        recipe3.tags.add(tag)
+
+        recipe2.tags.remove(tag)
+        self.assertStatsConsistent()
+
+        tag.recipe_set.remove(recipe1, recipe2)
+        self.assertStatsConsistent()
+
+    def test_invalid_top(self):
+        """ Test a non-numeric top is rejected """
+        response = self.client.get(STATS_URL, {'top': 'ten'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rebuild_command(self):
+        """ Test the rebuild command recomputes statistics """
+        self.client.get(STATS_URL)
+        sample_recipe(user=self.user)
+        RecipeStats.objects.filter(user=self.user).update(recipe_count=0)
+
+        call_command(
+            'rebuild_recipe_stats', user=[self.user.email], stdout=StringIO()
+        )
+
+        self.assertEqual(
+            RecipeStats.objects.get(user=self.user).recipe_count, 1
+        )
@@ -0,0 +1,191 @@
+import time
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import bulk, sync
+from core.models import Tag, Ingredient, Recipe, Tombstone
+
+SYNC_URL = reverse('recipe:sync')
+
+
+def sample_recipe(user, **params):
+    defaults = {'title': 'test', 'time_minutes': 10, 'price': 5.00}
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class PublicSyncAPITest(TestCase):
+
+    def test_auth_required(self):
+        """ Test authentication is required to sync """
+        response = APIClient().get(SYNC_URL)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateSyncAPITest(TestCase):
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user(
+            email='test@gmail.com',
+            password='test_password',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.tag = Tag.objects.create(user=self.user, name='vegan')
+        self.recipe = sample_recipe(user=self.user)
+        self.recipe.tags.add(self.tag)
+
+    def sync(self, token=None):
+        params = {'since': token} if token else {}
+        response = self.client.get(SYNC_URL, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_initial_sync(self):
+        """ Test a client without token gets everything it owns """
+        other = get_user_model().objects.create_user(
+            email='other@gmail.com', password='test_password'
+        )
+        Tag.objects.create(user=other, name='other')
+
+        data = self.sync()
+
+        self.assertFalse(data['more'])
+        self.assertEqual([tag['name'] for tag in data['tags']], ['vegan'])
+        self.assertEqual(data['ingredients'], [])
+        self.assertEqual(data['recipes'][0]['tags'], [self.tag.id])
+        self.assertEqual(self.sync(data['token'])['recipes'], [])
+
+    def test_changes_since_token(self):
+        """ Test only rows changed after the token are returned """
+        token = self.sync()['token']
+        untouched = sample_recipe(user=self.user, title='untouched')
+        token = self.sync(token)['token']
+        ingredient = Ingredient.objects.create(user=self.user, name='salt')
+        self.recipe.ingredients.add(ingredient)
+
+        data = self.sync(token)
+
+        self.assertEqual([row['id'] for row in data['ingredients']],
+                         [ingredient.id])
+        self.assertEqual([row['id'] for row in data['recipes']],
+                         [self.recipe.id])
+        self.assertNotEqual(data['recipes'][0]['id'], untouched.id)
+        self.assertEqual(data['tags'], [])
+
+    def test_queryset_updates_tracked(self):
+        """ Test bulk updates bypassing save are numbered as changes """
+        token = self.sync()['token']
+        bulk.update_recipes(
+            Recipe.objects.filter(pk=self.recipe.pk), self.user.pk,
+            {'title': 'renamed'}, using='default',
+        )
+
+        data = self.sync(token)
+
+        self.assertEqual(data['recipes'][0]['title'], 'renamed')
+
+    def test_deletions_as_tombstones(self):
+        """ Test deleted rows are returned as ids """
+        token = self.sync()['token']
+        tag_id = self.tag.id
+        self.tag.delete()
+        bulk.delete_recipes(
+            Recipe.objects.filter(pk=self.recipe.pk), self.user.pk,
+            using='default',
+        )
+
+        data = self.sync(token)
+
+        self.assertEqual(data['deleted'], {
+            'tags': [tag_id],
+            'ingredients': [],
+            'recipes': [self.recipe.id],
+        })
+        self.assertEqual(data['recipes'], [])
+
+    def test_skip_change_tracking(self):
+        """ Test untracked deletions leave no tombstones, updates no number """
+        before = Recipe.objects.get(pk=self.recipe.pk).change_seq
+        with transaction.atomic():
+            sync.skip_change_tracking('default')
+            Recipe.objects.filter(pk=self.recipe.pk).update(title='new')
+            self.tag.delete()
+
+        self.assertEqual(
+            Recipe.objects.get(pk=self.recipe.pk).change_seq, before
+        )
+        self.assertFalse(Tombstone.objects.filter(model='tag').exists())
+
+    @override_settings(SYNC_PAGE_SIZE=2)
+    def test_paged_sync(self):
+        """ Test large change sets are sent in pages without gaps """
+        for index in range(4):
+            sample_recipe(user=self.user, title=f'recipe {index}')
+        Tag.objects.create(user=self.user, name='dessert').delete()
+
+        recipes, deleted, token, pages = set(), set(), None, 0
+        while True:
+            data = self.sync(token)
+            recipes.update(row['id'] for row in data['recipes'])
+            # rows after the end of a cut short page may come again
+            deleted.update(data['deleted']['tags'])
+            token, pages = data['token'], pages + 1
+            if not data['more']:
+                break
+
+        self.assertGreater(pages, 1)
+        self.assertEqual(
+            recipes, set(Recipe.objects.values_list('id', flat=True))
+        )
+        self.assertEqual(len(deleted), 1)
+
+    def test_invalid_and_expired_tokens(self):
+        """ Test malformed tokens are rejected and old ones expire """
+        expired = sync.make_token(1, time.time() - 31 * 24 * 60 * 60)
+
+        bad = self.client.get(SYNC_URL, {'since': 'abc'})
+        old = self.client.get(SYNC_URL, {'since': expired})
+
+        self.assertEqual(bad.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(old.status_code, status.HTTP_410_GONE)
+
+    def test_prune_tombstones(self):
+        """ Test tombstones older than the retention are deleted """
+        self.tag.delete()
+        Tombstone.objects.update(deleted_at='2000-01-01T00:00Z')
+        Recipe.objects.get().delete()
+        out = StringIO()
+
+        call_command('prune_tombstones', stdout=out)
+
+        self.assertIn('1 tombstones deleted', out.getvalue())
+        self.assertEqual(Tombstone.objects.get().model, 'recipe')
+
+    @patch('core.sync.time.time', return_value=1000.0)
+    def test_token_time_kept_while_paging(self, now):
+        """ Test a page cut short keeps the time the client was complete """
+        Tag.objects.create(user=self.user, name='dessert')
+        token = sync.make_token(sync.INITIAL_SEQ, 900)
+
+        _, _, next_token, more = sync.read_changes(
+            {'tags': Tag.objects.all()}, self.user, token, using='default',
+            limit=1,
+        )
+        _, _, last_token, last_more = sync.read_changes(
+            {'tags': Tag.objects.all()}, self.user, next_token,
+            using='default', limit=1,
+        )
+
+        self.assertTrue(more)
+        self.assertTrue(next_token.endswith('.900'))
+        self.assertFalse(last_more)
+        self.assertTrue(last_token.endswith('.1000'))
@@ -0,0 +1,124 @@
+import hashlib
+import os
+import struct
+from io import BytesIO
+
+from PIL import Image, UnidentifiedImageError
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions, status
+
+ALLOWED_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+
+# metadata such as EXIF may precede the image size in the header
+HEADER_LIMIT = 256 * 1024
+
+# room for multipart boundaries and the other form fields
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadTooLarge(exceptions.APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = _('Uploaded image is too large.')
+    default_code = 'upload_too_large'
+
+
+def sniff_image(header):
+    """
+    Return (format, width, height) read from the image header only, or
+    None while the header is incomplete or not an image.
+    """
+    try:
+        with Image.open(BytesIO(header)) as image:
+            return image.format, image.width, image.height
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError,
+            SyntaxError, ValueError, EOFError, struct.error):
+        return None
+
+
+class StreamingImageUploadHandler(FileUploadHandler):
+    """
+    Stream an uploaded image into a temporary file next to the media
+    storage, rejecting it as soon as it exceeds the size limit.
+
+    Format and dimensions are read from the header and the content hash
+    is computed while streaming, so memory use does not depend on the
+    file size and the image is never decoded.
+    """
+    chunk_size = 64 * 1024
+    field_name = 'image'
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.max_size = settings.RECIPE_IMAGE_MAX_UPLOAD_SIZE
+        self.max_dimension = settings.RECIPE_IMAGE_MAX_DIMENSION
+
+    def handle_raw_input(self, input_data, META, content_length, boundary,
+                         encoding=None):
+        """ Reject oversized requests before reading the body """
+        if content_length > self.max_size + MULTIPART_OVERHEAD:
+            raise UploadTooLarge()
+
+    def new_file(self, field_name, *args, **kwargs):
+        if field_name != self.field_name:
+            raise SkipFile()
+
+        super().new_file(field_name, *args, **kwargs)
+        os.makedirs(settings.FILE_UPLOAD_TEMP_DIR, exist_ok=True)
+        self.file = TemporaryUploadedFile(
+            self.file_name, self.content_type, 0, self.charset,
+            self.content_type_extra,
+        )
+        self.size = 0
+        self.header = b''
+        self.image_info = None
+        self.hash = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.size > self.max_size:
+            self.file.close()
+            raise UploadTooLarge()
+
+        if self.image_info is None:
+            self.header += raw_data
+            self._sniff(final=False)
+
+        self.hash.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        if self.image_info is None:
+            self._sniff(final=True)
+
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.content_hash = self.hash.hexdigest()
+        (self.file.image_format,
+         self.file.image_width,
+         self.file.image_height) = self.image_info
+        return self.file
+
+    def _sniff(self, final):
+        self.image_info = sniff_image(self.header)
+        if self.image_info is None:
+            if final or len(self.header) > HEADER_LIMIT:
+                self._reject(_('Upload a valid image. The file you uploaded '
+                               'was either not an image or a corrupted '
+                               'image.'))
+            return
+
+        image_format, width, height = self.image_info
+        self.header = b''
+        if image_format not in ALLOWED_FORMATS:
+            self._reject(_('Unsupported image format %(format)s.')
+                         % {'format': image_format})
+        if max(width, height) > self.max_dimension:
+            self._reject(_('Image dimensions must not exceed %(max)s px.')
+                         % {'max': self.max_dimension})
+
+    def _reject(self, message):
+        self.file.close()
+        raise exceptions.ValidationError({self.field_name: [message]})
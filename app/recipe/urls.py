@@ -10,5 +10,9 @@ router.register('recipes', views.RecipeAPIViewSet, basename='recipes')
 app_name = 'recipe'
 
 urlpatterns = [
+    path('stats/', views.RecipeStatsAPIView.as_view(), name='stats'),
+    path('sync/', views.RecipeSyncAPIView.as_view(), name='sync'),
+    path('events/ticket/', views.EventTicketAPIView.as_view(),
+         name='events-ticket'),
     path('', include(router.urls))
 ]
\ No newline at end of file
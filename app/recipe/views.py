@@ -1,13 +1,33 @@
+import os
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.http import FileResponse
+from django.utils.http import parse_etags, quote_etag
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework import viewsets, mixins, permissions, status
+from rest_framework import (viewsets, mixins, permissions, serializers,
+                            status, views)
 from rest_framework.authentication import TokenAuthentication
+from core import (bulk, cookable, events, fragments, search, shopping,
+                  similarity, stats, sync, tasks, variants)
+from core.media import signed_media_url
 from core.models import Tag, Ingredient, Recipe
+from core.sharding import shard_for_user
+from .permissions import IsShardWritable
+from .uploadhandlers import StreamingImageUploadHandler
 from .serializers import (TagSerializer,
                           IngredientSerializer,
                           RecipeSerializer,
+                          RecipeListSerializer,
+                          RecipeBulkSerializer,
                           RecipeDetailSerializer,
-                          RecipeImageSerializer)
+                          RecipeImageSerializer,
+                          RecipeFilterSerializer,
+                          ShoppingListSerializer,
+                          EXPANDABLE_RELATIONS)
 
 
 class BaseRecipeAttrAPIViewSet(viewsets.GenericViewSet,
@@ -15,14 +35,14 @@ class BaseRecipeAttrAPIViewSet(viewsets.GenericViewSet,
                                mixins.CreateModelMixin):
     """ Manage recipe attributes [tags, ingredients] """
     authentication_classes = [TokenAuthentication]
-    permission_classes = [permissions.IsAuthenticated]
+    permission_classes = [permissions.IsAuthenticated, IsShardWritable]
 
     def get_queryset(self):
         """ Return objects for current authenticated user only """
         assigned_only = bool(
             int(self.request.query_params.get('assigned_only', 0))
         )
-        queryset = self.queryset
+        queryset = self.queryset.using(shard_for_user(self.request.user))
         if assigned_only:
             queryset = queryset.filter(recipe__isnull=False).distinct()
         return queryset.filter(user=self.request.user).order_by('-name')
@@ -31,6 +51,38 @@ class BaseRecipeAttrAPIViewSet(viewsets.GenericViewSet,
         """ Assign user to a created attribute """
         serializer.save(user=self.request.user)
 
+    @action(methods=['GET'], detail=False)
+    def autocomplete(self, request):
+        """ Return the most used names starting with ?prefix= """
+        prefix = request.query_params.get('prefix', '')
+        try:
+            limit = int(request.query_params.get(
+                'limit', settings.AUTOCOMPLETE_LIMIT
+            ))
+        except ValueError:
+            limit = 0
+        if not prefix or not 1 <= limit <= settings.AUTOCOMPLETE_MAX_LIMIT:
+            return Response(
+                data={'detail': 'Provide a prefix and a limit from 1 to '
+                                f'{settings.AUTOCOMPLETE_MAX_LIMIT}.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        using = shard_for_user(request.user)
+        # usage counts are read from the statistics row
+        stats.get_stats(request.user, using=using)
+        matches = search.autocomplete(
+            self.queryset.model,
+            request.user.pk,
+            prefix,
+            limit,
+            using=using,
+        )
+        return Response(data=[
+            {'id': pk, 'name': name, 'uses': uses}
+            for pk, name, uses in matches
+        ])
+
 
 class TagAPIViewSet(BaseRecipeAttrAPIViewSet):
     """ Manage Tags """
@@ -43,11 +95,12 @@ class IngredientAPIViewSet(BaseRecipeAttrAPIViewSet):
     serializer_class = IngredientSerializer
     queryset = Ingredient.objects.all()
 
+
 class RecipeAPIViewSet(viewsets.ModelViewSet):
     serializer_class = RecipeSerializer
     queryset = Recipe.objects.all()
     authentication_classes = [TokenAuthentication]
-    permission_classes = [permissions.IsAuthenticated]
+    permission_classes = [permissions.IsAuthenticated, IsShardWritable]
 
     def _params_to_int(self, qs):
         """ Convert list of string IDs to integers """
@@ -56,25 +109,93 @@ class RecipeAPIViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         tags = self.request.query_params.get('tags')
         ingredients = self.request.query_params.get('ingredients')
-        queryset = self.queryset
+        queryset = self.queryset.using(shard_for_user(self.request.user))
         if tags:
             tag_ids = self._params_to_int(tags)
-            queryset = queryset.filter(tags__id__in=tag_ids)
+            queryset = queryset.filter(summary__tag_ids__overlap=tag_ids)
 
         if ingredients:
             ingredients_ids = self._params_to_int(ingredients)
-            queryset = queryset.filter(ingredients__id__in=ingredients_ids)
+            queryset = queryset.filter(
+                summary__ingredient_ids__overlap=ingredients_ids
+            )
+
+        if self.action in ('list', 'similar', 'cookable'):
+            queryset = queryset.select_related('summary')
+        queryset = queryset.filter(user=self.request.user).order_by('-id')
+        if self.action == 'list':
+            filters = RecipeFilterSerializer(data=self.request.query_params)
+            filters.is_valid(raise_exception=True)
+            queryset = filters.filter(queryset)
 
-        return queryset.filter(user=self.request.user).order_by('-id')
+        return queryset
 
     def get_serializer_class(self):
         """ Return appropriate serializer class """
-        if self.action == "retrieve":
+        if self.action in ("list", "similar", "cookable"):
+            return RecipeListSerializer
+        elif self.action == "retrieve":
             return RecipeDetailSerializer
         elif self.action == "upload_image":
             return RecipeImageSerializer
+        elif self.action == "bulk":
+            return RecipeBulkSerializer
         return self.serializer_class
 
+    def _expand(self):
+        """ Return the relations named by the ?expand= parameter """
+        expand = [
+            name for name in
+            self.request.query_params.get('expand', '').split(',') if name
+        ]
+        unknown = set(expand) - set(EXPANDABLE_RELATIONS)
+        if unknown:
+            raise serializers.ValidationError({'expand': [
+                f'Must be a list of {", ".join(EXPANDABLE_RELATIONS)}.'
+            ]})
+        return expand
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action == 'list':
+            kwargs['expand'] = self._expand()
+        return super().get_serializer(*args, **kwargs)
+
+    def _fragment_variant(self):
+        """ Name the representation of this action for the fragment cache """
+        variant = self.action
+        if self.action == 'list':
+            variant += '.' + '+'.join(sorted(self._expand()))
+        # image urls are absolute
+        return f'{variant}@{self.request.build_absolute_uri("/")}'
+
+    def _serialize(self, recipes):
+        if self.action == 'list':
+            # one query per expanded relation for the recipes not cached
+            prefetch_related_objects(recipes, *self._expand())
+        return self.get_serializer(recipes, many=True).data
+
+    def _render(self, recipes):
+        return fragments.render(
+            recipes, self._serialize, self._fragment_variant()
+        )
+
+    def list(self, request, *args, **kwargs):
+        """ List recipes, serializing only those changed since cached """
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self._render(page))
+        return Response(self._render(queryset))
+
+    def retrieve(self, request, *args, **kwargs):
+        recipe = self.get_object()
+        return Response(self._render([recipe])[0])
+
+    def perform_content_negotiation(self, request, force=False):
+        # image variants pick their format from the Accept header themselves
+        force = force or self.action == 'image'
+        return super().perform_content_negotiation(request, force=force)
+
     def perform_create(self, serializer):
         """ Assign a user to a new recipe """
         serializer.save(user=self.request.user)
@@ -82,6 +203,7 @@ class RecipeAPIViewSet(viewsets.ModelViewSet):
     @action(methods=['POST'], detail=True, url_path='upload-image')
     def upload_image(self, request, pk=None):
         """ Upload an image to a recipe """
+        request.upload_handlers = [StreamingImageUploadHandler(request)]
         recipe = self.get_object()
         serializer = self.get_serializer(
             recipe,
@@ -89,7 +211,13 @@ class RecipeAPIViewSet(viewsets.ModelViewSet):
         )
 
         if serializer.is_valid():
-            serializer.save()
+            recipe = serializer.save()
+            if recipe.image:
+                transaction.on_commit(
+                    partial(tasks.render_image_variants.delay,
+                            recipe.image.name),
+                    using=shard_for_user(request.user),
+                )
             return Response(
                 data=serializer.data,
                 status=status.HTTP_200_OK
@@ -100,3 +228,276 @@ class RecipeAPIViewSet(viewsets.ModelViewSet):
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    @action(methods=['PATCH', 'DELETE'], detail=False)
+    def bulk(self, request):
+        """ Update or delete recipes selected by ids or tag filters """
+        serializer = self.get_serializer(data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        values = dict(serializer.validated_data)
+        ids = values.pop('ids', None)
+        if ids is None and not (request.query_params.get('tags') or
+                                request.query_params.get('ingredients')):
+            return Response(
+                data={'ids': ['Provide ids or a tags or ingredients filter.']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        queryset = self.get_queryset()
+        if ids is not None:
+            queryset = queryset.filter(id__in=ids)
+        using = shard_for_user(request.user)
+
+        if request.method == 'DELETE':
+            deleted = bulk.delete_recipes(
+                queryset, request.user.pk, using=using
+            )
+            return Response(data={'deleted': deleted})
+
+        if not values:
+            return Response(
+                data={'non_field_errors': [
+                    f'Provide at least one of {", ".join(bulk.BULK_FIELDS)}.'
+                ]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        updated = bulk.update_recipes(
+            queryset, request.user.pk, values, using=using
+        )
+        return Response(data={'updated': updated})
+
+    @action(methods=['GET'], detail=True)
+    def image(self, request, pk=None):
+        """ Return the recipe image resized in the best accepted format """
+        recipe = self.get_object()
+        if not recipe.image or not os.path.isfile(recipe.image.path):
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        try:
+            width = int(request.query_params.get(
+                'width', max(settings.RECIPE_IMAGE_WIDTHS)
+            ))
+        except ValueError:
+            width = 0
+        if width < 1:
+            return Response(
+                data={'width': ['A positive integer is required.']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        width = variants.variant_width(width)
+        image_format, ext = variants.negotiate_format(
+            request.META.get('HTTP_ACCEPT'), recipe.image.name
+        )
+        try:
+            key = variants.variant_key(
+                recipe.image.name, recipe.image.path, width, ext
+            )
+            etag = quote_etag(key)
+            if etag in parse_etags(
+                request.META.get('HTTP_IF_NONE_MATCH', '')
+            ):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                response = FileResponse(
+                    variants.get_variant(
+                        key, recipe.image.path, width, image_format
+                    ),
+                    content_type=f'image/{image_format.lower()}',
+                )
+        except variants.SourceUnreadable:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        except variants.VariantUnavailable:
+            response = Response(
+                data={'detail': 'The image is being resized, retry shortly.'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+            response['Retry-After'] = '1'
+            return response
+        response['ETag'] = etag
+        response['Vary'] = 'Accept, Authorization'
+        response['Cache-Control'] = (
+            f'private, max-age={settings.MEDIA_CACHE_MAX_AGE}'
+        )
+        return response
+
+    @action(methods=['GET'], detail=True, url_path='image-url')
+    def image_url(self, request, pk=None):
+        """ Return a short-lived URL of the recipe image for <img> tags """
+        recipe = self.get_object()
+        if not recipe.image:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response(data={
+            'url': request.build_absolute_uri(
+                signed_media_url(request.user, recipe.image.name)
+            ),
+            'expires_in': settings.MEDIA_SIGNED_URL_MAX_AGE,
+        })
+
+    @action(methods=['GET'], detail=True)
+    def similar(self, request, pk=None):
+        """ Return the user's recipes sharing most tags and ingredients """
+        recipe = self.get_object()
+        try:
+            k = min(max(int(request.query_params.get('k', 10)), 1), 100)
+        except ValueError:
+            return Response(
+                data={'k': ['A valid integer is required.']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        metric = request.query_params.get('metric', 'jaccard')
+        if metric not in similarity.METRICS:
+            return Response(
+                data={'metric': [f'Must be one of {similarity.METRICS}']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        index = similarity.get_index(
+            request.user.pk, using=shard_for_user(request.user)
+        )
+        scored = index.similar(recipe.pk, k=k, metric=metric)
+        recipes = self.get_queryset().in_bulk([pk for pk, _ in scored])
+
+        data = []
+        for recipe_id, score in scored:
+            if recipe_id in recipes:
+                item = self.get_serializer(recipes[recipe_id]).data
+                item['similarity'] = score
+                data.append(item)
+        return Response(data=data, status=status.HTTP_200_OK)
+
+    @action(methods=['GET'], detail=False)
+    def cookable(self, request):
+        """ Return recipes that can be cooked with the given ingredients """
+        ingredients = request.query_params.get('ingredients')
+        if not ingredients:
+            return Response(
+                data={'ingredients': ['This query parameter is required.']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            have = set(self._params_to_int(ingredients))
+            max_missing = min(max(int(request.query_params.get(
+                'missing', cookable.MAX_MISSING
+            )), 0), cookable.MAX_MISSING)
+            limit = min(max(
+                int(request.query_params.get('limit', 50)), 1
+            ), 500)
+        except ValueError:
+            return Response(
+                data={'detail': 'ingredients, missing and limit must be '
+                                'integers.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        index = cookable.get_index(
+            request.user.pk, using=shard_for_user(request.user)
+        )
+        results = index.search(have, max_missing=max_missing)[:limit]
+        recipes = self.get_queryset().in_bulk([pk for pk, _, _ in results])
+
+        data = []
+        for recipe_id, _, coverage in results:
+            if recipe_id in recipes:
+                item = self.get_serializer(recipes[recipe_id]).data
+                item['missing'] = [
+                    pk for pk in item['ingredients'] if pk not in have
+                ]
+                item['coverage'] = coverage
+                data.append(item)
+        return Response(data=data, status=status.HTTP_200_OK)
+
+    # the recipe ids are posted, as hundreds of them do not fit in a URL.
+    # It only reads, so it stays open while the user's data is moved.
+    @action(methods=['POST'], detail=False, url_path='shopping-list',
+            permission_classes=[permissions.IsAuthenticated])
+    def shopping_list(self, request):
+        """ Return the ingredients of the given recipes, each listed once """
+        query = ShoppingListSerializer(data=request.data)
+        query.is_valid(raise_exception=True)
+        rows = shopping.shopping_list(
+            request.user.pk,
+            query.validated_data['ids'],
+            using=shard_for_user(request.user),
+        )
+        data = [
+            {'ids': ingredient_ids, 'name': name, 'recipes': recipe_ids}
+            for ingredient_ids, name, recipe_ids in rows
+        ]
+        return Response(data=data, status=status.HTTP_200_OK)
+
+
+class RecipeStatsAPIView(views.APIView):
+    """ Dashboard statistics of the authenticated user's recipes """
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        db = shard_for_user(request.user)
+        recipe_stats = stats.get_stats(request.user, using=db)
+
+        try:
+            top = min(max(int(request.query_params.get('top', 5)), 1), 50)
+        except ValueError:
+            return Response(
+                data={'top': ['A valid integer is required.']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(
+            stats.describe_stats(recipe_stats, top=top, using=db)
+        )
+
+
+class EventTicketAPIView(views.APIView):
+    """ Short-lived ticket opening the change event stream """
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        return Response(data={
+            'ticket': events.issue_ticket(request.user),
+            'expires_in': settings.EVENTS_TICKET_MAX_AGE,
+        })
+
+
+class RecipeSyncAPIView(views.APIView):
+    """ Tags, ingredients and recipes changed since a sync token """
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        db = shard_for_user(request.user)
+        try:
+            changed, tombstones, token, more = sync.read_changes({
+                'tags': Tag.objects.using(db).filter(user=request.user),
+                'ingredients': Ingredient.objects.using(db).filter(
+                    user=request.user
+                ),
+                'recipes': Recipe.objects.using(db).filter(
+                    user=request.user
+                ).select_related('summary'),
+            }, request.user, request.query_params.get('since'), using=db)
+        except ValueError:
+            return Response(
+                data={'since': ['Invalid sync token.']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except sync.TokenExpired:
+            return Response(
+                data={'detail': 'Sync token expired, sync everything again.'},
+                status=status.HTTP_410_GONE
+            )
+
+        deleted = {'tags': [], 'ingredients': [], 'recipes': []}
+        for tombstone in tombstones:
+            deleted[f'{tombstone.model}s'].append(tombstone.object_id)
+        return Response({
+            'token': token,
+            'more': more,
+            'tags': TagSerializer(changed['tags'], many=True).data,
+            'ingredients': IngredientSerializer(
+                changed['ingredients'], many=True
+            ).data,
+            'recipes': RecipeListSerializer(
+                changed['recipes'], many=True
+            ).data,
+            'deleted': deleted,
+        })
@@ -3,6 +3,7 @@ from django.contrib.auth import get_user_model
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
+from core.models import Task, UserPurge
 
 CREATE_USER_URL = reverse('user:create')
 TOKEN_URL = reverse('user:token')
@@ -120,3 +121,17 @@ class PrivateUserAPITest(TestCase):
         self.assertEqual(self.user.name, payload.get('name'))
         self.assertTrue(self.user.check_password(payload.get('password')))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_delete_account(self):
+        """ Test deleting the account deactivates it and schedules a purge """
+        response = self.client.delete(USER_URL)
+
+        self.user.refresh_from_db()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertFalse(self.user.is_active)
+        self.assertTrue(
+            UserPurge.objects.filter(user_id=self.user.pk).exists()
+        )
+        self.assertEqual(
+            Task.objects.get().args, [self.user.pk]
+        )
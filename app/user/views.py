@@ -1,4 +1,8 @@
-from rest_framework import generics, authentication, permissions
+from django.db import transaction
+from rest_framework import generics, authentication, permissions, status
+from rest_framework.response import Response
+from core import purge, tasks
+from core.sharding import global_database
 from .serializers import UserSerializer, AuthTokenSerializer
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.settings import api_settings
@@ -14,7 +18,7 @@ class CreateAuthTokenView(ObtainAuthToken):
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
 
 
-class ManageUserView(generics.RetrieveUpdateAPIView):
+class ManageUserView(generics.RetrieveUpdateDestroyAPIView):
     """ Manage authenticated user profile """
     serializer_class = UserSerializer
     authentication_classes = [authentication.TokenAuthentication]
@@ -23,3 +27,11 @@ class ManageUserView(generics.RetrieveUpdateAPIView):
     def get_object(self):
         """ Retrieve and return authenticated user profile """
         return self.request.user
+
+    def destroy(self, request, *args, **kwargs):
+        """ Deactivate the account and purge its data in the background """
+        user = self.get_object()
+        with transaction.atomic(using=global_database()):
+            purge.request_purge(user)
+            tasks.purge_user.delay(user.pk)
+        return Response(status=status.HTTP_202_ACCEPTED)